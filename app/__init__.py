@@ -6,18 +6,23 @@ from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 from flask_migrate import Migrate
+from werkzeug.middleware.proxy_fix import ProxyFix
 from .config import Config
-from flask_session_captcha import FlaskSessionCaptcha
+from .captcha_pool import PooledSessionCaptcha
+from . import sessions
 
 db = SQLAlchemy()
 migrate = Migrate()
 login = LoginManager()
-captcha = FlaskSessionCaptcha()
+captcha = PooledSessionCaptcha()
 
-def create_app():
+def create_app(config_class=Config):
     """Create and configure the Flask application."""""
     app = Flask(__name__)
-    app.config.from_object(Config)
+    app.config.from_object(config_class)
+    if app.config['PROXY_FIX_X_FOR']:
+        proxies = app.config['PROXY_FIX_X_FOR']
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxies, x_proto=proxies)
 
     # Enable debug mode on development servers
     if socket.gethostname().startswith(Config.DEVELOPMENT_SERVER):
@@ -29,8 +34,12 @@ def create_app():
     login.init_app(app)
     login.login_view = 'login'
     captcha.init_app(app)
+    sessions.init_app(app)
 
     with app.app_context():
-        from app import routes, models
+        from app import routes, models, identity, stats, table_versions
+
+    from app import cli
+    cli.register(app)
 
     return app
\ No newline at end of file
@@ -0,0 +1,176 @@
+# app/attendance_analytics.py
+"""
+This module computes a class batch's attendance report with NumPy.
+
+``AttendanceMatrix.load()`` reads the batch's UserAttendance rows with one
+query into students x sessions arrays: an int8 status code (mapped from the
+status letter in SQL), and the late and left-early minutes (NaN when not
+recorded). The batch's ClassSessions are the columns, in date order. The
+rows are the batch's roster (StudentGroup) plus anyone else with marks in
+it, so enrolled students who were never marked are reported too. A student
+not marked for a session has UNMARKED there.
+
+``summarize()`` works on whole arrays:
+- the attendance rate per student and per session: P and L count as
+  attended, A as missed, E and UNMARKED not at all;
+- the lateness and left-early distributions (percentiles and histogram);
+- the longest and the current run of absences per student (E and UNMARKED
+  sessions neither break nor extend a run);
+- the at-risk students: rate below ``ATTENDANCE_AT_RISK_RATE``, or a current
+  run of at least ``ATTENDANCE_AT_RISK_STREAK`` absences.
+"""
+import itertools
+import numpy as np
+import sqlalchemy as sa
+from flask import current_app
+from app import db
+import app.models as mo
+
+UNMARKED, PRESENT, LATE, ABSENT, EXCUSED = -1, 0, 1, 2, 3
+# AttendanceStatusLookup.status -> code; other letters count as absent
+STATUS_CODES = {'P': PRESENT, 'L': LATE, 'A': ABSENT, 'E': EXCUSED}
+# Histogram bin edges in minutes; the last bin is open ended
+MINUTE_BINS = (1, 5, 10, 15, 30, 60)
+PERCENTILES = (50, 75, 90)
+
+
+class AttendanceMatrix:
+    """A batch's attendance as students x sessions arrays."""
+
+    def __init__(self, user_ids, session_ids, dates, status, late, left_early):
+        self.user_ids = user_ids
+        self.session_ids = session_ids
+        self.dates = dates
+        self.status = status
+        self.late = late
+        self.left_early = left_early
+
+    @classmethod
+    def from_rows(cls, sessions, rows, roster=()):
+        """Build from (id, class_date) sessions in date order, (user_id, class_session_id, status code,
+        late, left early) rows, with -1 minutes when not recorded, and the user ids of the roster."""
+        session_ids = np.array([session_id for session_id, _ in sessions], np.int64)
+        dates = np.array([class_date for _, class_date in sessions], 'datetime64[D]')
+        values = np.fromiter(itertools.chain.from_iterable(rows), np.int64, count=5 * len(rows)).reshape(-1, 5)
+        user_ids = np.union1d(np.fromiter(roster, np.int64), values[:, 0])
+        row = np.searchsorted(user_ids, values[:, 0])
+        by_id = np.argsort(session_ids)
+        col = by_id[np.searchsorted(session_ids, values[:, 1], sorter=by_id)]
+        shape = (len(user_ids), len(session_ids))
+        status = np.full(shape, UNMARKED, np.int8)
+        status[row, col] = values[:, 2]
+        minutes = []
+        for column in (3, 4):
+            matrix = np.full(shape, np.nan, np.float32)
+            matrix[row, col] = np.where(values[:, column] < 0, np.nan, values[:, column])
+            minutes.append(matrix)
+        return cls(user_ids, session_ids, dates, status, *minutes)
+
+    @classmethod
+    def load(cls, class_batch_id):
+        """Load the attendance of a class batch: one query each for the marks, the session dates and the roster."""
+        sessions = db.session.execute(
+            sa.select(mo.ClassSession.id, mo.ClassSession.class_date)
+            .where(mo.ClassSession.class_batch_id == class_batch_id)
+            .order_by(mo.ClassSession.class_date, mo.ClassSession.id)).all()
+        # Codes and minutes come out as plain ints, so the rows convert to an array in one pass. The
+        # Core connection skips the ORM result wrapping, which costs more than the query here.
+        code = sa.case(STATUS_CODES, value=mo.AttendanceStatusLookup.status, else_=ABSENT)
+        rows = db.session.connection().execute(
+            sa.select(mo.UserAttendance.user_id, mo.UserAttendance.class_session_id, code,
+                      sa.func.coalesce(mo.UserAttendance.late_by_min, -1),
+                      sa.func.coalesce(mo.UserAttendance.left_early_by_min, -1))
+            .join(mo.ClassSession, mo.ClassSession.id == mo.UserAttendance.class_session_id)
+            .join(mo.AttendanceStatusLookup, mo.AttendanceStatusLookup.id == mo.UserAttendance.attendance_status_id)
+            .where(mo.ClassSession.class_batch_id == class_batch_id)).all()
+        roster = db.session.scalars(
+            sa.select(mo.StudentGroup.user_id).distinct()
+            .join(mo.ClassGroup, mo.ClassGroup.id == mo.StudentGroup.class_group_id)
+            .join(mo.ClassRegion, mo.ClassRegion.id == mo.ClassGroup.class_region_id)
+            .where(mo.ClassRegion.class_batch_id == class_batch_id)).all()
+        return cls.from_rows(sessions, rows, roster)
+
+
+def _rate(attended, counted):
+    return np.divide(attended, counted, out=np.full(attended.shape, np.nan), where=counted > 0)
+
+
+def absence_runs(attended, absent):
+    """(longest, current) runs of absent per row; cells in neither mask are skipped."""
+    n_rows, n_cols = absent.shape
+    # Cells after the same number of attended sessions belong to the same run.
+    run = np.cumsum(attended, axis=1)
+    current = (absent & (run == run[:, -1:])).sum(axis=1) if n_cols else np.zeros(n_rows, np.int64)
+    # Absent cells in row-major order have non-decreasing keys, so runs are contiguous.
+    keys = (np.arange(n_rows)[:, None] * (n_cols + 1) + run)[absent]
+    longest = np.zeros(n_rows, np.int64)
+    if len(keys):
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+        lengths = np.diff(np.r_[starts, len(keys)])
+        np.maximum.at(longest, keys[starts] // (n_cols + 1), lengths)
+    return longest, current
+
+
+def distribution(minutes):
+    """Percentiles and histogram of the positive, recorded minutes."""
+    values = minutes[minutes > 0]
+    counts = np.histogram(values, bins=(*MINUTE_BINS, np.inf))[0] if len(values) else np.zeros(len(MINUTE_BINS), int)
+    labels = [f'{low}-{high - 1}' for low, high in zip(MINUTE_BINS, MINUTE_BINS[1:])] + [f'{MINUTE_BINS[-1]}+']
+    return {
+        'count': int(len(values)),
+        'mean': round(float(values.mean()), 1) if len(values) else None,
+        'percentiles': {p: float(v) for p, v in zip(PERCENTILES, np.percentile(values, PERCENTILES))}
+        if len(values) else {},
+        'histogram': list(zip(labels, counts.tolist())),
+    }
+
+
+def summarize(matrix, at_risk_rate, at_risk_streak):
+    """The report of an AttendanceMatrix, as plain Python values."""
+    status = matrix.status
+    attended = (status == PRESENT) | (status == LATE)
+    absent = status == ABSENT
+    counted = attended | absent
+    n_attended = attended.sum(axis=1)
+    n_counted = counted.sum(axis=1)
+    rate = _rate(n_attended, n_counted)
+    session_rate = _rate(attended.sum(axis=0), counted.sum(axis=0))
+    longest, current = absence_runs(attended, absent)
+    late = matrix.late > 0
+    n_late = late.sum(axis=1)
+    late_minutes = np.where(late, matrix.late, 0).sum(axis=1)
+    n_left_early = (matrix.left_early > 0).sum(axis=1)
+    at_risk = (n_counted > 0) & ((rate < at_risk_rate) | (current >= at_risk_streak))
+    risky = np.flatnonzero(at_risk)
+    risky = risky[np.lexsort((-current[risky], rate[risky]))]
+    total = int(n_counted.sum())
+    students = [
+        {'user_id': int(user_id), 'attended': int(a), 'counted': int(c),
+         'rate': None if np.isnan(r) else round(float(r), 4), 'late': int(nl),
+         'mean_late': round(float(lm / nl), 1) if nl else None, 'left_early': int(ne),
+         'longest_absence': int(lo), 'current_absence': int(cu), 'at_risk': bool(risk)}
+        for user_id, a, c, r, nl, lm, ne, lo, cu, risk in zip(
+            matrix.user_ids, n_attended, n_counted, rate, n_late, late_minutes, n_left_early, longest, current,
+            at_risk)]
+    return {
+        'students': students,
+        'sessions': [{'session_id': int(session_id), 'date': str(date),
+                      'rate': None if np.isnan(r) else round(float(r), 4)}
+                     for session_id, date, r in zip(matrix.session_ids, matrix.dates, session_rate)],
+        'overall_rate': round(int(n_attended.sum()) / total, 4) if total else None,
+        'lateness': distribution(matrix.late),
+        'left_early': distribution(matrix.left_early),
+        'at_risk': [int(i) for i in matrix.user_ids[risky]],
+    }
+
+
+def report(class_batch_id):
+    """The attendance report of a class batch, with usernames."""
+    config = current_app.config
+    result = summarize(AttendanceMatrix.load(class_batch_id),
+                       config['ATTENDANCE_AT_RISK_RATE'], config['ATTENDANCE_AT_RISK_STREAK'])
+    names = dict(db.session.execute(sa.select(mo.User.id, mo.User.username).where(
+        mo.User.id.in_([student['user_id'] for student in result['students']]))).all())
+    for student in result['students']:
+        student['username'] = names.get(student['user_id'])
+    return result
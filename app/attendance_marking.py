@@ -0,0 +1,118 @@
+# app/attendance_marking.py
+"""
+This module records a ClassSession's attendance for a whole roster at once.
+
+``roster()`` lists the students of the session's batch (narrowed to the
+marker's scope) with their current marks, in one query. ``parse_marks()``
+reads one status, late and left-early value per roster student from the
+submitted sheet. A student whose status is left blank keeps their current
+mark. ``save_marks()`` writes the marks with one multi-row
+INSERT ... ON CONFLICT (user_id, class_session_id) DO UPDATE, so a
+300-student sheet is one statement in one transaction.
+"""
+from datetime import datetime, timezone
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql, sqlite
+from app import db
+import app.models as mo
+
+Attendance = mo.UserAttendance.__table__
+MAX_MINUTES = 600
+# SQLite binds at most 32766 parameters per statement; larger sheets are split.
+MAX_PARAMETERS = 32766
+
+
+def _dialect():
+    return postgresql if db.session.get_bind().dialect.name == 'postgresql' else sqlite
+
+
+def open_session(class_batch_id, class_date, teacher_id):
+    """The id of the batch's ClassSession on class_date, created if missing."""
+    stmt = _dialect().insert(mo.ClassSession.__table__).values(
+        class_batch_id=class_batch_id, class_date=class_date, teacher_id=teacher_id,
+        created_by=teacher_id, updated_by=teacher_id)
+    db.session.execute(stmt.on_conflict_do_nothing(index_elements=['class_date', 'class_batch_id']))
+    return db.session.scalar(sa.select(mo.ClassSession.id).where(
+        mo.ClassSession.class_batch_id == class_batch_id, mo.ClassSession.class_date == class_date))
+
+
+def roster(class_session, condition=sa.true()):
+    """The batch's students with their marks for class_session, as rows of
+    (user_id, username, group, index_no, status, late_by_min, left_early_by_min).
+
+    A student in several groups of the batch is listed once, in the lowest group id.
+    """
+    first = (sa.select(mo.StudentGroup.user_id, sa.func.min(mo.StudentGroup.class_group_id).label('group_id'))
+             .join(mo.ClassGroup, mo.ClassGroup.id == mo.StudentGroup.class_group_id)
+             .join(mo.ClassRegion, mo.ClassRegion.id == mo.ClassGroup.class_region_id)
+             .where(mo.ClassRegion.class_batch_id == class_session.class_batch_id, condition)
+             .group_by(mo.StudentGroup.user_id).subquery())
+    return db.session.execute(
+        sa.select(mo.User.id, mo.User.username, mo.ClassGroup.name, mo.StudentGroup.index_no,
+                  mo.AttendanceStatusLookup.status, mo.UserAttendance.late_by_min,
+                  mo.UserAttendance.left_early_by_min)
+        .select_from(first)
+        .join(mo.User, mo.User.id == first.c.user_id)
+        .join(mo.ClassGroup, mo.ClassGroup.id == first.c.group_id)
+        .join(mo.StudentGroup, sa.and_(mo.StudentGroup.user_id == first.c.user_id,
+                                       mo.StudentGroup.class_group_id == first.c.group_id))
+        .outerjoin(mo.UserAttendance, sa.and_(mo.UserAttendance.user_id == mo.User.id,
+                                              mo.UserAttendance.class_session_id == class_session.id))
+        .outerjoin(mo.AttendanceStatusLookup,
+                   mo.AttendanceStatusLookup.id == mo.UserAttendance.attendance_status_id)
+        .order_by(mo.ClassGroup.name, mo.StudentGroup.index_no, mo.User.id)).all()
+
+
+def statuses():
+    """{status letter: AttendanceStatusLookup id}, in id order."""
+    return dict(db.session.execute(sa.select(mo.AttendanceStatusLookup.status, mo.AttendanceStatusLookup.id)
+                                   .order_by(mo.AttendanceStatusLookup.id)).all())
+
+
+def _minutes(value):
+    if not value:
+        return None
+    minutes = int(value)
+    if not 0 <= minutes <= MAX_MINUTES:
+        raise ValueError
+    return minutes
+
+
+def parse_marks(form, user_ids, status_ids):
+    """([{user_id, attendance_status_id, late_by_min, left_early_by_min}], {user_id: error}) from
+    the form fields status-<id>, late-<id> and left-<id> of the given user ids."""
+    marks, errors = [], {}
+    for user_id in dict.fromkeys(user_ids):
+        status = form.get(f'status-{user_id}', '').strip()
+        if not status:
+            continue
+        if status not in status_ids:
+            errors[user_id] = f'Unknown status {status!r}.'
+            continue
+        try:
+            late, left = _minutes(form.get(f'late-{user_id}')), _minutes(form.get(f'left-{user_id}'))
+        except ValueError:
+            errors[user_id] = f'Minutes must be whole numbers from 0 to {MAX_MINUTES}.'
+            continue
+        marks.append({'user_id': user_id, 'attendance_status_id': status_ids[status],
+                      'late_by_min': late, 'left_early_by_min': left})
+    return marks, errors
+
+
+def save_marks(class_session_id, marks, marked_by):
+    """Insert or update marks for class_session_id with one upsert statement (per MAX_PARAMETERS)."""
+    if not marks:
+        return 0
+    now = datetime.now(timezone.utc)
+    # One row per user: PostgreSQL rejects an upsert that affects the same row twice.
+    by_user = {mark['user_id']: mark for mark in marks}
+    rows = [{**mark, 'class_session_id': class_session_id, 'created_by': marked_by, 'created_at': now,
+             'updated_by': marked_by, 'updated_at': now} for mark in by_user.values()]
+    per_statement = MAX_PARAMETERS // len(rows[0])
+    for start in range(0, len(rows), per_statement):
+        stmt = _dialect().insert(Attendance).values(rows[start:start + per_statement])
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=[Attendance.c.user_id, Attendance.c.class_session_id],
+            set_={name: stmt.excluded[name] for name in
+                  ('attendance_status_id', 'late_by_min', 'left_early_by_min', 'updated_by', 'updated_at')}))
+    return len(rows)
@@ -0,0 +1,165 @@
+# app/authz.py
+"""
+This module decides what a user may do, from their UserRole rows.
+
+Each Role name maps to a set of ``Perm`` bits (``ROLE_PERMISSIONS``). A
+UserRole without a class batch/region/group grants its role's bits
+everywhere. A UserRole with one of them grants the bits only within its
+most specific scope (group, else region, else batch).
+
+``Grants`` holds the result: one int of global bits, plus, per bit granted
+only in some scopes, the frozensets of batch, region and group ids. It is
+built from the roles of the cached user (app/identity.py). It is therefore
+computed once per user and dropped when their UserRole rows or any Role
+change. ``can()`` is a few bit and set operations. ``filter()`` turns the
+same grants into a SQL condition for listing queries.
+"""
+import enum
+from collections import namedtuple
+from functools import wraps
+import sqlalchemy as sa
+from flask import flash, redirect, url_for
+from flask_login import current_user
+from app.identity import user_cache
+
+
+class Perm(enum.IntFlag):
+    VIEW_STUDENTS = enum.auto()
+    REGISTER_STUDENTS = enum.auto()
+    TAKE_ATTENDANCE = enum.auto()
+    ENTER_SCORES = enum.auto()
+    VIEW_REPORTS = enum.auto()
+    MANAGE_CLASSES = enum.auto()
+    MANAGE_MENTORS = enum.auto()
+    VIEW_BOTH_GENDERS = enum.auto()
+    MANAGE_ROLES = enum.auto()
+    MANAGE_PASSWORDS = enum.auto()
+    VIEW_METRICS = enum.auto()
+
+
+ALL = Perm(sum(Perm))
+STAFF = Perm.VIEW_STUDENTS | Perm.TAKE_ATTENDANCE
+
+# Role.role -> permissions (see data/initial_data/1_roles.sql); unknown roles grant nothing.
+ROLE_PERMISSIONS = {
+    'Admin': ALL,
+    'BatchZimmedar': STAFF | Perm.REGISTER_STUDENTS | Perm.ENTER_SCORES | Perm.VIEW_REPORTS
+                     | Perm.MANAGE_CLASSES | Perm.MANAGE_MENTORS,
+    'Ustad': STAFF | Perm.ENTER_SCORES | Perm.VIEW_REPORTS,
+    'Gender': Perm.VIEW_BOTH_GENDERS,
+    'Muallim': Perm.VIEW_STUDENTS,
+    'HalqahNaqeeb': STAFF,
+    'InfoTechNaqeeb': STAFF | Perm.VIEW_REPORTS | Perm.VIEW_METRICS,
+    'FieldNaqeeb': Perm.VIEW_STUDENTS,
+    'ClassSupportNaqeeb': STAFF,
+    'RegistrationTeam': Perm.VIEW_STUDENTS | Perm.REGISTER_STUDENTS,
+    'Student': Perm(0),
+    'NoRole': Perm(0),
+}
+
+Scope = namedtuple('Scope', 'batch_ids region_ids group_ids')
+NOWHERE = Scope(frozenset(), frozenset(), frozenset())
+
+
+class Grants:
+    """A user's effective permissions: global bits plus per-bit scope id sets."""
+
+    __slots__ = ('user_id', 'bits', 'any_bits', 'level', 'scopes')
+
+    def __init__(self, user_id, bits=0, scopes=None, level=None):
+        self.user_id = user_id
+        self.bits = int(bits)
+        self.scopes = scopes or {}
+        self.any_bits = self.bits
+        for bit in self.scopes:
+            self.any_bits |= bit
+        self.level = level
+
+    @classmethod
+    def from_roles(cls, user_id, user_roles):
+        """Build the grants of user_roles (UserRole rows with their Role loaded)."""
+        bits = 0
+        level = None
+        scoped = {}
+        for user_role in user_roles:
+            role_bits = int(ROLE_PERMISSIONS.get(user_role.role.role, 0))
+            level = user_role.role.level if level is None else min(level, user_role.role.level)
+            if user_role.class_group_id is not None:
+                kind, scope_id = 2, user_role.class_group_id
+            elif user_role.class_region_id is not None:
+                kind, scope_id = 1, user_role.class_region_id
+            elif user_role.class_batch_id is not None:
+                kind, scope_id = 0, user_role.class_batch_id
+            else:
+                bits |= role_bits
+                continue
+            for bit in Perm:
+                if role_bits & bit:
+                    scoped.setdefault(int(bit), (set(), set(), set()))[kind].add(scope_id)
+        scopes = {bit: Scope(*map(frozenset, ids)) for bit, ids in scoped.items() if not bits & bit}
+        return cls(user_id, bits, scopes, level)
+
+    def can(self, perm, batch_id=None, region_id=None, group_id=None):
+        """Whether every bit of perm is granted, globally or for one of the given ids.
+
+        Pass all the ids of the record (e.g. a group's region and batch too),
+        since a batch-wide grant covers the regions and groups of the batch.
+        Without ids, only global grants count.
+        """
+        missing = int(perm) & ~self.bits
+        while missing:
+            bit = missing & -missing
+            scope = self.scopes.get(bit, NOWHERE)
+            if not (batch_id in scope.batch_ids or region_id in scope.region_ids or group_id in scope.group_ids):
+                return False
+            missing ^= bit
+        return True
+
+    def has_anywhere(self, perm):
+        """Whether every bit of perm is granted globally or in some scope."""
+        return int(perm) & self.any_bits == int(perm)
+
+    def scope(self, perm):
+        """The Scope of a single-bit perm: None if global, NOWHERE if not granted."""
+        if self.bits & perm:
+            return None
+        return self.scopes.get(int(perm), NOWHERE)
+
+    def filter(self, perm, batch=None, region=None, group=None):
+        """A SQL condition keeping the rows whose batch/region/group columns are in perm's scope."""
+        scope = self.scope(perm)
+        if scope is None:
+            return sa.true()
+        conditions = [column.in_(ids) for column, ids in
+                      ((batch, scope.batch_ids), (region, scope.region_ids), (group, scope.group_ids))
+                      if column is not None and ids]
+        return sa.or_(*conditions) if conditions else sa.false()
+
+
+NO_GRANTS = Grants(None)
+
+
+def grants_for(user):
+    """The cached Grants of a user (nothing for anonymous users)."""
+    if not getattr(user, 'is_authenticated', False):
+        return NO_GRANTS
+    return user_cache.derived(user.id, 'grants', lambda cached: Grants.from_roles(cached.id, cached.roles)) \
+        or NO_GRANTS
+
+
+def current_grants():
+    return grants_for(current_user)
+
+
+def permission_required(perm, anywhere=False):
+    """Route decorator (below @login_required) requiring perm globally, or in some scope if anywhere."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            grants = current_grants()
+            if not (grants.has_anywhere(perm) if anywhere else grants.can(perm)):
+                flash('You are not authorized to perform this action.', 'danger')
+                return redirect(url_for('index'))
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,99 @@
+# app/calendar_feed.py
+"""
+This module builds the calendar events of a date window.
+
+Events are the ClassSessions, TestSessions, Task due dates and ClassBatch
+start dates in [start, end), each found with one range query on its
+indexed date column. The batch and its ClassName are joined in the same
+query. Only the viewer's batches are shown: all of them with a global
+VIEW_STUDENTS grant, else those the grant's scopes fall in, those they
+teach (ClassBatchTeacher) and those they study in (StudentGroup).
+
+``etag()`` is computed from the table versions (app/table_versions.py), the
+viewer and the window, without a query. An unchanged window is answered
+with a 304 before any event is loaded.
+"""
+import hashlib
+from datetime import date, datetime, timedelta
+import sqlalchemy as sa
+import sqlalchemy.orm as so
+from app import db
+from app.authz import Perm, grants_for
+from app.table_versions import versions
+import app.models as mo
+
+CALENDAR_TABLES = ('class_session', 'test_session', 'task', 'class_batch', 'class_name', 'class_region',
+                   'class_group', 'student_group', 'class_batch_teacher', 'user_role', 'role')
+versions.track(*CALENDAR_TABLES)
+
+MAX_DAYS = 366
+COLORS = {'class': '#0d6efd', 'test': '#dc3545', 'task': '#198754', 'batch': '#6c757d'}
+
+
+def parse_window(start, end):
+    """The [start, end) dates of FullCalendar's start/end parameters; ValueError if invalid."""
+    if not start or not end:
+        raise ValueError('start and end are required')
+    start, end = date.fromisoformat(start[:10]), date.fromisoformat(end[:10])
+    if not start < end <= start + timedelta(days=MAX_DAYS):
+        raise ValueError(f'end must be after start, by at most {MAX_DAYS} days')
+    return start, end
+
+
+def etag(user, start, end):
+    key = f'{user.id}:{start}:{end}:{versions.get(CALENDAR_TABLES)}'
+    return hashlib.blake2b(key.encode(), digest_size=12).hexdigest()
+
+
+def viewer_batch_ids(user):
+    """The ids of the batches user may see events of, or None for all of them."""
+    scope = grants_for(user).scope(Perm.VIEW_STUDENTS)
+    if scope is None:
+        return None
+    region_batch = sa.select(mo.ClassRegion.class_batch_id)
+    queries = [
+        sa.select(mo.ClassBatchTeacher.class_batch_id).where(mo.ClassBatchTeacher.user_id == user.id),
+        region_batch.join(mo.ClassGroup, mo.ClassGroup.class_region_id == mo.ClassRegion.id)
+        .join(mo.StudentGroup, mo.StudentGroup.class_group_id == mo.ClassGroup.id)
+        .where(mo.StudentGroup.user_id == user.id),
+    ]
+    if scope.region_ids:
+        queries.append(region_batch.where(mo.ClassRegion.id.in_(scope.region_ids)))
+    if scope.group_ids:
+        queries.append(region_batch.join(mo.ClassGroup, mo.ClassGroup.class_region_id == mo.ClassRegion.id)
+                       .where(mo.ClassGroup.id.in_(scope.group_ids)))
+    return set(scope.batch_ids) | set(db.session.scalars(sa.union(*queries)))
+
+
+def _in_window(model, column, start, end, batch_ids):
+    query = (sa.select(model).join(model.class_batch).join(mo.ClassBatch.class_name)
+             .options(so.contains_eager(model.class_batch).contains_eager(mo.ClassBatch.class_name))
+             .where(column >= start, column < end).order_by(column))
+    if batch_ids is not None:
+        query = query.where(model.class_batch_id.in_(batch_ids))
+    return db.session.scalars(query).all()
+
+
+def _event(kind, key, title, day, batch):
+    return {'id': f'{kind}-{key}', 'title': f'{batch.class_name.name} {batch.batch_no}: {title}',
+            'start': day.isoformat(), 'allDay': True, 'color': COLORS[kind], 'extendedProps': {'type': kind}}
+
+
+def events(start, end, batch_ids=None):
+    """The events of [start, end) in batch_ids (None for all batches), as FullCalendar event dicts."""
+    if batch_ids is not None and not batch_ids:
+        return []
+    found = [_event('class', s.id, 'Class', s.class_date, s.class_batch)
+             for s in _in_window(mo.ClassSession, mo.ClassSession.class_date, start, end, batch_ids)]
+    found += [_event('test', t.id, f'Test ({t.max_score})', t.test_date, t.class_batch)
+              for t in _in_window(mo.TestSession, mo.TestSession.test_date, start, end, batch_ids)]
+    found += [_event('task', t.id, t.name, t.due_date, t.class_batch)
+              for t in _in_window(mo.Task, mo.Task.due_date, start, end, batch_ids)]
+    batches = (sa.select(mo.ClassBatch).join(mo.ClassBatch.class_name)
+               .options(so.contains_eager(mo.ClassBatch.class_name))
+               .where(mo.ClassBatch.start_date >= datetime.combine(start, datetime.min.time()),
+                      mo.ClassBatch.start_date < datetime.combine(end, datetime.min.time())))
+    if batch_ids is not None:
+        batches = batches.where(mo.ClassBatch.id.in_(batch_ids))
+    found += [_event('batch', b.id, 'Starts', b.start_date.date(), b) for b in db.session.scalars(batches)]
+    return found
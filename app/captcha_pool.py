@@ -0,0 +1,120 @@
+# app/captcha_pool.py
+"""
+This module serves captchas from a pool of pre-rendered images.
+
+Rendering the captcha image is the slowest part of the login and support
+pages. ``PooledSessionCaptcha`` is a drop-in FlaskSessionCaptcha whose
+``captcha()`` template call pops a ready (answer, <img>) pair from a deque.
+A daemon thread keeps up to ``CAPTCHA_POOL_SIZE`` pairs per worker and
+renders a replacement after each pop. The image is rendered on the request
+only when the pool is empty. Each pair is served once.
+
+The thread is started on first use, so it also runs in workers forked after
+the app was created. ``stats()`` reports the hits, the misses and the hit
+rate.
+"""
+import base64
+import os
+import secrets
+import string
+import threading
+from collections import deque
+from flask_session_captcha import FlaskSessionCaptcha
+from markupsafe import Markup
+
+DEFAULT_POOL_SIZE = 100
+# FlaskSessionCaptcha's include_* options, in the order it draws from them
+ALPHABETS = (('include_punctuation', string.punctuation), ('include_numeric', string.digits),
+             ('include_alphabet', string.ascii_lowercase))
+_random = secrets.SystemRandom()
+
+
+class PooledSessionCaptcha(FlaskSessionCaptcha):
+    """FlaskSessionCaptcha with a per-worker pool of pre-rendered captchas."""
+
+    pool_size = DEFAULT_POOL_SIZE
+
+    def init_app(self, app):
+        super().init_app(app)
+        self.pool_size = app.config.get('CAPTCHA_POOL_SIZE', self.pool_size)
+        self._pool = deque()
+        self._wanted = threading.Event()
+        self._lock = threading.Lock()
+        self._producer = None
+        self._pid = None
+        self.hits = 0
+        self.misses = 0
+        self.produced = 0
+
+    def _answer(self):
+        # Same answers as FlaskSessionCaptcha's private generator: length characters split evenly between the
+        # enabled alphabets (the last one takes the remainder), shuffled.
+        alphabets = [chars for option, chars in ALPHABETS if getattr(self, option)]
+        if not alphabets:
+            raise RuntimeError('Enable at least one of CAPTCHA_INCLUDE_NUMERIC, _ALPHABET and _PUNCTUATION.')
+        if self.length <= 0:
+            raise ValueError('CAPTCHA_LENGTH must be greater than 0.')
+        each = self.length // len(alphabets)
+        answer = [secrets.choice(chars) for chars in alphabets for _ in range(each)]
+        answer += [secrets.choice(alphabets[-1]) for _ in range(self.length - len(answer))]
+        _random.shuffle(answer)
+        return ''.join(answer)
+
+    def render(self):
+        """Render one (answer, data URI) pair."""
+        answer = self._answer()
+        image = base64.b64encode(self.image_generator.generate(answer).getvalue()).decode('ascii')
+        return answer, f'data:image/png;base64, {image}'
+
+    def fill(self):
+        """Top the pool up to pool_size."""
+        while len(self._pool) < self.pool_size:
+            self._pool.append(self.render())
+            with self._lock:
+                self.produced += 1
+
+    def _produce(self):
+        while True:
+            self._wanted.clear()
+            self.fill()
+            self._wanted.wait(60)
+
+    def _ensure_producer(self):
+        if self._pid == os.getpid() and self._producer.is_alive():
+            return
+        with self._lock:
+            if self._pid != os.getpid() or not self._producer.is_alive():
+                self._pool.clear()
+                self._producer = threading.Thread(target=self._produce, name='captcha-pool', daemon=True)
+                self._producer.start()
+                self._pid = os.getpid()
+
+    def generate(self, *args, **kwargs):
+        """The captcha <img>, from the pool unless it is empty or options are overridden."""
+        if not self.enabled or not self.pool_size or any(
+                key.startswith('include_') for key in kwargs):
+            return super().generate(*args, **kwargs)
+        self._ensure_producer()
+        try:
+            answer, data = self._pool.popleft()
+            hit = True
+        except IndexError:
+            answer, data = self.render()
+            hit = False
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        self._wanted.set()
+        self.set_answer(answer)
+        css = f"class='{kwargs['css_class']}'" if kwargs.get('css_class') else ''
+        return Markup(f"<img src='{data}' {css} >")
+
+    def stats(self):
+        """Pool counters of this worker."""
+        with self._lock:
+            hits, misses, produced = self.hits, self.misses, self.produced
+        served = hits + misses
+        return {'pool_size': self.pool_size, 'pooled': len(self._pool), 'produced': produced,
+                'hits': hits, 'misses': misses, 'hit_rate': round(hits / served, 4) if served else None}
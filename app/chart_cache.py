@@ -0,0 +1,46 @@
+# app/chart_cache.py
+"""
+This module caches the dashboard chart payloads per worker.
+
+The JSON is built once per combination of the versions of the tables it is
+computed from (app/table_versions.py), and kept with an ETag derived from
+its content. A dashboard load that finds its key costs a dict lookup. A
+browser that sends the ETag back gets a 304.
+"""
+import hashlib
+import json
+from collections import namedtuple
+from app import stats
+from app.table_versions import versions
+
+CHART_TABLES = ('student_group', 'class_group', 'class_region', 'class_batch', 'user_status_lookup',
+                'dashboard_stat')
+versions.track(*CHART_TABLES)
+
+Payload = namedtuple('Payload', 'etag body')
+
+
+class ChartCache:
+    """The current chart Payload, rebuilt when a table version moves."""
+
+    def __init__(self):
+        # (versions key, Payload), replaced as a whole
+        self._entry = None
+
+    @staticmethod
+    def build():
+        return {name: {'labels': list(series), 'data': list(series.values())}
+                for name, series in stats.chart_series().items()}
+
+    def get(self):
+        key = versions.get(CHART_TABLES)
+        entry = self._entry
+        if entry is not None and entry[0] == key:
+            return entry[1]
+        body = json.dumps(self.build(), separators=(',', ':')).encode()
+        payload = Payload(hashlib.blake2b(body, digest_size=12).hexdigest(), body)
+        self._entry = (key, payload)
+        return payload
+
+
+charts = ChartCache()
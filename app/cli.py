@@ -0,0 +1,92 @@
+# app/cli.py
+"""
+This module registers the custom ``flask`` command line commands.
+"""
+import os
+import time
+import click
+from flask import current_app
+
+
+def register(app):
+    """Register the CLI commands on the given app."""
+
+    @app.cli.command('geo-cache-invalidate')
+    def geo_cache_invalidate():
+        """Make every worker reload the geo reference cache."""
+        from app.geo import cache
+        cache.invalidate()
+        click.echo('Geo cache invalidated.')
+
+    @app.cli.command('stats-reconcile')
+    def stats_reconcile():
+        """Recount the dashboard counters and report any drift."""
+        from app import stats
+        drift = stats.reconcile()
+        for key, (stored, counted) in sorted(drift.items()):
+            click.echo(f'{key}: {stored} -> {counted}')
+        click.echo(f'{len(drift)} counters corrected.')
+
+    @app.cli.command('role-grant')
+    @click.argument('email')
+    @click.argument('role')
+    def role_grant(email, role):
+        """Give the user with EMAIL the ROLE everywhere (e.g. the first Admin)."""
+        import sqlalchemy as sa
+        from app import db
+        import app.models as mo
+        user_id = db.session.scalar(sa.select(mo.Contact.user_id).where(mo.Contact.email == email.strip().lower()))
+        role_id = db.session.scalar(sa.select(mo.Role.id).where(mo.Role.role == role))
+        if user_id is None or role_id is None:
+            raise click.ClickException(f'No user with email {email!r}' if user_id is None else f'No role {role!r}')
+        if not db.session.scalar(sa.select(mo.UserRole.id).filter_by(
+                user_id=user_id, role_id=role_id, class_batch_id=None, class_region_id=None, class_group_id=None)):
+            db.session.add(mo.UserRole(user_id=user_id, role_id=role_id, created_by=user_id, updated_by=user_id))
+            db.session.commit()
+        click.echo(f'{email} has the {role} role.')
+
+    @app.cli.command('sessions-sweep')
+    def sessions_sweep():
+        """Delete the expired server-side sessions."""
+        from app.sessions import ServerSideSessionInterface
+        if not isinstance(app.session_interface, ServerSideSessionInterface):
+            raise click.ClickException('SESSION_TYPE is not a server-side store.')
+        click.echo(f'{app.session_interface.store.sweep(time.time())} expired sessions deleted.')
+
+    @app.cli.command('geo-import')
+    @click.argument('directory', type=click.Path(exists=True, file_okay=False))
+    @click.option('--table', 'tables', multiple=True,
+                  type=click.Choice(['regions', 'subregions', 'countries', 'states', 'cities']),
+                  help='Only import these tables (repeatable).')
+    @click.option('--batch-size', default=5000, show_default=True, help='Rows per executemany chunk.')
+    @click.option('--replace', is_flag=True,
+                  help='Delete every row of the imported tables first, instead of only inserting new rows and '
+                       'updating changed ones. Fails while addresses or other tables still reference the rows.')
+    def geo_import(directory, tables, batch_size, replace):
+        """Load the countries-states-cities JSON/CSV dumps from DIRECTORY.
+
+        Rows are matched on id (or wikiDataId): new ones are inserted, changed ones updated and none deleted,
+        unless --replace is given.
+        """
+        from app.geo import cache
+        from app.geo_import import import_geo
+        import_geo(directory, tables, batch_size, replace, echo=click.echo)
+        if os.path.exists(current_app.config['GEO_SNAPSHOT_PATH']):
+            _build_snapshot()
+        cache.invalidate()
+        click.echo('Geo cache invalidated.')
+
+    @app.cli.command('geo-snapshot')
+    def geo_snapshot():
+        """Write the memory-mapped geo snapshot shared by the workers."""
+        from app.geo import cache
+        _build_snapshot()
+        cache.invalidate()
+        click.echo('Geo cache invalidated.')
+
+
+def _build_snapshot():
+    from app.geo_snapshot import build_snapshot
+    path = current_app.config['GEO_SNAPSHOT_PATH']
+    count = build_snapshot(path)
+    click.echo(f'Geo snapshot written to {path} ({count} cities).')
@@ -40,5 +40,40 @@ class Config:
     CAPTCHA_LENGTH = 6
     CAPTCHA_WIDTH = 160
     CAPTCHA_HEIGHT = 60
-    SESSION_TYPE = 'filesystem'
+    # Pre-rendered captchas kept per worker (app/captcha_pool.py); 0 renders on every request
+    CAPTCHA_POOL_SIZE = 100
+    # Server-side sessions (app/sessions.py): 'sqlite', 'memory' (single process) or 'cookie'
+    SESSION_TYPE = 'sqlite'
+    # None keeps sessions.db in the app's instance folder
+    SESSION_SQLITE_PATH = os.environ.get('SESSION_SQLITE_PATH')
+    SESSION_MEMORY_MAX = 10000
+    SESSION_SWEEP_INTERVAL = 600
+    # Password hashing (app/passwords.py): werkzeug method and cost; pool of
+    # PASSWORD_HASH_WORKERS (default: CPU count) 'thread's, 'process'es or 'inline'
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD') or 'scrypt:32768:8:1'
+    PASSWORD_HASH_WORKERS = None
+    PASSWORD_HASH_EXECUTOR = 'thread'
+    # Reverse proxies in front of the app whose X-Forwarded-For/-Proto are trusted (werkzeug ProxyFix); 0 for none.
+    # The login throttle keys on the client address, so set this behind a proxy.
+    PROXY_FIX_X_FOR = int(os.environ.get('PROXY_FIX_X_FOR') or 0)
+    # Login throttle (app/throttle.py): (attempts in a burst, seconds to earn them back)
+    LOGIN_THROTTLE_EMAIL = (5, 300)
+    LOGIN_THROTTLE_IP = (50, 300)
+    LOGIN_THROTTLE_FLUSH_INTERVAL = 30
+    # Seconds between the `flask stats-reconcile` cron runs (README.md); older counters are logged as stale (app/stats.py)
+    STATS_RECONCILE_INTERVAL = 3600
+    # Seconds a worker trusts its copy of the table versions (app/table_versions.py)
+    TABLE_VERSION_CHECK_INTERVAL = 5
+    # Attendance report (app/attendance_analytics.py): at risk below this rate or after this many absences in a row
+    ATTENDANCE_AT_RISK_RATE = 0.75
+    ATTENDANCE_AT_RISK_STREAK = 3
+    # Rows fetched per round trip by the streaming exports (app/exports.py)
+    EXPORT_YIELD_PER = 1000
+    # Seconds a worker may serve a logged-in user from its identity cache (app/identity.py)
+    USER_CACHE_TTL = 30
+    # Geo reference cache (app/geo.py)
+    GEO_CACHE_STAMP = os.path.join(basedir, 'geo_cache.stamp')
+    GEO_CACHE_CHECK_INTERVAL = 5
+    # Memory-mapped geo snapshot, used when the file exists (flask geo-snapshot)
+    GEO_SNAPSHOT_PATH = os.path.join(basedir, 'geo_snapshot.bin')
     DEVELOPMENT_SERVER = ('DESKTOP-RLGODEE', 'server-does-not-exit')
\ No newline at end of file
@@ -0,0 +1,122 @@
+# app/dedup.py
+"""
+This module detects duplicate registrations.
+
+Mobile/WhatsApp numbers and emails are normalized first, then checked two
+ways:
+- against the indexed Contact columns, with one set-based ``IN (...)`` query
+  per chunk of records;
+- against the earlier records of the same import.
+
+A number counts as taken whether it was stored as someone's mobile or as
+their WhatsApp. Emails are compared as stored (the registration paths store
+them lower-cased), so the unique index on Contact.email is used.
+"""
+import re
+from collections import namedtuple
+import sqlalchemy as sa
+from app import db
+import app.models as mo
+
+CHUNK_SIZE = 500
+
+# field: 'mobile', 'whatsapp' or 'email'; user_id: the existing owner, or
+# first_ref: the earlier record of the same batch using the value.
+Duplicate = namedtuple('Duplicate', 'ref field value user_id first_ref')
+
+LABELS = {'mobile': 'Mobile', 'whatsapp': 'WhatsApp', 'email': 'Email'}
+
+
+def normalize_phone(value):
+    """Return a phone number as an int of its digits (international '00' prefix dropped), or None."""
+    if value is None:
+        return None
+    digits = re.sub(r'\D', '', str(value))
+    if digits.startswith('00'):
+        digits = digits[2:]
+    return int(digits) if 7 <= len(digits) <= 15 else None
+
+
+def normalize_email(value):
+    """Return an email stripped and lower-cased, or None."""
+    value = (value or '').strip().lower()
+    return value or None
+
+
+def describe(duplicate, noun='record'):
+    """A one-line, user facing explanation of a Duplicate (refs are called noun)."""
+    label = LABELS[duplicate.field]
+    if duplicate.user_id is not None:
+        return f'{label} {duplicate.value} is already registered (user {duplicate.user_id})'
+    return f'{label} {duplicate.value} appears more than once in this import (first in {noun} {duplicate.first_ref})'
+
+
+class DuplicateChecker:
+    """Checks batches of registrations for duplicates.
+
+    The checker remembers the values of the records passed to ``accept()``
+    once they are committed. Calling ``check()`` then ``accept()`` once per
+    chunk of a bulk import therefore also catches duplicates that span
+    chunks, without pointing at records that were rolled back.
+    """
+
+    def __init__(self, chunk_size=CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self.seen = {}
+        # (kind, value) -> the first ref of the last check(), until accept()
+        self.pending = {}
+
+    def check(self, records):
+        """Find the duplicates among records of (ref, mobile, whatsapp, email).
+
+        Values are normalized here. Returns {ref: [Duplicate, ...]} for the
+        records that have any.
+        """
+        records = [(ref, normalize_phone(mobile), normalize_phone(whatsapp), normalize_email(email))
+                   for ref, mobile, whatsapp, email in records]
+        found = {}
+        self.pending = {}
+        for ref, mobile, whatsapp, email in records:
+            for field, kind, value in (('mobile', 'phone', mobile), ('whatsapp', 'phone', whatsapp),
+                                       ('email', 'email', email)):
+                if value is None:
+                    continue
+                key = (kind, value)
+                first_ref = self.seen[key] if key in self.seen else self.pending.setdefault(key, ref)
+                if first_ref != ref:
+                    found.setdefault(ref, []).append(Duplicate(ref, field, value, None, first_ref))
+        for start in range(0, len(records), self.chunk_size):
+            for duplicate in self._existing(records[start:start + self.chunk_size]):
+                found.setdefault(duplicate.ref, []).append(duplicate)
+        return found
+
+    def accept(self, refs):
+        """Remember the values of the last check()'s records with refs, now that they are committed."""
+        refs = set(refs)
+        self.seen.update((key, ref) for key, ref in self.pending.items() if ref in refs)
+        self.pending = {}
+
+    def _existing(self, records):
+        phones = {v for _, mobile, whatsapp, _ in records for v in (mobile, whatsapp) if v is not None}
+        emails = {email for *_, email in records if email is not None}
+        if not phones and not emails:
+            return []
+        owners = {}
+        for user_id, mobile, whatsapp, email in db.session.execute(
+                sa.select(mo.Contact.user_id, mo.Contact.mobile, mo.Contact.whatsapp, mo.Contact.email)
+                .where(sa.or_(mo.Contact.mobile.in_(phones), mo.Contact.whatsapp.in_(phones),
+                              mo.Contact.email.in_(emails)))):
+            for kind, value in (('phone', mobile), ('phone', whatsapp), ('email', normalize_email(email))):
+                owners.setdefault((kind, value), user_id)
+        duplicates = []
+        for ref, mobile, whatsapp, email in records:
+            for field, kind, value in (('mobile', 'phone', mobile), ('whatsapp', 'phone', whatsapp),
+                                       ('email', 'email', email)):
+                if value is not None and (kind, value) in owners:
+                    duplicates.append(Duplicate(ref, field, value, owners[(kind, value)], None))
+        return duplicates
+
+
+def find_existing(mobile=None, whatsapp=None, email=None):
+    """Return the Duplicates of a single registration against existing contacts."""
+    return DuplicateChecker().check([(None, mobile, whatsapp, email)]).get(None, [])
@@ -0,0 +1,179 @@
+# app/exports.py
+"""
+This module streams batch rosters, attendance and test scores as CSV or XLSX.
+
+Each export is a generator of rows: a header tuple, then the rows of one
+query run with ``yield_per`` (``EXPORT_YIELD_PER`` rows at a time from a
+server-side cursor). The writers turn rows into byte chunks as they come,
+so a response holds one chunk and one fetch of rows, whatever the size of
+the batch.
+
+XLSX is written without a spreadsheet library: a minimal workbook whose one
+sheet has inline strings, zipped on the fly to an unseekable sink (zipfile
+then writes data descriptors). CSV cells starting with a formula character
+are prefixed with a quote, so a spreadsheet opens them as text.
+"""
+import csv
+import io
+import re
+import zipfile
+from xml.sax.saxutils import escape
+import sqlalchemy as sa
+from flask import current_app
+from app import db
+import app.models as mo
+
+CHUNK_ROWS = 500
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+# Characters XML 1.0 does not allow
+XML_INVALID = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+
+
+def _yield_per():
+    return current_app.config['EXPORT_YIELD_PER']
+
+
+def roster_rows(class_batch_id, condition=sa.true()):
+    """Header and rows of the students of a batch; condition narrows them (e.g. a scope filter)."""
+    yield ('Group', 'Index', 'User ID', 'Name', 'Gender', 'Birth Year', 'Status', 'Mobile', 'WhatsApp', 'Email')
+    yield from db.session.execute(
+        sa.select(mo.ClassGroup.name, mo.StudentGroup.index_no, mo.User.id, mo.User.username, mo.User.gender,
+                  mo.User.birthyear, mo.UserStatusLookup.status, mo.Contact.mobile, mo.Contact.whatsapp,
+                  mo.Contact.email)
+        .join(mo.User, mo.User.id == mo.StudentGroup.user_id)
+        .join(mo.ClassGroup, mo.ClassGroup.id == mo.StudentGroup.class_group_id)
+        .join(mo.ClassRegion, mo.ClassRegion.id == mo.ClassGroup.class_region_id)
+        .join(mo.UserStatusLookup, mo.UserStatusLookup.id == mo.StudentGroup.status_id)
+        .outerjoin(mo.Contact, mo.Contact.user_id == mo.User.id)
+        .where(mo.ClassRegion.class_batch_id == class_batch_id, condition)
+        .order_by(mo.ClassGroup.name, mo.StudentGroup.index_no, mo.User.id)
+        .execution_options(yield_per=_yield_per()))
+
+
+def attendance_rows(class_batch_id):
+    """Header and rows of every attendance mark of a batch, by date."""
+    yield ('Date', 'User ID', 'Name', 'Status', 'Late (min)', 'Left Early (min)', 'Note')
+    yield from db.session.execute(
+        sa.select(mo.ClassSession.class_date, mo.User.id, mo.User.username, mo.AttendanceStatusLookup.status,
+                  mo.UserAttendance.late_by_min, mo.UserAttendance.left_early_by_min, mo.UserAttendance.note)
+        .join(mo.ClassSession, mo.ClassSession.id == mo.UserAttendance.class_session_id)
+        .join(mo.User, mo.User.id == mo.UserAttendance.user_id)
+        .join(mo.AttendanceStatusLookup, mo.AttendanceStatusLookup.id == mo.UserAttendance.attendance_status_id)
+        .where(mo.ClassSession.class_batch_id == class_batch_id)
+        .order_by(mo.ClassSession.class_date, mo.User.id)
+        .execution_options(yield_per=_yield_per()))
+
+
+def score_rows(class_batch_id):
+    """Header and rows of every test score of a batch, by test date."""
+    yield ('Test Date', 'Max Score', 'User ID', 'Name', 'Score', 'Percent', 'Note')
+    rows = db.session.execute(
+        sa.select(mo.TestSession.test_date, mo.TestSession.max_score, mo.User.id, mo.User.username,
+                  mo.TestSessionScore.score, mo.TestSessionScore.note)
+        .join(mo.TestSession, mo.TestSession.id == mo.TestSessionScore.test_session_id)
+        .join(mo.User, mo.User.id == mo.TestSessionScore.user_id)
+        .where(mo.TestSession.class_batch_id == class_batch_id)
+        .order_by(mo.TestSession.test_date, mo.User.id)
+        .execution_options(yield_per=_yield_per()))
+    for test_date, max_score, user_id, username, score, note in rows:
+        percent = round(score * 100 / max_score, 1) if max_score else None
+        yield test_date, max_score, user_id, username, score, percent, note
+
+
+def csv_chunks(rows):
+    """UTF-8 (with BOM, for Excel) CSV of rows, CHUNK_ROWS rows per chunk."""
+    buffer = io.StringIO()
+    buffer.write('\ufeff')
+    writer = csv.writer(buffer)
+    for n, row in enumerate(rows, 1):
+        writer.writerow(["'" + value if isinstance(value, str) and value.startswith(FORMULA_PREFIXES) else value
+                         for value in row])
+        if n % CHUNK_ROWS == 0:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+class _Sink:
+    """Unseekable file object collecting what zipfile writes, drained between rows."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+XLSX_PARTS = {
+    '[Content_Types].xml':
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>',
+    '_rels/.rels':
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/'
+        'officeDocument" Target="xl/workbook.xml"/></Relationships>',
+    'xl/workbook.xml':
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="{sheet}" sheetId="1" r:id="rId1"/></sheets></workbook>',
+    'xl/_rels/workbook.xml.rels':
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/'
+        'worksheet" Target="worksheets/sheet1.xml"/></Relationships>',
+}
+
+
+def _cell(value):
+    if value is None:
+        return '<c/>'
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return f'<c><v>{value}</v></c>'
+    text = escape(XML_INVALID.sub('', str(value)))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def xlsx_chunks(rows, sheet='Sheet1'):
+    """An XLSX workbook of rows on one sheet, zipped as it is written."""
+    sink = _Sink()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as workbook:
+        for name, content in XLSX_PARTS.items():
+            workbook.writestr(name, content.replace('{sheet}', escape(sheet[:31]), 1))
+        with workbook.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as part:
+            part.write(b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                       b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>')
+            lines = []
+            for row in rows:
+                lines.append('<row>' + ''.join(_cell(value) for value in row) + '</row>')
+                if len(lines) == CHUNK_ROWS:
+                    part.write(''.join(lines).encode())
+                    lines.clear()
+                    yield sink.drain()
+            part.write((''.join(lines) + '</sheetData></worksheet>').encode())
+    yield sink.drain()
+
+
+WRITERS = {
+    'csv': (csv_chunks, 'text/csv; charset=utf-8'),
+    'xlsx': (xlsx_chunks, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+}
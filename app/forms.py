@@ -11,7 +11,7 @@ the integrity of the submitted data.
 import datetime
 from flask_wtf import FlaskForm
 from wtforms import StringField, IntegerField, SelectField, SubmitField, PasswordField, BooleanField, TextAreaField, DateField, FileField, EmailField, TelField
-from wtforms.validators import DataRequired, Length, Email, EqualTo, ValidationError, Optional,InputRequired, NumberRange
+from wtforms.validators import DataRequired, Length, Email, EqualTo, Optional,InputRequired, NumberRange
 
 
 import sqlalchemy as sa
@@ -19,6 +19,7 @@ from app import db
 from app.models import User, ClassName, ClassBatch, ClassRegion, ClassGroup, ClassGroupMentor, StudentGroup, ClassBatchTeacher, Role, UserRole, ClassBatchStatus, Countries, UserStatusLookup, Contact, RegStatusLookup
 
 from .config import Config
+from .dedup import describe, find_existing
 
 thisyear = datetime.datetime.now().year
 
@@ -60,6 +61,11 @@ class RegFromWaText(FlaskForm):
     whatsapptext = TextAreaField('Paste WhatsApp Registration Text in the below box.', validators=[], render_kw={"rows": 34, "cols": 100})
     register = SubmitField('Register')
 
+class RegFromWaExport(FlaskForm):
+    """ Bulk WhatsApp Registration Form (exported chat file) """
+    file = FileField('Exported WhatsApp chat (.txt)', validators=[DataRequired()])
+    submit = SubmitField('Import')
+
 class UserRegForm(FlaskForm):
     """
     A form for registering new users.
@@ -122,11 +128,14 @@ class UserRegForm(FlaskForm):
         else:
             self.registration_status.choices = [(s.id, s.status) for s in RegStatusLookup.query.all()]
 
-    def validate_email_mobile(self, email, mobile):
-        """Validate that the email or mobile number is unique."""
-        user = User.query.filter((User.email == self.email.data) | (User.mobile == self.mobile.data)).first()
-        if user:
-            raise ValidationError('A user with that email or mobile number already exists.')
+    def validate(self, extra_validators=None):
+        """Validate the fields, then check mobile, WhatsApp and email against existing contacts in one query."""
+        if not super().validate(extra_validators):
+            return False
+        duplicates = find_existing(self.mobile.data, self.whatsapp.data, self.email.data)
+        for duplicate in duplicates:
+            getattr(self, duplicate.field).errors.append(describe(duplicate))
+        return not duplicates
 
 
 
@@ -356,4 +365,21 @@ class UpdateReferrerForm(FlaskForm):
     email = StringField('Email', validators=[Email(), Length(max=120)])
     batch = StringField('Batch', validators=[Length(max=16)])
     referrer_id = IntegerField('Referrer ID')
-    submit = SubmitField('Update')
\ No newline at end of file
+    submit = SubmitField('Update')
+
+class ClassSessionForm(FlaskForm):
+    """Pick the batch and date of a class session to mark."""
+    class_batch_id = SelectField('Class Batch', coerce=int, validators=[DataRequired()])
+    class_date = DateField('Date', default=datetime.date.today, validators=[DataRequired()])
+    submit = SubmitField('Open Attendance')
+
+class AttendanceSheetForm(FlaskForm):
+    """Attendance sheet; the per-student fields are read by app/attendance_marking.py."""
+    submit = SubmitField('Save Attendance')
+
+class ScoreImportForm(FlaskForm):
+    """Upload a test's scores as CSV rows of (student, score, note)."""
+    test_session_id = SelectField('Test', coerce=int, validators=[DataRequired()])
+    file = FileField('Scores (.csv)', validators=[DataRequired()])
+    dry_run = BooleanField('Only check the file (dry run)')
+    submit = SubmitField('Import Scores')
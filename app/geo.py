@@ -0,0 +1,654 @@
+# app/geo.py
+"""
+This module provides an in-process cache of the geo reference tables.
+
+Countries, states and cities (the dr5hn countries-states-cities dataset) almost
+never change, so they are loaded once per worker into plain tuples and the JSON
+payloads served by the location APIs are serialized up front. Lookups are dict
+hits keyed by id. Country timezones are parsed once at load time into a
+``TimezoneRegistry``.
+
+When a geo snapshot has been built (``flask geo-snapshot``, see
+``app/geo_snapshot.py``) the cities, their JSON payloads and the lookup
+indexes are read from the memory-mapped file instead, so the bulk of the data
+is shared between worker processes rather than copied into each of them.
+
+The cache is versioned by a stamp file. ``invalidate()`` drops the local copy
+and touches the stamp, which makes every other worker reload on its next
+stamp check (at most ``GEO_CACHE_CHECK_INTERVAL`` seconds later).
+"""
+import bisect
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+from array import array
+from collections import OrderedDict, namedtuple
+from datetime import datetime, timedelta
+import sqlalchemy as sa
+from flask import current_app
+from app import db
+import app.models as mo
+
+Country = namedtuple('Country', 'id name iso2 iso3 phonecode currency currency_name capital timezones native')
+State = namedtuple('State', 'id name country_id iso2 native')
+City = namedtuple('City', 'id name state_id country_id state_code')
+Zone = namedtuple('Zone', 'name gmt_offset gmt_offset_name abbreviation tz_name')
+
+EMPTY_JSON = b'[]'
+
+
+def dumps(obj):
+    """Serialize obj to compact JSON bytes."""
+    return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+
+def parse_timezones(text):
+    """Parse a Countries.timezones blob into a tuple of Zones.
+
+    The upstream JSON dumps store real JSON; the SQL dumps store a JS object
+    literal (bare keys, single quotes), which is normalized before parsing.
+    """
+    if not text:
+        return ()
+    try:
+        items = json.loads(text)
+    except ValueError:
+        try:
+            items = json.loads(re.sub(r'([{,])\s*(\w+)\s*:', r'\1"\2":', text).replace("'", '"'))
+        except ValueError:
+            return ()
+    return tuple(Zone(item.get('zoneName'), int(item.get('gmtOffset') or 0), item.get('gmtOffsetName'),
+                      item.get('abbreviation'), item.get('tzName'))
+                 for item in items if isinstance(item, dict))
+
+
+class TimezoneRegistry:
+    """Country timezones parsed once, with lookups by zone name or label.
+
+    Offsets are the fixed ``gmtOffset`` values of the dataset; daylight saving
+    time is not modelled.
+    """
+
+    def __init__(self, countries):
+        self.by_country = {}
+        self.by_name = {}
+        self.by_label = {}
+        for country in sorted(countries.values(), key=lambda c: c.id):
+            self.by_country[country.id] = country.timezones
+            for zone in country.timezones:
+                if zone.name:
+                    self.by_name.setdefault(zone.name, zone)
+                for label in (zone.gmt_offset_name, zone.abbreviation):
+                    if label:
+                        self.by_label.setdefault(label.upper(), zone)
+
+    def for_country(self, country_id):
+        """Return the Zones of a country (empty if unknown)."""
+        return self.by_country.get(country_id, ())
+
+    def resolve(self, tz):
+        """Find a Zone by zone name ('Asia/Kolkata'), offset name ('UTC+05:30') or abbreviation ('IST')."""
+        if not tz:
+            return None
+        tz = tz.strip()
+        return self.by_name.get(tz) or self.by_label.get(tz.upper())
+
+    def utc_offset(self, tz):
+        """Return the UTC offset of tz as a timedelta, or None if unknown."""
+        zone = self.resolve(tz)
+        return timedelta(seconds=zone.gmt_offset) if zone else None
+
+    def to_utc(self, hours, tz):
+        """Convert a local time of day (e.g. CallOutTime.hours) in tz to UTC."""
+        offset = self.utc_offset(tz)
+        if offset is None or hours is None:
+            return None
+        local = datetime.combine(datetime(2000, 1, 1), hours.replace(tzinfo=None))
+        return (local - offset).time()
+
+    @staticmethod
+    def label(zones):
+        """Format zones as 'UTC+05:30|IST, ...' for display."""
+        return ', '.join(f'{z.gmt_offset_name}|{z.abbreviation}' for z in zones)
+
+
+class Memo:
+    """An LRU cache of computed values with at most maxsize entries (unbounded if None).
+
+    Unlike lru_cache on a bound method, it holds no reference to its owner.
+    """
+
+    def __init__(self, maxsize=None):
+        self.maxsize = maxsize
+        self.values = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, compute):
+        """The value of key, computed as compute(*key) on a miss."""
+        with self._lock:
+            if key in self.values:
+                self.values.move_to_end(key)
+                return self.values[key]
+        value = compute(*key)
+        with self._lock:
+            self.values[key] = value
+            if self.maxsize and len(self.values) > self.maxsize:
+                self.values.popitem(last=False)
+        return value
+
+
+class GeoData:
+    """An immutable snapshot of the geo tables, built by ``load()``.
+
+    ``cities`` and ``cities_json`` are dicts when loaded from the database and
+    read-only views of the mapped file when loaded from a geo snapshot.
+    """
+
+    def __init__(self, version, country_rows, state_rows, cities, cities_json=None, snapshot=None):
+        self.version = version
+        self.countries = {}
+        translations = {}
+        for row in country_rows:
+            self.countries[row[0]] = Country(*row[:8], parse_timezones(row[8]), row[9])
+            translations[row[0]] = row[10]
+        self.states = {row[0]: State(*row) for row in state_rows}
+        self.cities = cities
+        self.snapshot = snapshot
+        self.timezones = TimezoneRegistry(self.countries)
+        self.country_resolver = CountryResolver(self.countries, translations)
+
+        states_by_country = {}
+        for state in sorted(self.states.values(), key=lambda s: s.id):
+            states_by_country.setdefault(state.country_id, []).append({'id': state.id, 'name': state.name})
+        self.states_json = {cid: dumps(rows) for cid, rows in states_by_country.items()}
+
+        if cities_json is None:
+            cities_by_state = {}
+            for city in sorted(cities.values(), key=lambda c: c.id):
+                cities_by_state.setdefault(city.state_id, []).append({'id': city.id, 'name': city.name})
+            cities_json = {sid: dumps(rows) for sid, rows in cities_by_state.items()}
+        self.cities_json = cities_json
+
+        self._location_json = {}
+        self._lock = threading.Lock()
+        self._prefix_index = None
+        self._spatial_index = None
+        self._state_indexes = Memo()
+        self._city_indexes = Memo(1024)
+        self._country_names = Memo(4096)
+        self._state_ids = Memo(8192)
+        self._city_ids = Memo(16384)
+
+    @staticmethod
+    def query_rows():
+        """Read the raw country, state and city rows with three column-only queries."""
+        country_rows = db.session.execute(sa.select(
+            mo.Countries.id, mo.Countries.name, mo.Countries.iso2, mo.Countries.iso3,
+            mo.Countries.phonecode, mo.Countries.currency, mo.Countries.currency_name,
+            mo.Countries.capital, mo.Countries.timezones, mo.Countries.native,
+            mo.Countries.translations)).all()
+        state_rows = db.session.execute(sa.select(
+            mo.States.id, mo.States.name, mo.States.country_id, mo.States.iso2, mo.States.native)).all()
+        city_rows = db.session.execute(sa.select(
+            mo.Cities.id, mo.Cities.name, mo.Cities.state_id, mo.Cities.country_id, mo.Cities.state_code)).all()
+        return country_rows, state_rows, city_rows
+
+    @classmethod
+    def load(cls, version):
+        """Map the geo snapshot if one has been built, else read the tables."""
+        path = current_app.config.get('GEO_SNAPSHOT_PATH')
+        if path and os.path.exists(path):
+            from app.geo_snapshot import GeoSnapshot
+            return GeoSnapshot(path).geo_data(version)
+        country_rows, state_rows, city_rows = cls.query_rows()
+        return cls(version, country_rows, state_rows, {row[0]: City(*row) for row in city_rows})
+
+    @property
+    def prefix_index(self):
+        """The typeahead index, built on first use."""
+        if self._prefix_index is None:
+            with self._lock:
+                if self._prefix_index is None:
+                    self._prefix_index = self.snapshot.prefix_index(self) if self.snapshot else PrefixIndex(self)
+        return self._prefix_index
+
+    @property
+    def spatial_index(self):
+        """The nearest-city grid index, built on first use."""
+        if self._spatial_index is None:
+            from app.geo_spatial import SpatialIndex
+            with self._lock:
+                if self._spatial_index is None:
+                    self._spatial_index = self.snapshot.spatial_index() if self.snapshot else SpatialIndex.from_db()
+        return self._spatial_index
+
+    def nearest_cities(self, lat, lon, k=5):
+        """Return the k nearest cities to (lat, lon) as dicts, closest first."""
+        results = []
+        for city_id, distance in self.spatial_index.nearest(lat, lon, k):
+            city = self.cities.get(city_id)
+            if city is None:
+                continue
+            state = self.states.get(city.state_id)
+            country = self.countries.get(city.country_id)
+            results.append({'id': city.id, 'name': city.name,
+                            'state_id': city.state_id, 'state': state.name if state else None,
+                            'country_id': city.country_id, 'country': country.name if country else None,
+                            'distance_km': round(distance, 3)})
+        return results
+
+    def state_index(self, country_id):
+        """The NameIndex over the states (and native names) of a country."""
+        return self._state_indexes.get((country_id,), self._state_index)
+
+    def city_index(self, state_id):
+        """The NameIndex over the cities of a state."""
+        return self._city_indexes.get((state_id,), self._city_index)
+
+    def resolve_country(self, name):
+        """Return the Country best matching the free-text name (or None)."""
+        return self._country_names.get((name,), self.country_resolver.resolve)
+
+    def _state_index(self, country_id):
+        states = sorted((s for s in self.states.values() if s.country_id == country_id), key=lambda s: s.id)
+        return NameIndex([(s.name, s.id) for s in states] + [(s.native, s.id) for s in states if s.native])
+
+    def _city_index(self, state_id):
+        return NameIndex((row['name'], row['id']) for row in json.loads(self.cities_json.get(state_id, EMPTY_JSON)))
+
+    def _resolve_state_id(self, country_id, name):
+        return self.state_index(country_id).lookup(name)
+
+    def _resolve_city_id(self, state_id, name):
+        return self.city_index(state_id).lookup(name)
+
+    def resolve_state(self, country_id, name):
+        """Return the State of country_id best matching the free-text name (or None)."""
+        state_id = self._state_ids.get((country_id, name or ''), self._resolve_state_id)
+        return self.states.get(state_id) if state_id is not None else None
+
+    def resolve_city(self, state_id, name):
+        """Return the City of state_id best matching the free-text name (or None)."""
+        city_id = self._city_ids.get((state_id, name or ''), self._resolve_city_id)
+        return self.cities.get(city_id) if city_id is not None else None
+
+    def resolve_place(self, country, state, city):
+        """Resolve free-text country/state/city names top down; return (Country, State, City), None where unresolved."""
+        country = self.resolve_country(country) if country else None
+        state = self.resolve_state(country.id, state) if country and state else None
+        city = self.resolve_city(state.id, city) if state and city else None
+        return country, state, city
+
+    def location_json(self, city_id):
+        """Return the /api/location payload for a city, serialized on first use."""
+        payload = self._location_json.get(city_id)
+        if payload is None:
+            city = self.cities.get(city_id)
+            if city is None:
+                return EMPTY_JSON
+            country = self.countries[city.country_id]
+            state = self.states[city.state_id]
+            payload = dumps([{
+                'Country': country.name,
+                'ISO3': country.iso3,
+                'ISO2': country.iso2,
+                'Phone Code': country.phonecode,
+                'Currency': country.currency,
+                'Currency Name': country.currency_name,
+                'Capital': country.capital,
+                'Timezones': TimezoneRegistry.label(country.timezones),
+                'CityState': state.name,
+                'City': city.name,
+            }])
+            self._location_json[city_id] = payload
+        return payload
+
+
+def normalize(text):
+    """Casefold text and strip accents so 'Málaga' and 'malaga' compare equal."""
+    text = unicodedata.normalize('NFKD', text.casefold())
+    return ' '.join(''.join(ch for ch in text if not unicodedata.combining(ch)).split())
+
+
+# Words that only qualify a place name ("Lucknow District", "Dist. Pune").
+NOISE_WORDS = frozenset({'city', 'town', 'district', 'dist', 'state', 'province', 'region', 'division',
+                         'tehsil', 'taluka', 'municipality', 'governorate', 'the', 'of'})
+
+
+def token_key(key):
+    """Order-insensitive form of a normalized name without punctuation or noise words."""
+    words = re.sub(r'[^\w ]', ' ', key).split()
+    return ' '.join(sorted(w for w in words if w not in NOISE_WORDS)) or key
+
+
+def trigrams(key):
+    """The set of (space padded) character trigrams of a normalized name."""
+    padded = f'  {key} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def edit_distance(a, b, limit):
+    """Edit distance counting an adjacent transposition as one edit; limit + 1 once it exceeds limit."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    prev2 = None
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        row = [i] + [0] * len(b)
+        for j, cb in enumerate(b, 1):
+            cost = ca != cb
+            row[j] = min(prev[j] + 1, row[j - 1] + 1, prev[j - 1] + cost)
+            if i > 1 and j > 1 and ca == b[j - 2] and a[i - 2] == cb:
+                row[j] = min(row[j], prev2[j - 2] + 1)
+        if min(row) > limit:
+            return limit + 1
+        prev2, prev = prev, row
+    return prev[-1]
+
+
+class NameIndex:
+    """Fuzzy lookup of names to ids within one scope (e.g. the cities of a state).
+
+    A lookup tries the normalized name, then its token key (word order,
+    punctuation and noise words ignored), then the token key most similar
+    by trigram Dice coefficient, if that reaches ``threshold``, and finally
+    the closest one within one or two edits, which catches the transpositions
+    ("Inida") that trigrams score poorly. Candidates for both fallbacks come
+    from an inverted trigram index, so only names sharing at least one
+    trigram are scored. On ties the earlier item wins.
+    """
+
+    def __init__(self, items, threshold=0.6):
+        self.threshold = threshold
+        self.exact = {}
+        self.tokens = {}
+        self.refs = []
+        self.keys = []
+        self.sizes = []
+        self.postings = {}
+        for name, ref in items:
+            key = normalize(name)
+            if not key:
+                continue
+            tokens = token_key(key)
+            self.exact.setdefault(key, ref)
+            self.tokens.setdefault(tokens, ref)
+            grams = trigrams(tokens)
+            for gram in grams:
+                self.postings.setdefault(gram, []).append(len(self.refs))
+            self.refs.append(ref)
+            self.keys.append(tokens)
+            self.sizes.append(len(grams))
+
+    def lookup(self, name):
+        """Return the id best matching name, or None."""
+        key = normalize(name) if name else ''
+        if not key:
+            return None
+        ref = self.exact.get(key)
+        if ref is None:
+            tokens = token_key(key)
+            ref = self.tokens.get(tokens)
+            if ref is None:
+                ref = self._similar(tokens)
+        return ref
+
+    def _similar(self, tokens):
+        grams = trigrams(tokens)
+        shared = {}
+        for gram in grams:
+            for i in self.postings.get(gram, ()):
+                shared[i] = shared.get(i, 0) + 1
+        best, best_score = None, 0.0
+        for i, count in shared.items():
+            score = 2.0 * count / (len(grams) + self.sizes[i])
+            if score > best_score or (score == best_score and i < best):
+                best, best_score = i, score
+        if best is not None and best_score >= self.threshold:
+            return self.refs[best]
+        limit = 1 if len(tokens) <= 6 else 2
+        best, best_distance = None, limit + 1
+        for i in sorted(shared):
+            distance = edit_distance(tokens, self.keys[i], limit)
+            if distance < best_distance:
+                best, best_distance = i, distance
+        return self.refs[best] if best is not None else None
+
+
+class CountryResolver:
+    """Hash index from normalized country names and aliases to countries.
+
+    Keys are the name, iso2, iso3, native name and every value of the
+    ``translations`` JSON. On a collision the earlier kind wins (a real name
+    beats a code, a code beats a translation). When there is no exact hit the
+    names are ranked: prefix of the name, then prefix of a word in the name,
+    then substring; ties go to the shorter name. Misspellings fall back to
+    the closest name or alias by trigram similarity (see NameIndex).
+    """
+
+    def __init__(self, countries, translations):
+        self.countries = countries
+        self.index = {}
+        ordered = sorted(countries.values(), key=lambda c: c.id)
+        for country in ordered:
+            self._add(country.name, country.id)
+        for country in ordered:
+            self._add(country.iso2, country.id)
+            self._add(country.iso3, country.id)
+        for country in ordered:
+            self._add(country.native, country.id)
+        for country in ordered:
+            for name in self._translations(translations.get(country.id)):
+                self._add(name, country.id)
+        self.names = [(normalize(c.name), c.id) for c in ordered]
+        self._fuzzy = None
+
+    def _add(self, name, country_id):
+        if name:
+            self.index.setdefault(normalize(name), country_id)
+
+    @staticmethod
+    def _translations(text):
+        if not text:
+            return ()
+        try:
+            items = json.loads(text)
+        except ValueError:
+            return ()
+        return [v for v in items.values() if isinstance(v, str)] if isinstance(items, dict) else ()
+
+    def resolve(self, name):
+        """Return the best matching Country for name, or None."""
+        if not name:
+            return None
+        key = normalize(name)
+        if not key:
+            return None
+        country_id = self.index.get(key)
+        if country_id is None:
+            country_id = self._ranked(key)
+        if country_id is None:
+            if self._fuzzy is None:
+                self._fuzzy = NameIndex(self.index.items())
+            country_id = self._fuzzy.lookup(key)
+        return self.countries.get(country_id) if country_id is not None else None
+
+    def _ranked(self, key):
+        best = None
+        for name, country_id in self.names:
+            if name.startswith(key):
+                rank = 0
+            elif (' ' + key) in name or ('-' + key) in name:
+                rank = 1
+            elif key in name:
+                rank = 2
+            else:
+                continue
+            candidate = (rank, len(name), country_id)
+            if best is None or candidate < best:
+                best = candidate
+        return best[2] if best else None
+
+
+class PrefixIndex:
+    """Sorted-array prefix index over city and state names.
+
+    Every name (and native name) is indexed from the start of each of its
+    words, so 'prad' finds 'Uttar Pradesh'. Entries are kept as a sorted list
+    of keys with a parallel int array of ids (cities positive, states
+    negative); a lookup is a bisect plus a short forward scan. Prebuilt
+    keys/ids sequences (from a geo snapshot) can be passed in instead.
+    Country-filtered lookups bisect into per-country key/id arrays, split
+    from the shared ones on first use.
+    """
+
+    def __init__(self, data, keys=None, ids=None):
+        # The rows, not data itself, so that data (which holds this index) is not in a reference cycle.
+        self.cities, self.states, self.countries = data.cities, data.states, data.countries
+        if keys is None:
+            entries = []
+            for city in data.cities.values():
+                self._add(entries, city.name, city.id)
+            for state in data.states.values():
+                self._add(entries, state.name, -state.id)
+                if state.native and state.native != state.name:
+                    self._add(entries, state.native, -state.id)
+            entries.sort()
+            keys = [key for key, _ in entries]
+            ids = array('i', (ref for _, ref in entries))
+        self.keys = keys
+        self.ids = ids
+        self._by_country = None
+        self._results = Memo(4096)
+
+    @staticmethod
+    def _add(entries, name, ref):
+        key = normalize(name)
+        entries.append((key, ref))
+        start = key.find(' ')
+        while start != -1:
+            entries.append((key[start + 1:], ref))
+            start = key.find(' ', start + 1)
+
+    def _country_of(self, ref):
+        row = self.cities.get(ref) if ref > 0 else self.states.get(-ref)
+        return row.country_id if row else None
+
+    def by_country(self):
+        """{country id: (keys, ids)} of the entries of each country, in key order."""
+        if self._by_country is None:
+            by_country = {}
+            for key, ref in zip(self.keys, self.ids):
+                keys, ids = by_country.setdefault(self._country_of(ref), ([], array('i')))
+                keys.append(key)
+                ids.append(ref)
+            self._by_country = by_country
+        return self._by_country
+
+    def search(self, query, limit=10, country_id=None):
+        """Return up to limit refs (city id, or -state id) whose names start with query."""
+        prefix = normalize(query)
+        if not prefix:
+            return []
+        keys, ids = (self.keys, self.ids) if country_id is None else self.by_country().get(country_id, ((), ()))
+        found = []
+        seen = set()
+        i = bisect.bisect_left(keys, prefix)
+        while i < len(keys) and len(found) < limit and keys[i].startswith(prefix):
+            ref = ids[i]
+            i += 1
+            if ref not in seen:
+                seen.add(ref)
+                found.append(ref)
+        return found
+
+    def search_json(self, query, limit=10, country_id=None):
+        """search() as serialized city/state dicts, memoized."""
+        return self._results.get((query, limit, country_id), self._search_json)
+
+    def _search_json(self, query, limit, country_id):
+        results = []
+        for ref in self.search(query, limit, country_id):
+            if ref > 0:
+                city = self.cities[ref]
+                state = self.states.get(city.state_id)
+                country = self.countries.get(city.country_id)
+                results.append({'type': 'city', 'id': city.id, 'name': city.name,
+                                 'state_id': city.state_id, 'state': state.name if state else None,
+                                 'country_id': city.country_id, 'country': country.name if country else None})
+            else:
+                state = self.states[-ref]
+                country = self.countries.get(state.country_id)
+                results.append({'type': 'state', 'id': state.id, 'name': state.name,
+                                'state_id': state.id, 'state': state.name,
+                                'country_id': state.country_id, 'country': country.name if country else None})
+        return dumps(results)
+
+
+class GeoCache:
+    """Lazily loaded, explicitly invalidated holder of the current GeoData."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = None
+        self._stamp = None
+        self._checked_at = 0.0
+
+    @staticmethod
+    def _stamp_path():
+        return current_app.config['GEO_CACHE_STAMP']
+
+    def _read_stamp(self):
+        try:
+            return os.stat(self._stamp_path()).st_mtime_ns
+        except OSError:
+            return 0
+
+    def _is_stale(self):
+        now = time.monotonic()
+        if now - self._checked_at < current_app.config['GEO_CACHE_CHECK_INTERVAL']:
+            return False
+        self._checked_at = now
+        return self._read_stamp() != self._stamp
+
+    @property
+    def data(self) -> GeoData:
+        """The loaded geo data, (re)loading it if missing or stale."""
+        data = self._data
+        if data is None or self._is_stale():
+            with self._lock:
+                if self._data is None or self._read_stamp() != self._stamp:
+                    self._stamp = self._read_stamp()
+                    self._data = GeoData.load(self._stamp)
+                data = self._data
+        return data
+
+    @property
+    def version(self):
+        """The stamp the current data was loaded under."""
+        return self.data.version
+
+    @property
+    def timezones(self) -> TimezoneRegistry:
+        """The timezone registry of the current data."""
+        return self.data.timezones
+
+    def invalidate(self):
+        """Drop the cached data here and signal the other workers to reload."""
+        path = self._stamp_path()
+        with open(path, 'a'):
+            os.utime(path, ns=(time.time_ns(), time.time_ns()))
+        with self._lock:
+            self._data = None
+            self._checked_at = 0.0
+
+
+cache = GeoCache()
+
+
+def json_response(payload):
+    """Wrap pre-serialized JSON bytes in a response."""
+    return current_app.response_class(payload, mimetype='application/json')
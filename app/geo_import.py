@@ -0,0 +1,261 @@
+# app/geo_import.py
+"""
+This module bulk loads the dr5hn countries-states-cities dataset.
+
+The upstream JSON/CSV dumps are streamed record by record, coerced to the
+column types of the matching model and written with batched ``executemany``
+statements, one transaction per table. By default the import is an upsert:
+only new or changed rows (matched on ``id``, falling back to ``wikiDataId``)
+are written and no row is deleted, so the rows referenced by addresses and
+child tables stay in place. A replace deletes the imported tables (children
+first) and inserts the dumps, all in one transaction; it fails while other
+rows still reference the deleted ones and foreign keys are enforced.
+"""
+# https://github.com/dr5hn/countries-states-cities-database
+import csv
+import gzip
+import json
+import os
+import time
+from contextlib import nullcontext
+from datetime import datetime
+import sqlalchemy as sa
+from app import db
+import app.models as mo
+
+# Load order respects the foreign keys between the tables.
+TABLES = [
+    ('regions', mo.Regions),
+    ('subregions', mo.Subregions),
+    ('countries', mo.Countries),
+    ('states', mo.States),
+    ('cities', mo.Cities),
+]
+
+# Upstream field names that differ from our column names, per table.
+ALIASES = {
+    'states': {'state_code': 'iso2'},
+}
+
+# Columns that are never used to decide whether a row has changed.
+IGNORED_IN_COMPARE = {'created_at', 'updated_at'}
+
+DEFAULT_BATCH_SIZE = 5000
+
+
+def open_dump(path):
+    """Open a (possibly gzipped) dump file for text reading."""
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', newline='')
+    return open(path, 'r', encoding='utf-8', newline='')
+
+
+def iter_json_array(fp, chunk_size=1 << 16):
+    """Yield the elements of a top level JSON array without loading the whole file."""
+    decoder = json.JSONDecoder()
+    buf = ''
+    pos = 0
+    started = False
+    eof = False
+    while True:
+        while pos < len(buf) and buf[pos] in ' \t\r\n,':
+            pos += 1
+        if not started and pos < len(buf):
+            if buf[pos] != '[':
+                raise ValueError('Expected a JSON array')
+            started = True
+            pos += 1
+            continue
+        if started and pos < len(buf) and buf[pos] == ']':
+            return
+        try:
+            if pos >= len(buf):
+                raise ValueError('need more data')
+            obj, end = decoder.raw_decode(buf, pos)
+        except ValueError:
+            if eof:
+                if buf[pos:].strip():
+                    raise
+                return
+            chunk = fp.read(chunk_size)
+            eof = not chunk
+            buf = buf[pos:] + chunk
+            pos = 0
+            continue
+        yield obj
+        pos = end
+
+
+def iter_records(path):
+    """Yield dict records from a JSON or CSV dump."""
+    with open_dump(path) as fp:
+        if '.csv' in os.path.basename(path):
+            yield from csv.DictReader(fp)
+        else:
+            yield from iter_json_array(fp)
+
+
+def find_dump(directory, name):
+    """Return the dump file for a table in directory, or None."""
+    for ext in ('.json', '.csv', '.json.gz', '.csv.gz'):
+        path = os.path.join(directory, name + ext)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def _coercer(column):
+    """Return a function converting a raw dump value to the column's type."""
+    type_ = column.type
+    if isinstance(type_, sa.Boolean):
+        return lambda v: v if isinstance(v, bool) else str(v).strip().lower() in ('1', 'true', 't', 'yes')
+    if isinstance(type_, sa.Integer):
+        return lambda v: int(v)
+    if isinstance(type_, sa.Numeric):
+        return lambda v: float(v)
+    if isinstance(type_, (sa.DateTime, sa.TIMESTAMP)):
+        return lambda v: v if isinstance(v, datetime) else datetime.fromisoformat(str(v).replace('Z', '+00:00'))
+    # Nested JSON (timezones, translations) is stored as text.
+    return lambda v: v if isinstance(v, str) else json.dumps(v, ensure_ascii=False)
+
+
+class TableImporter:
+    """Streams one dump into one table."""
+
+    def __init__(self, name, model, batch_size=DEFAULT_BATCH_SIZE, replace=False, echo=print):
+        self.name = name
+        self.table = model.__table__
+        self.batch_size = batch_size
+        self.replace = replace
+        self.echo = echo
+        self.aliases = ALIASES.get(name, {})
+        self.coercers = {c.name: _coercer(c) for c in self.table.columns}
+        self.inserted = self.updated = self.unchanged = 0
+
+    def convert(self, record, keys):
+        """Map a raw record onto the fixed key set of this import."""
+        row = {}
+        for key in keys:
+            value = record.get(key)
+            if value is None:
+                for src, dst in self.aliases.items():
+                    if dst == key and record.get(src) not in (None, ''):
+                        value = record[src]
+            if value is None or value == '':
+                row[key] = None
+            else:
+                row[key] = self.coercers[key](value)
+        return row
+
+    def keys_for(self, record):
+        """The table columns present in the first record of the dump."""
+        present = set(record) | {self.aliases[k] for k in record if k in self.aliases}
+        return [c.name for c in self.table.columns if c.name in present]
+
+    def _existing(self, conn, keys):
+        compare = [k for k in keys if k not in IGNORED_IN_COMPARE and k != 'id']
+        cols = [self.table.c.id] + [self.table.c[k] for k in compare]
+        by_id = {}
+        by_wikidata = {}
+        for row in conn.execute(sa.select(*cols)):
+            by_id[row[0]] = tuple(_normalize(v) for v in row[1:])
+            if 'wikiDataId' in compare:
+                wikidata = row[1 + compare.index('wikiDataId')]
+                if wikidata:
+                    by_wikidata[wikidata] = row[0]
+        return compare, by_id, by_wikidata
+
+    def _report(self, started):
+        self.echo(f'{self.name}: {self.inserted + self.updated + self.unchanged} rows '
+                  f'(inserted {self.inserted}, updated {self.updated}, unchanged {self.unchanged}) '
+                  f'{time.monotonic() - started:.1f}s')
+
+    def run(self, records, conn=None):
+        """Import records in a single transaction, conn's if given."""
+        started = time.monotonic()
+        records = iter(records)
+        first = next(records, None)
+        if first is None:
+            self.echo(f'{self.name}: empty dump, skipped')
+            return self
+        keys = self.keys_for(first)
+        insert = sa.insert(self.table)
+        with nullcontext(conn) if conn is not None else db.engine.begin() as conn:
+            if self.replace:
+                conn.execute(sa.delete(self.table))
+            else:
+                compare, by_id, by_wikidata = self._existing(conn, keys)
+                update = (sa.update(self.table)
+                          .where(self.table.c.id == sa.bindparam('_id'))
+                          .values({k: sa.bindparam(k) for k in keys if k != 'id'}))
+            inserts, updates = [], []
+
+            def flush():
+                if inserts:
+                    conn.execute(insert, inserts)
+                    self.inserted += len(inserts)
+                    inserts.clear()
+                if updates:
+                    conn.execute(update, updates)
+                    self.updated += len(updates)
+                    updates.clear()
+                self._report(started)
+
+            for record in _chain(first, records):
+                row = self.convert(record, keys)
+                if not self.replace:
+                    row_id = row.get('id')
+                    if row_id not in by_id and row.get('wikiDataId') in by_wikidata:
+                        row_id = row['id'] = by_wikidata[row['wikiDataId']]
+                    current = by_id.get(row_id)
+                    if current is None:
+                        inserts.append(row)
+                    elif current == tuple(_normalize(row[k]) for k in compare):
+                        self.unchanged += 1
+                    else:
+                        row['_id'] = row_id
+                        updates.append(row)
+                else:
+                    inserts.append(row)
+                if len(inserts) + len(updates) >= self.batch_size:
+                    flush()
+            flush()
+        return self
+
+
+def _chain(first, rest):
+    yield first
+    yield from rest
+
+
+def _normalize(value):
+    """Make DB and dump values comparable (Decimal vs float, etc.)."""
+    if isinstance(value, bool) or value is None:
+        return value
+    if isinstance(value, (int, float)) or type(value).__name__ == 'Decimal':
+        return round(float(value), 8)
+    return value
+
+
+def import_geo(directory, tables=None, batch_size=DEFAULT_BATCH_SIZE, replace=False, echo=print):
+    """Import every table that has a dump in directory; return the importers run."""
+    found = []
+    for name, model in TABLES:
+        if tables and name not in tables:
+            continue
+        path = find_dump(directory, name)
+        if path is None:
+            echo(f'{name}: no dump found in {directory}, skipped')
+            continue
+        found.append((name, model, path))
+    if not replace:
+        return [_import(name, model, path, batch_size, False, echo) for name, model, path in found]
+    with db.engine.begin() as conn:
+        for name, model, _ in reversed(found):
+            echo(f'{name}: deleted {conn.execute(sa.delete(model.__table__)).rowcount} rows')
+        return [_import(name, model, path, batch_size, True, echo, conn) for name, model, path in found]
+
+
+def _import(name, model, path, batch_size, replace, echo, conn=None):
+    echo(f'{name}: loading {path}')
+    return TableImporter(name, model, batch_size, replace, echo).run(iter_records(path), conn)
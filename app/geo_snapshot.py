@@ -0,0 +1,202 @@
+# app/geo_snapshot.py
+"""
+This module writes and maps the columnar geo snapshot file.
+
+``flask geo-snapshot`` dumps the geo tables into a single file of fixed-width
+little-endian columns: int32 ids, float32 latitude/longitude, and int64
+offsets into string pools for the names. The file also holds the
+pre-serialized per-state city lists and the sorted typeahead keys. Cities are
+stored in grid-cell order, so the nearest-city index uses the columns as they
+are.
+
+Workers map the file read-only. Its pages live in the OS page cache and are
+shared by every process, instead of each worker building ~150k Python
+objects. Only the small countries and states tables, stored as a JSON
+section, are still loaded into dicts.
+
+Layout: a header (magic, section count), a directory of (name, offset,
+length) entries, then the 8-byte aligned sections.
+"""
+import bisect
+import json
+import mmap
+import os
+import struct
+from collections.abc import Mapping
+import numpy as np
+from app.geo import City, GeoData, PrefixIndex
+from app.geo_spatial import SpatialIndex
+
+MAGIC = b'SIMSGEO\x01'
+HEADER = struct.Struct('<8sII')
+ENTRY = struct.Struct('<16sQQ')
+ALIGN = 8
+
+
+def _align(pos):
+    return (pos + ALIGN - 1) // ALIGN * ALIGN
+
+
+def _string_pool(values):
+    """Encode strings as (int64 offsets, utf-8 blob); value i is blob[off[i]:off[i + 1]]."""
+    encoded = [(value or '').encode('utf-8') for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype='<i8')
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    return offsets.tobytes(), b''.join(encoded)
+
+
+def write_snapshot(path, sections):
+    """Write named byte sections to path, replacing any previous file atomically."""
+    names = list(sections)
+    pos = _align(HEADER.size + ENTRY.size * len(names))
+    directory = []
+    for name in names:
+        directory.append((name, pos, len(sections[name])))
+        pos = _align(pos + len(sections[name]))
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(names), 0))
+        for name, offset, length in directory:
+            f.write(ENTRY.pack(name.encode('ascii'), offset, length))
+        for name, offset, length in directory:
+            f.write(b'\0' * (offset - f.tell()))
+            f.write(sections[name])
+    os.replace(tmp, path)
+
+
+def build_snapshot(path):
+    """Snapshot the geo tables into path; return the number of cities written."""
+    country_rows, state_rows, city_rows = GeoData.query_rows()
+    data = GeoData(0, country_rows, state_rows, {row[0]: City(*row) for row in city_rows})
+    spatial = SpatialIndex.from_db()
+    prefix = PrefixIndex(data)
+
+    # City columns in grid order, plus an id-sorted permutation for lookups by id.
+    ids = spatial.ids.astype('<i4')
+    cities = [data.cities[int(city_id)] for city_id in ids]
+    by_id = np.argsort(ids, kind='stable').astype('<i4')
+    state_ids = sorted(data.cities_json)
+
+    sections = {
+        'meta': json.dumps({'countries': [list(row) for row in country_rows],
+                            'states': [list(row) for row in state_rows]}).encode('utf-8'),
+        'city_id': ids.tobytes(),
+        'city_state': np.array([c.state_id for c in cities], dtype='<i4').tobytes(),
+        'city_country': np.array([c.country_id for c in cities], dtype='<i4').tobytes(),
+        'city_lat': spatial.lats.astype('<f4').tobytes(),
+        'city_lon': spatial.lons.astype('<f4').tobytes(),
+        'city_sorted': ids[by_id].tobytes(),
+        'city_row': by_id.tobytes(),
+        'grid_starts': np.asarray(spatial.starts, dtype='<i8').tobytes(),
+        'json_state': np.array(state_ids, dtype='<i4').tobytes(),
+        'prefix_ref': np.array(prefix.ids, dtype='<i4').tobytes(),
+    }
+    for name, values in (('city_name', [c.name for c in cities]),
+                         ('city_code', [c.state_code for c in cities]),
+                         ('prefix', prefix.keys)):
+        sections[name + '.off'], sections[name + '.str'] = _string_pool(values)
+    sections['json.off'], sections['json.str'] = _string_pool(
+        data.cities_json[sid].decode('utf-8') for sid in state_ids)
+    write_snapshot(path, sections)
+    return len(cities)
+
+
+class StringColumn:
+    """Read-only sequence of the strings in a pool, decoded on access."""
+
+    def __init__(self, offsets, blob):
+        self.offsets = offsets
+        self.blob = blob
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return str(self.blob[self.offsets[i]:self.offsets[i + 1]], 'utf-8')
+
+
+class PayloadMap:
+    """Read-only state id -> pre-serialized JSON bytes mapping over the snapshot."""
+
+    def __init__(self, keys, offsets, blob):
+        self.keys = keys
+        self.offsets = offsets
+        self.blob = blob
+
+    def get(self, key, default=None):
+        i = bisect.bisect_left(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            return self.blob[self.offsets[i]:self.offsets[i + 1]].tobytes()
+        return default
+
+
+class SnapshotCities(Mapping):
+    """Read-only city id -> City mapping over the snapshot columns."""
+
+    def __init__(self, snapshot):
+        self.sorted_ids = snapshot.column('city_sorted', 'i')
+        self.rows = snapshot.column('city_row', 'i')
+        self.state_ids = snapshot.column('city_state', 'i')
+        self.country_ids = snapshot.column('city_country', 'i')
+        self.names = snapshot.strings('city_name')
+        self.codes = snapshot.strings('city_code')
+
+    def __getitem__(self, city_id):
+        i = bisect.bisect_left(self.sorted_ids, city_id)
+        if i == len(self.sorted_ids) or self.sorted_ids[i] != city_id:
+            raise KeyError(city_id)
+        row = self.rows[i]
+        return City(city_id, self.names[row], self.state_ids[row], self.country_ids[row], self.codes[row] or None)
+
+    def __iter__(self):
+        return iter(self.sorted_ids)
+
+    def __len__(self):
+        return len(self.sorted_ids)
+
+
+class GeoSnapshot:
+    """A snapshot file mapped read-only into this process."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count, _ = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not a geo snapshot')
+        self.buffer = memoryview(self.mm)
+        self.sections = {}
+        for i in range(count):
+            name, offset, length = ENTRY.unpack_from(self.mm, HEADER.size + i * ENTRY.size)
+            self.sections[name.rstrip(b'\0').decode('ascii')] = (offset, length)
+
+    def raw(self, name):
+        """A zero-copy view of a section's bytes."""
+        offset, length = self.sections[name]
+        return self.buffer[offset:offset + length]
+
+    def column(self, name, fmt):
+        """A zero-copy typed view of a section (struct format, e.g. 'i')."""
+        return self.raw(name).cast(fmt)
+
+    def array(self, name, dtype):
+        """A zero-copy read-only NumPy view of a section."""
+        offset, length = self.sections[name]
+        dtype = np.dtype(dtype)
+        return np.frombuffer(self.mm, dtype=dtype, count=length // dtype.itemsize, offset=offset)
+
+    def strings(self, name):
+        return StringColumn(self.column(name + '.off', 'q'), self.raw(name + '.str'))
+
+    def geo_data(self, version):
+        """Build the GeoData backed by this snapshot."""
+        meta = json.loads(bytes(self.raw('meta')))
+        cities_json = PayloadMap(self.column('json_state', 'i'), self.column('json.off', 'q'), self.raw('json.str'))
+        return GeoData(version, meta['countries'], meta['states'], SnapshotCities(self), cities_json, snapshot=self)
+
+    def prefix_index(self, data):
+        return PrefixIndex(data, self.strings('prefix'), self.column('prefix_ref', 'i'))
+
+    def spatial_index(self):
+        return SpatialIndex.from_sorted(self.array('city_id', '<i4'), self.array('city_lat', '<f4'),
+                                        self.array('city_lon', '<f4'), self.array('grid_starts', '<i8'))
@@ -0,0 +1,133 @@
+# app/geo_spatial.py
+"""
+This module provides nearest-city lookups over the Cities coordinates.
+
+City coordinates are held in NumPy arrays bucketed into a 1 x 1 degree grid
+(points sorted by cell, with a cell -> offset table). A query scans rings of
+cells outward from the query point and computes haversine distances for the
+candidates in one vectorized step, stopping as soon as the k-th best distance
+is no larger than the distance to anything outside the scanned block.
+"""
+import math
+import numpy as np
+import sqlalchemy as sa
+from app import db
+import app.models as mo
+
+EARTH_RADIUS_KM = 6371.0088
+ROWS, COLS = 180, 360
+
+
+def haversine_km(lat, lon, lats, lons):
+    """Great-circle distance from (lat, lon) to each of lats/lons (all in degrees)."""
+    lat1 = math.radians(lat)
+    lat2 = np.radians(lats)
+    dlat = lat2 - lat1
+    dlon = np.radians(lons - lon)
+    a = np.sin(dlat / 2) ** 2 + math.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def _cells(lats, lons):
+    rows = np.clip(np.floor(lats).astype(np.int64) + 90, 0, ROWS - 1)
+    cols = (np.floor(lons).astype(np.int64) + 180) % COLS
+    return rows * COLS + cols
+
+
+class SpatialIndex:
+    """Grid index over city ids and coordinates."""
+
+    def __init__(self, ids, lats, lons):
+        ids = np.asarray(ids, dtype=np.int32)
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        cells = _cells(lats, lons)
+        order = np.argsort(cells, kind='stable')
+        self.ids = ids[order]
+        self.lats = lats[order]
+        self.lons = lons[order]
+        self.starts = np.searchsorted(cells[order], np.arange(ROWS * COLS + 1))
+
+    @classmethod
+    def from_db(cls):
+        """Build the index from the Cities table with a single query."""
+        rows = db.session.execute(sa.select(
+            mo.Cities.id, sa.cast(mo.Cities.latitude, sa.Float), sa.cast(mo.Cities.longitude, sa.Float))).all()
+        if not rows:
+            return cls([], [], [])
+        ids, lats, lons = zip(*rows)
+        return cls(ids, np.array(lats, dtype=np.float64), np.array(lons, dtype=np.float64))
+
+    @classmethod
+    def from_sorted(cls, ids, lats, lons, starts):
+        """Wrap arrays that are already in grid order (e.g. views of a geo snapshot) without copying."""
+        index = cls.__new__(cls)
+        index.ids, index.lats, index.lons, index.starts = ids, lats, lons, starts
+        return index
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _ring(self, row, col, r):
+        """Indexes of the points in the cells exactly r rings away from (row, col)."""
+        parts = []
+        for rr in range(row - r, row + r + 1):
+            if rr < 0 or rr >= ROWS:
+                continue
+            if abs(rr - row) == r:
+                # A row first reached by this ring: take its whole span.
+                cols = range(COLS) if 2 * r + 1 >= COLS else [c % COLS for c in range(col - r, col + r + 1)]
+            elif r <= COLS // 2:
+                # A row already scanned: only the two new edge columns (one once they meet).
+                cols = {(col - r) % COLS, (col + r) % COLS}
+            else:
+                continue
+            base = rr * COLS
+            for c in cols:
+                start, end = self.starts[base + c], self.starts[base + c + 1]
+                if start != end:
+                    parts.append(np.arange(start, end))
+        return parts
+
+    @staticmethod
+    def _outside_bound_km(lat, lon, row, col, r):
+        """A lower bound on the distance to any point outside the scanned block."""
+        bounds = []
+        south = (row - r) - 90
+        north = (row + r + 1) - 90
+        if south > -90:
+            bounds.append(lat - south)
+        if north < 90:
+            bounds.append(north - lat)
+        lat_km = math.radians(min(bounds)) * EARTH_RADIUS_KM if bounds else math.inf
+        if 2 * r + 1 >= COLS:
+            return lat_km
+        west = (col - r) - 180
+        east = (col + r + 1) - 180
+        dlon = math.radians(min(min(lon - west, east - lon), 90.0))
+        # Distance from the point to the nearest meridian bounding the block.
+        lon_km = math.asin(min(1.0, abs(math.cos(math.radians(lat))) * math.sin(dlon))) * EARTH_RADIUS_KM
+        return min(lat_km, lon_km)
+
+    def nearest(self, lat, lon, k=5):
+        """Return [(city_id, distance_km), ...] for the k nearest cities."""
+        if not len(self) or k <= 0:
+            return []
+        k = min(k, len(self))
+        [cell] = _cells(np.array([lat]), np.array([lon]))
+        row, col = divmod(int(cell), COLS)
+        cand_idx = np.empty(0, dtype=np.int64)
+        cand_dist = np.empty(0, dtype=np.float64)
+        for r in range(max(ROWS, COLS // 2) + 1):
+            parts = self._ring(row, col, r)
+            if parts:
+                idx = np.concatenate(parts)
+                cand_idx = np.concatenate((cand_idx, idx))
+                cand_dist = np.concatenate((cand_dist, haversine_km(lat, lon, self.lats[idx], self.lons[idx])))
+            if len(cand_idx) >= k:
+                kth = np.partition(cand_dist, k - 1)[k - 1]
+                if kth <= self._outside_bound_km(lat, lon, row, col, r):
+                    break
+        top = np.argpartition(cand_dist, k - 1)[:k] if len(cand_dist) > k else np.arange(len(cand_dist))
+        top = top[np.argsort(cand_dist[top], kind='stable')]
+        return [(int(self.ids[cand_idx[i]]), float(cand_dist[i])) for i in top]
@@ -0,0 +1,124 @@
+# app/identity.py
+"""
+This module caches the logged-in users behind Flask-Login's ``user_loader``.
+
+A user is loaded once, with one statement that eagerly loads contact,
+password and roles (with their Role). The result is kept per worker as a
+detached copy for ``USER_CACHE_TTL`` seconds. Each request gets its own
+session-bound instance through ``Session.merge(load=False)``, which copies
+the cached state without a database roundtrip.
+
+When a user's User, Contact, Password or UserRole rows change, the user is
+evicted from this worker's cache on commit; a change to any Role clears it.
+Other workers see the change once their entry expires. Values derived from
+a cached user (``derived()``, e.g. the authz grants) go with it.
+"""
+import threading
+import time
+from collections import OrderedDict
+import sqlalchemy as sa
+import sqlalchemy.orm as so
+from flask import current_app
+from app import db
+import app.models as mo
+
+MAX_USERS = 10000
+
+
+class UserCache:
+    """Per-worker TTL cache of detached, eagerly loaded User objects."""
+
+    def __init__(self, max_users=MAX_USERS):
+        self.max_users = max_users
+        self._lock = threading.Lock()
+        self._users = OrderedDict()
+
+    @staticmethod
+    def _load(user_id):
+        stmt = (sa.select(mo.User).where(mo.User.id == user_id)
+                .options(so.joinedload(mo.User.contact), so.joinedload(mo.User.password),
+                         so.joinedload(mo.User.roles).joinedload(mo.UserRole.role)))
+        with so.Session(db.engine, expire_on_commit=False) as session:
+            return session.scalars(stmt).unique().first()
+
+    def _entry(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._users.get(user_id)
+        if entry is None or entry[0] <= now:
+            user = self._load(user_id)
+            if user is None:
+                return None
+            # [expires, detached user, derived values such as authz grants]
+            entry = [now + current_app.config['USER_CACHE_TTL'], user, {}]
+            with self._lock:
+                self._users[user_id] = entry
+                self._users.move_to_end(user_id)
+                while len(self._users) > self.max_users:
+                    self._users.popitem(last=False)
+        return entry
+
+    def get(self, user_id):
+        """Return the User for user_id bound to the current session, or None."""
+        entry = self._entry(user_id)
+        return None if entry is None else db.session.merge(entry[1], load=False)
+
+    def derived(self, user_id, key, build):
+        """build(cached user), computed once per cache entry, so it is dropped with the user."""
+        entry = self._entry(user_id)
+        if entry is None:
+            return None
+        value = entry[2].get(key)
+        if value is None:
+            value = entry[2][key] = build(entry[1])
+        return value
+
+    def evict(self, user_id):
+        with self._lock:
+            self._users.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
+
+
+user_cache = UserCache()
+
+
+def _user_id(target):
+    return target.id if isinstance(target, mo.User) else target.user_id
+
+
+def _mark_changed(mapper, connection, target):
+    session = so.object_session(target)
+    if session is not None:
+        session.info.setdefault('identity_changed', set()).add(_user_id(target))
+
+
+for _model in (mo.User, mo.Contact, mo.Password, mo.UserRole):
+    for _event in ('after_insert', 'after_update', 'after_delete'):
+        sa.event.listen(_model, _event, _mark_changed)
+
+
+def _mark_roles_changed(mapper, connection, target):
+    session = so.object_session(target)
+    if session is not None:
+        session.info['roles_changed'] = True
+
+
+for _event in ('after_insert', 'after_update', 'after_delete'):
+    sa.event.listen(mo.Role, _event, _mark_roles_changed)
+
+
+@sa.event.listens_for(so.Session, 'after_commit')
+def _evict_changed(session):
+    if session.info.pop('roles_changed', False):
+        user_cache.clear()
+    for user_id in session.info.pop('identity_changed', ()):
+        user_cache.evict(user_id)
+
+
+@sa.event.listens_for(so.Session, 'after_rollback')
+def _forget_changed(session):
+    session.info.pop('identity_changed', None)
+    session.info.pop('roles_changed', None)
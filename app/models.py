@@ -18,15 +18,15 @@ from app import db, login
 from datetime import datetime, timezone
 from flask_login import UserMixin
 from typing import Optional
-from werkzeug.security import generate_password_hash, check_password_hash
 from sqlalchemy_utils import EmailType
 from sqlalchemy import BigInteger
 
 
 @login.user_loader
 def load_user(user_id):
-    """Load user."""
-    return db.session.get(User, int(user_id))
+    """Load user (from the per-worker identity cache, see app/identity.py)."""
+    from app.identity import user_cache
+    return user_cache.get(int(user_id))
 
 class BaseModel(db.Model):
     """Base model for other models to inherit from."""
@@ -91,8 +91,8 @@ class Contact(BaseModel):
     __table_args__ = {'extend_existing': True}
     id: so.Mapped[int] = so.mapped_column(primary_key=True)
     user_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey('user.id'), unique=True, nullable=False)
-    mobile: so.Mapped[int] = so.mapped_column(sa.BigInteger, nullable=False)
-    whatsapp: so.Mapped[int] = so.mapped_column(sa.BigInteger, nullable=False)
+    mobile: so.Mapped[int] = so.mapped_column(sa.BigInteger, nullable=False, index=True)
+    whatsapp: so.Mapped[int] = so.mapped_column(sa.BigInteger, nullable=False, index=True)
     email: so.Mapped[str] = so.mapped_column(sa.String(256), unique=True, nullable=False, index=True)
 
     user: so.Mapped['User'] = so.relationship('User', back_populates='contact', foreign_keys=[user_id])
@@ -116,11 +116,18 @@ class Password(db.Model):
 
     def set_password(self, password):
         """Set password."""
-        self.password_hash = generate_password_hash(password)
+        from app.passwords import hasher
+        self.password_hash = hasher.hash(password)
 
     def check_password(self, password):
         """Check password."""
-        return check_password_hash(self.password_hash, password)
+        from app.passwords import hasher
+        return hasher.verify(self.password_hash, password)
+
+    def needs_rehash(self):
+        """Whether the hash was made with other than the configured method and cost."""
+        from app.passwords import hasher
+        return hasher.needs_rehash(self.password_hash)
 
 
 class HomeAddress(BaseModel):
@@ -287,6 +294,12 @@ class CallOutTime(BaseModel):
 
     user: so.Mapped['User'] = so.relationship(back_populates='callout_time', foreign_keys=[user_id])
 
+    @property
+    def hours_utc(self):
+        """The call-out time converted to UTC using the timezone registry."""
+        from app.geo import cache
+        return cache.timezones.to_utc(self.hours, self.timezone)
+
     def __repr__(self):
         return f'<CallOutTime UserID: {self.user_id} Hours: {self.hours}>'
 
@@ -317,7 +330,7 @@ class TestSession(BaseModel):
 
 class TestSessionScore(BaseModel):
     """TestSessionScore model."""
-    __table_args__ = {'extend_existing': True}
+    __table_args__ = (sa.UniqueConstraint('test_session_id', 'user_id'), {'extend_existing': True})
     id: so.Mapped[int] = so.mapped_column(primary_key=True)
     test_session_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey('test_session.id'), nullable=False)
     user_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey('user.id'), nullable=False)
@@ -337,7 +350,7 @@ class Task(BaseModel):
     name: so.Mapped[str] = so.mapped_column(sa.String(64), nullable=False)
     description: so.Mapped[str] = so.mapped_column(sa.Text, nullable=True)
     class_batch_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey('class_batch.id'), nullable=False)
-    due_date: so.Mapped[datetime] = so.mapped_column(sa.Date, nullable=False)
+    due_date: so.Mapped[datetime] = so.mapped_column(sa.Date, index=True, nullable=False)
 
     class_batch: so.Mapped['ClassBatch'] = so.relationship()
 
@@ -555,6 +568,18 @@ class UserRole(BaseModel):
     class_batch: so.Mapped['ClassBatch'] = so.relationship(foreign_keys=[class_batch_id])
     class_group: so.Mapped['ClassGroup'] = so.relationship(foreign_keys=[class_group_id])
 
+class DashboardStat(db.Model):
+    """Materialized dashboard counter, kept current by app/stats.py."""
+    __table_args__ = {'extend_existing': True}
+    key: so.Mapped[str] = so.mapped_column(sa.String(64), primary_key=True)
+    value: so.Mapped[int] = so.mapped_column(sa.BigInteger, nullable=False, default=0)
+
+class TableVersion(db.Model):
+    """Modification version of a table, bumped on commit by app/table_versions.py."""
+    __table_args__ = {'extend_existing': True}
+    table_name: so.Mapped[str] = so.mapped_column(sa.String(64), primary_key=True)
+    version: so.Mapped[int] = so.mapped_column(sa.BigInteger, nullable=False, default=0)
+
 class Message(BaseModel):
     """Message model."""
     __table_args__ = {'extend_existing': True}
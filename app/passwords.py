@@ -0,0 +1,100 @@
+# app/passwords.py
+"""
+This module hashes and verifies passwords on a bounded worker pool.
+
+Werkzeug's scrypt/pbkdf2 are CPU bound. Running them on the request thread
+lets a login burst start one hash per request thread at once. Here they run
+on a pool of ``PASSWORD_HASH_WORKERS`` threads (hashlib releases the GIL while
+hashing) or processes, so at most that many hashes run at a time and the
+rest wait in the pool's queue.
+
+The algorithm and cost come from ``PASSWORD_HASH_METHOD`` (any werkzeug
+method string, e.g. 'scrypt:32768:8:1' or 'pbkdf2:sha256:600000'). A stored
+hash made with other parameters ``needs_rehash()``; the login route rehashes
+it with the password the user just proved.
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from flask import current_app, has_app_context
+from werkzeug.security import generate_password_hash, check_password_hash
+
+DEFAULT_METHOD = 'scrypt:32768:8:1'
+EXECUTORS = ('thread', 'process', 'inline')
+
+
+class PasswordHasher:
+    """Runs werkzeug's password hashing on a lazily created, per-worker pool."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pool = None
+        self._settings = None
+        self._prefixes = {}
+
+    @staticmethod
+    def settings():
+        """(method, workers, executor) from the app config."""
+        config = current_app.config if has_app_context() else {}
+        executor = config.get('PASSWORD_HASH_EXECUTOR', 'thread')
+        if executor not in EXECUTORS:
+            raise ValueError(f'PASSWORD_HASH_EXECUTOR must be one of {EXECUTORS}, not {executor!r}')
+        workers = config.get('PASSWORD_HASH_WORKERS') or os.cpu_count() or 1
+        return config.get('PASSWORD_HASH_METHOD', DEFAULT_METHOD), workers, executor
+
+    def _executor(self, workers, executor):
+        if executor == 'inline':
+            return None
+        with self._lock:
+            if self._settings != (workers, executor):
+                if self._pool is not None:
+                    self._pool.shutdown(wait=False)
+                if executor == 'process':
+                    # spawn: forking a process that holds threads and DB connections is unsafe
+                    self._pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'))
+                else:
+                    self._pool = ThreadPoolExecutor(workers, thread_name_prefix='password-hash')
+                self._settings = (workers, executor)
+            return self._pool
+
+    def _run(self, fn, *args):
+        method, workers, executor = self.settings()
+        pool = self._executor(workers, executor)
+        if pool is None:
+            return fn(*args)
+        return pool.submit(fn, *args).result()
+
+    def hash(self, password):
+        """Hash password with the configured method."""
+        return self._run(generate_password_hash, password, self.settings()[0])
+
+    def verify(self, password_hash, password):
+        """Check password against a stored hash of any supported method."""
+        if not password_hash:
+            return False
+        return self._run(check_password_hash, password_hash, password)
+
+    def prefix(self, method):
+        """The method prefix werkzeug stores for method, e.g. 'scrypt' -> 'scrypt:32768:8:1'."""
+        prefix = self._prefixes.get(method)
+        if prefix is None:
+            # werkzeug fills in the default parameters, so read them off one hash per method.
+            prefix = self._prefixes[method] = generate_password_hash('', method).partition('$')[0]
+        return prefix
+
+    def needs_rehash(self, password_hash):
+        """Whether a stored hash was made with other than the configured method and cost."""
+        if not password_hash:
+            return False
+        return password_hash.partition('$')[0] != self.prefix(self.settings()[0])
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+            self._pool = None
+            self._settings = None
+
+
+hasher = PasswordHasher()
@@ -13,15 +13,17 @@ import json
 import time
 import logging
 from urllib.parse import urlsplit
-from flask import render_template, flash, redirect, url_for, request, send_file, jsonify, current_app, session
+from flask import render_template, flash, redirect, url_for, request, send_file, jsonify, current_app, session, stream_with_context
 from app.config import Config
 
 # Configure logging
 logging.basicConfig(filename=Config.LOGFILE, level=logging.INFO,
                     format='%(asctime)s - %(levelname)s - %(message)s')
-from io import BytesIO
+from io import BytesIO, TextIOWrapper
+from werkzeug.utils import secure_filename
 from flask_login import login_user, logout_user, current_user, login_required
 import sqlalchemy as sa
+import sqlalchemy.orm as so
 from app import db, captcha
 from app.forms import ClassNameForm, ClassBatchForm, ClassRegionForm, ClassGroupForm, ClassGroupMentorForm, UserStatusForm, StudentGroupForm, ClassBatchTeacherForm, RoleForm, UserRoleForm, ClassBatchStatusForm, BatchForm, ReferrerSearchForm, UpdateReferrerForm
 from app.models import ClassName, ClassBatch, ClassRegion, ClassGroup, ClassGroupMentor, StudentGroup, ClassBatchTeacher, Role, UserRole, ClassBatchStatus, UserStatusLookup, RegStatusLookup, Referrer
@@ -30,9 +32,23 @@ from app.models import ClassName, ClassBatch, ClassRegion, ClassGroup, ClassGrou
 import app.forms as fo
 import app.models as mo
 from . import forms
+from . import geo
+from . import sessions
+from . import stats
+from . import chart_cache
+from . import attendance_analytics
+from . import score_analytics
+from . import calendar_feed
+from . import exports
+from . import attendance_marking
+from . import score_import
 # from flask_debugtoolbar import DebugToolbarExtension
 from functions.parse_wa_text import parse_wa_text_fn
-from werkzeug.security import generate_password_hash, check_password_hash
+from app.wa_import import WaImporter, iter_chat_blocks
+from app.passwords import hasher
+from app.throttle import throttle
+from app.dedup import normalize_email
+from app.authz import Perm, current_grants, permission_required
 
 
 @current_app.route('/')
@@ -61,23 +77,41 @@ def login():
         return redirect(url_for('index'))
     form = fo.LoginForm()
     if form.validate_on_submit():
+        # Over-limit attempts are turned away before the captcha, the DB and the hasher.
+        email = normalize_email(form.email.data)
+        retry_after = throttle.attempt(email, request.remote_addr)
+        if retry_after:
+            flash(f'Too many login attempts. Please try again in {int(retry_after) + 1} seconds.', 'danger')
+            logging.info(f"Login throttled for email: {form.email.data} from IP: {request.remote_addr} User-Agent: {request.user_agent}") # Log throttled
+            return render_template('login.html', title='Sign In', form=form), 429, {'Retry-After': str(int(retry_after) + 1)}
+        throttle.maybe_flush()
         if captcha.validate():
+            # One statement for the user, contact and password.
             user = db.session.scalar(
-                sa.select(mo.User).join(mo.User.contact).where(mo.Contact.email == form.email.data))
-            
+                sa.select(mo.User).join(mo.User.contact).outerjoin(mo.User.password)
+                .options(so.contains_eager(mo.User.contact), so.contains_eager(mo.User.password))
+                .where(mo.Contact.email == email))
+
             if not user:
                 flash('Invalid email or password', 'danger')
                 logging.info(f"Login denied: Invalid email or password for email: {form.email.data} from IP: {request.remote_addr} User-Agent: {request.user_agent}") # Log denied
                 return redirect(url_for('login'))
 
-            password_hash = db.session.scalar(sa.select(mo.Password).where(mo.Password.user_id == user.id))
+            password_hash = user.password
 
             if not password_hash or not mo.Password.check_password(password_hash, form.password.data):
                 flash('Invalid email or password', 'danger')
                 logging.info(f"Login denied: Invalid email or password for email: {form.email.data} from IP: {request.remote_addr} User-Agent: {request.user_agent}") # Log denied
                 return redirect(url_for('login'))
 
+            # Upgrade hashes made with an older method or cost, now that we have the password.
+            if password_hash.needs_rehash():
+                password_hash.set_password(form.password.data)
+                db.session.commit()
+
+            throttle.succeeded(email)
             login_user(user, remember=form.remember_me.data)
+            sessions.regenerate()
             logging.info(f"Login successful for user: {user.username} (email: {form.email.data}) from IP: {request.remote_addr} User-Agent: {request.user_agent}") # Log successful
             next_page = request.args.get('next')
             if not next_page or urlsplit(next_page).netloc != '':
@@ -157,6 +191,7 @@ def select_a_batch():
 
 @current_app.route('/reg_from_wa_text', methods=['GET', 'POST'])
 @login_required
+@permission_required(Perm.REGISTER_STUDENTS, anywhere=True)
 def reg_from_wa_text():
     """Render the reg_from_wa_text page to accept WhatsApp text."""
     form = forms.RegFromWaText()
@@ -164,7 +199,19 @@ def reg_from_wa_text():
         whatsapptext = request.form.get('whatsapptext')
         if whatsapptext:
             d=parse_wa_text_fn(whatsapptext)
+            geo_data = geo.cache.data
+            places = [('hometown_country', 'hometown_state', 'hometown_district'),
+                      ('resident_country', 'resident_state', 'resident_city')]
+            for fields in places:
+                for field, row in zip(fields, geo_data.resolve_place(*(d[f] for f in fields))):
+                    d[field] = row.id if row else None
             form = forms.UserRegForm(data=d)
+            # Offer the states/cities of the resolved parents so the selects show the matches.
+            for country_field, state_field, city_field in places:
+                if d[country_field]:
+                    form[state_field].choices = [(r['id'], r['name']) for r in json.loads(geo_data.states_json.get(d[country_field], geo.EMPTY_JSON))]
+                if d[state_field]:
+                    form[city_field].choices = [(r['id'], r['name']) for r in json.loads(geo_data.cities_json.get(d[state_field], geo.EMPTY_JSON))]
             return render_template('user_reg.html', form=form)
         else:
             flash("Student data is submitted and redirecting")
@@ -195,6 +242,22 @@ def reg_from_wa_text():
     return render_template('reg_from_wa_text.html', form=form)
 
 
+@current_app.route('/reg_from_wa_export', methods=['GET', 'POST'])
+@login_required
+@permission_required(Perm.REGISTER_STUDENTS, anywhere=True)
+def reg_from_wa_export():
+    """Bulk register the students of an exported WhatsApp chat and report the rejected blocks."""
+    form = forms.RegFromWaExport()
+    if form.validate_on_submit():
+        lines = TextIOWrapper(form.file.data.stream, encoding='utf-8-sig', errors='replace')
+        results = WaImporter(current_user.id).run(iter_chat_blocks(lines))
+        registered = sum(1 for r in results if r.status == 'registered')
+        logging.info(f'{current_user.username} bulk registered {registered} of {len(results)} WhatsApp blocks')
+        flash(f'{registered} of {len(results)} registrations imported.')
+        return render_template('reg_from_wa_export.html', form=form, results=results)
+    return render_template('reg_from_wa_export.html', form=form, results=None)
+
+
 @current_app.route('/support', methods=['GET', 'POST'])
 def support():
     """Renders the support page."""
@@ -210,6 +273,7 @@ def support():
 
 @current_app.route('/user_reg', methods=['GET', 'POST'])
 @login_required
+@permission_required(Perm.REGISTER_STUDENTS, anywhere=True)
 def user_reg():
     """Renders the user_reg page"""
     form = forms.UserRegForm()
@@ -249,18 +313,17 @@ def batches_for_class(class_id):
 
 @current_app.route('/api/states_for_country/<int:country_id>')
 def states_for_country(country_id):
-    states = mo.States.query.filter_by(country_id=country_id).all()
-    return jsonify([{'id': state.id, 'name': state.name} for state in states])
+    return geo.json_response(geo.cache.data.states_json.get(country_id, geo.EMPTY_JSON))
 
 
 @current_app.route('/api/cities_for_state/<int:state_id>')
 def cities_for_state(state_id):
-    cities = mo.Cities.query.filter_by(state_id=state_id).all()
-    return jsonify([{'id': city.id, 'name': city.name} for city in cities])
+    return geo.json_response(geo.cache.data.cities_json.get(state_id, geo.EMPTY_JSON))
 
 
 @current_app.route('/password', methods=['GET', 'POST'])
 @login_required
+@permission_required(Perm.MANAGE_PASSWORDS)
 def password():
     """Renders the password page."""
     form = fo.UserSearchForm()
@@ -277,6 +340,7 @@ def password():
 
 @current_app.route('/set_password/<int:user_id>', methods=['GET', 'POST'])
 @login_required
+@permission_required(Perm.MANAGE_PASSWORDS)
 def set_password(user_id):
     """Renders the set_password page."""
     user = db.session.get(mo.User, user_id)
@@ -288,10 +352,10 @@ def set_password(user_id):
         password = db.session.scalar(sa.select(mo.Password).where(mo.Password.user_id == user.id))
         profile_url = url_for('user_profile', username=user.username)
         if password:
-            password.password_hash = generate_password_hash(form.password.data)
+            password.password_hash = hasher.hash(form.password.data)
             flash(f'Password for <a href="{profile_url}">{user.username}</a> updated.')
         else:
-            password = mo.Password(user_id=user.id, password_hash=generate_password_hash(form.password.data))
+            password = mo.Password(user_id=user.id, password_hash=hasher.hash(form.password.data))
             db.session.add(password)
             flash(f'Password for <a href="{profile_url}">{user.username}</a> added.')
         db.session.commit()
@@ -320,10 +384,10 @@ def api_states(country_name):
     Returns:
         A JSON response containing a list of states.
     """
-    country = db.session.scalar(sa.select(mo.Countries).where(mo.Countries.name.ilike(f'%{country_name}%')))
+    data = geo.cache.data
+    country = data.resolve_country(country_name)
     if country:
-        states = db.session.scalars(sa.select(mo.States).where(mo.States.country_id == country.id)).all()
-        return jsonify([{'id': state.id, 'name': state.name} for state in states])
+        return geo.json_response(data.states_json.get(country.id, geo.EMPTY_JSON))
     return jsonify([])
 
 @current_app.route('/api/cities/<country_name>/<int:state_id>')
@@ -338,10 +402,11 @@ def api_cities(country_name, state_id):
     Returns:
         A JSON response containing a list of cities.
     """
-    country = db.session.scalar(sa.select(mo.Countries).where(mo.Countries.name.ilike(f'%{country_name}%')))
-    if country:
-        cities = db.session.scalars(sa.select(mo.Cities).where(mo.Cities.country_id == country.id, mo.Cities.state_id == state_id)).all()
-        return jsonify([{'id': city.id, 'name': city.name} for city in cities])
+    data = geo.cache.data
+    country = data.resolve_country(country_name)
+    state = data.states.get(state_id)
+    if country and state and state.country_id == country.id:
+        return geo.json_response(data.cities_json.get(state_id, geo.EMPTY_JSON))
     return jsonify([])
 
 @current_app.route('/api/location/<int:city_id>')
@@ -355,28 +420,47 @@ def api_location(city_id):
     Returns:
         A JSON response containing the location data.
     """
-    city = db.session.get(mo.Cities, city_id)
-    if city:
-        # tz = [d['gmtOffsetName'] for d in json.loads(city.country.timezones)]
-        return jsonify([{
-            'Country': city.country.name,
-            'ISO3': city.country.iso3,
-            'ISO2': city.country.iso2,
-            # 'Numeric Code': city.country.numeric_code,
-            'Phone Code': city.country.phonecode,
-            'Currency': city.country.currency,
-            'Currency Name': city.country.currency_name,
-            'Capital': city.country.capital,
-            # 'Timezones': ','.join([d['gmtOffsetName']+'|'+d['abbreviation'] for d in json.loads(city.country.timezones)]),
-            'Timezones': city.country.timezones,
-            # 'Nationality': city.country.nationality,
-            # 'Flag': city.country.flag,
-            'CityState': city.state.name,
-            'City': city.name,
-            # 'Latitude': city.latitude,
-            # 'Longitude': city.longitude
-        }])
-    return jsonify([])
+    return geo.json_response(geo.cache.data.location_json(city_id))
+
+@current_app.route('/api/geo/search')
+@login_required
+def api_geo_search():
+    """Typeahead search over city and state names.
+
+    Query args:
+        q (str): The prefix typed so far.
+        limit (int): Maximum number of results (default 10, at most 50).
+        country_id (int): Optionally restrict results to one country.
+
+    Returns:
+        A JSON list of matching cities/states with their state and country.
+    """
+    query = request.args.get('q', '').strip()
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 50)
+    country_id = request.args.get('country_id', type=int)
+    if not query:
+        return jsonify([])
+    return geo.json_response(geo.cache.data.prefix_index.search_json(query, limit, country_id))
+
+@current_app.route('/api/geo/nearest')
+@login_required
+def api_geo_nearest():
+    """Reverse lookup of the cities nearest to a coordinate.
+
+    Query args:
+        lat (float): Latitude in degrees.
+        lon (float): Longitude in degrees.
+        k (int): Number of cities to return (default 5, at most 50).
+
+    Returns:
+        A JSON list of the nearest cities with their distance in km.
+    """
+    lat = request.args.get('lat', type=float)
+    lon = request.args.get('lon', type=float)
+    k = min(max(request.args.get('k', 5, type=int), 1), 50)
+    if lat is None or lon is None or not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return jsonify({'error': 'lat and lon are required and must be valid coordinates'}), 400
+    return jsonify(geo.cache.data.nearest_cities(lat, lon, k))
 
 @current_app.route('/api/class_batches/<int:class_name_id>')
 @login_required
@@ -405,45 +489,217 @@ def api_class_regions(class_batch_id):
 @login_required
 def dashboard():
     """Renders the dashboard page."""
-    num_students = db.session.query(mo.User).count()
-    num_teachers = db.session.query(mo.ClassBatchTeacher).distinct(mo.ClassBatchTeacher.user_id).count()
-    num_classes = db.session.query(mo.ClassName).count()
-    num_batches = db.session.query(mo.ClassBatch).count()
-
-    # Data for charts
-    student_status_data = db.session.query(mo.UserStatus.status, sa.func.count(mo.StudentGroup.id)).join(mo.StudentGroup).group_by(mo.UserStatus.status).all()
-    student_batch_data = db.session.query(mo.ClassBatch.batch_no, sa.func.count(mo.StudentGroup.id)).join(mo.ClassGroup).join(mo.StudentGroup).join(mo.ClassRegion).join(mo.ClassBatch).group_by(mo.ClassBatch.batch_no).all()
-
-    chart_data = {
-        'student_status': {
-            'labels': [status[0] for status in student_status_data],
-            'data': [status[1] for status in student_status_data]
-        },
-        'student_batch': {
-            'labels': [batch[0] for batch in student_batch_data],
-            'data': [batch[1] for batch in student_batch_data]
-        }
-    }
-
+    counts = stats.dashboard_counts()
     return render_template('dashboard.html', title='Dashboard',
-                           num_students=num_students,
-                           num_teachers=num_teachers,
-                           num_classes=num_classes,
-                           num_batches=num_batches,
-                           chart_data=chart_data)
+                           num_students=counts['num_students'],
+                           num_teachers=counts['num_teachers'],
+                           num_classes=counts['num_classes'],
+                           num_batches=counts['num_batches'])
+
+@current_app.route('/api/dashboard/charts')
+@login_required
+def dashboard_charts():
+    """The dashboard chart data, cached until enrollment changes; 304 when the ETag matches."""
+    payload = chart_cache.charts.get()
+    if payload.etag in request.if_none_match:
+        response = current_app.response_class(status=304)
+    else:
+        response = current_app.response_class(payload.body, mimetype='application/json')
+    response.set_etag(payload.etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+def report_batches(endpoint, title):
+    """The class batches the current user may see reports of, linking to endpoint."""
+    batches = db.session.query(mo.ClassBatch).filter(
+        current_grants().filter(Perm.VIEW_REPORTS, batch=mo.ClassBatch.id)).order_by(mo.ClassBatch.id).all()
+    return render_template('report_batches.html', title=title, batches=batches, endpoint=endpoint)
+
+@current_app.route('/reports/attendance')
+@login_required
+@permission_required(Perm.VIEW_REPORTS, anywhere=True)
+def attendance_reports():
+    """Lists the class batches with an attendance report."""
+    return report_batches('attendance_report', 'Attendance Reports')
+
+@current_app.route('/reports/attendance/<int:class_batch_id>')
+@login_required
+@permission_required(Perm.VIEW_REPORTS, anywhere=True)
+def attendance_report(class_batch_id):
+    """Renders the attendance report of a class batch (JSON with ?format=json)."""
+    if not current_grants().can(Perm.VIEW_REPORTS, batch_id=class_batch_id):
+        flash('You are not authorized to perform this action.', 'danger')
+        return redirect(url_for('index'))
+    batch = db.get_or_404(mo.ClassBatch, class_batch_id)
+    report = attendance_analytics.report(class_batch_id)
+    if request.args.get('format') == 'json':
+        return jsonify(report)
+    return render_template('report_attendance.html', title='Attendance Report', batch=batch, report=report)
+
+@current_app.route('/reports/tests')
+@login_required
+@permission_required(Perm.VIEW_REPORTS, anywhere=True)
+def test_reports():
+    """Lists the class batches with a test score report."""
+    return report_batches('test_report', 'Test Reports')
+
+@current_app.route('/reports/tests/<int:class_batch_id>')
+@login_required
+@permission_required(Perm.VIEW_REPORTS, anywhere=True)
+def test_report(class_batch_id):
+    """Renders the test score report of a class batch (JSON with ?format=json, plus per-test scores with &scores=1)."""
+    if not current_grants().can(Perm.VIEW_REPORTS, batch_id=class_batch_id):
+        flash('You are not authorized to perform this action.', 'danger')
+        return redirect(url_for('index'))
+    batch = db.get_or_404(mo.ClassBatch, class_batch_id)
+    as_json = request.args.get('format') == 'json'
+    report = score_analytics.report(class_batch_id, scores=as_json and bool(request.args.get('scores')))
+    if as_json:
+        return jsonify(report)
+    return render_template('report_tests.html', title='Test Report', batch=batch, report=report)
+
+@current_app.route('/export/<any(roster, attendance, scores):kind>/<int:class_batch_id>')
+@login_required
+@permission_required(Perm.VIEW_STUDENTS, anywhere=True)
+def export_batch(kind, class_batch_id):
+    """Streams a batch's roster, attendance or test scores as ?format=csv (default) or xlsx."""
+    export_format = request.args.get('format', 'csv')
+    if export_format not in exports.WRITERS:
+        return jsonify({'error': 'format must be csv or xlsx'}), 400
+    grants = current_grants()
+    if kind == 'roster':
+        # Only the groups in the user's scope, and only their own gender without VIEW_BOTH_GENDERS.
+        condition = grants.filter(Perm.VIEW_STUDENTS, batch=ClassRegion.class_batch_id, region=ClassRegion.id,
+                                  group=ClassGroup.id)
+        if not grants.can(Perm.VIEW_BOTH_GENDERS, batch_id=class_batch_id):
+            condition = sa.and_(condition, mo.User.gender == current_user.gender)
+        rows = exports.roster_rows(class_batch_id, condition)
+    elif grants.can(Perm.VIEW_REPORTS, batch_id=class_batch_id):
+        rows = exports.attendance_rows(class_batch_id) if kind == 'attendance' else exports.score_rows(class_batch_id)
+    else:
+        flash('You are not authorized to perform this action.', 'danger')
+        return redirect(url_for('index'))
+    batch = db.get_or_404(mo.ClassBatch, class_batch_id)
+    write, mimetype = exports.WRITERS[export_format]
+    filename = secure_filename(f'{batch.class_name.name}-{batch.batch_no}-{kind}.{export_format}')
+    response = current_app.response_class(stream_with_context(write(rows)), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response.cache_control.private = True
+    response.cache_control.no_store = True
+    return response
+
+def attendance_scope(grants):
+    """SQL condition on ClassRegion/ClassGroup keeping the groups the user may take attendance of."""
+    return grants.filter(Perm.TAKE_ATTENDANCE, batch=ClassRegion.class_batch_id, region=ClassRegion.id,
+                         group=ClassGroup.id)
+
+@current_app.route('/attendance', methods=['GET', 'POST'])
+@login_required
+@permission_required(Perm.TAKE_ATTENDANCE, anywhere=True)
+def attendance():
+    """Opens (creating if needed) the class session of a batch and date for marking."""
+    form = fo.ClassSessionForm()
+    batches = db.session.execute(
+        sa.select(ClassBatch.id, ClassName.name, ClassBatch.batch_no).distinct()
+        .join(ClassName, ClassName.id == ClassBatch.class_name_id)
+        .join(ClassRegion, ClassRegion.class_batch_id == ClassBatch.id)
+        .outerjoin(ClassGroup, ClassGroup.class_region_id == ClassRegion.id)
+        .where(attendance_scope(current_grants())).order_by(ClassName.name, ClassBatch.batch_no)).all()
+    form.class_batch_id.choices = [(batch.id, f'{batch.name} {batch.batch_no}') for batch in batches]
+    if form.validate_on_submit():
+        class_session_id = attendance_marking.open_session(form.class_batch_id.data, form.class_date.data,
+                                                           current_user.id)
+        db.session.commit()
+        return redirect(url_for('mark_attendance', class_session_id=class_session_id))
+    return render_template('attendance.html', title='Attendance', form=form)
+
+@current_app.route('/attendance/<int:class_session_id>', methods=['GET', 'POST'])
+@login_required
+@permission_required(Perm.TAKE_ATTENDANCE, anywhere=True)
+def mark_attendance(class_session_id):
+    """Shows the attendance sheet of a class session and saves it in one upsert."""
+    class_session = db.get_or_404(mo.ClassSession, class_session_id)
+    students = attendance_marking.roster(class_session, attendance_scope(current_grants()))
+    if not students and not current_grants().can(Perm.TAKE_ATTENDANCE, batch_id=class_session.class_batch_id):
+        flash('You are not authorized to perform this action.', 'danger')
+        return redirect(url_for('index'))
+    form = fo.AttendanceSheetForm()
+    status_ids = attendance_marking.statuses()
+    errors = {}
+    if form.validate_on_submit():
+        marks, errors = attendance_marking.parse_marks(request.form, [student.id for student in students], status_ids)
+        if not errors:
+            saved = attendance_marking.save_marks(class_session.id, marks, current_user.id)
+            db.session.commit()
+            flash(f'Attendance saved for {saved} student(s).', 'success')
+            return redirect(url_for('mark_attendance', class_session_id=class_session.id))
+        flash('Nothing was saved; please correct the highlighted rows.', 'danger')
+    return render_template('mark_attendance.html', title='Mark Attendance', form=form, class_session=class_session,
+                           students=students, statuses=list(status_ids), errors=errors,
+                           submitted=request.form if errors else None)
+
+def scores_scope(grants):
+    """SQL condition on ClassRegion/ClassGroup keeping the groups the user may enter scores of."""
+    return grants.filter(Perm.ENTER_SCORES, batch=ClassRegion.class_batch_id, region=ClassRegion.id,
+                         group=ClassGroup.id)
+
+@current_app.route('/tests/import', methods=['GET', 'POST'])
+@login_required
+@permission_required(Perm.ENTER_SCORES, anywhere=True)
+def import_scores():
+    """Imports a test's scores from a CSV of (student, score, note) rows; a dry run only reports the errors."""
+    form = fo.ScoreImportForm()
+    condition = scores_scope(current_grants())
+    tests = db.session.execute(
+        sa.select(mo.TestSession.id, mo.TestSession.test_date, mo.TestSession.max_score, ClassName.name,
+                  ClassBatch.batch_no).distinct()
+        .join(ClassBatch, ClassBatch.id == mo.TestSession.class_batch_id)
+        .join(ClassName, ClassName.id == ClassBatch.class_name_id)
+        .join(ClassRegion, ClassRegion.class_batch_id == ClassBatch.id)
+        .outerjoin(ClassGroup, ClassGroup.class_region_id == ClassRegion.id)
+        .where(condition).order_by(mo.TestSession.test_date.desc(), mo.TestSession.id)).all()
+    form.test_session_id.choices = [(test.id, f'{test.name} {test.batch_no}: {test.test_date} (out of {test.max_score})')
+                                    for test in tests]
+    result = None
+    if form.validate_on_submit():
+        test_session = db.session.get(mo.TestSession, form.test_session_id.data)
+        lines = TextIOWrapper(form.file.data.stream, encoding='utf-8-sig', errors='replace', newline='')
+        result = score_import.import_scores(test_session, lines, current_user.id, condition, form.dry_run.data)
+        if result.errors:
+            flash(f'Nothing was imported; {len(result.errors)} row(s) were rejected. Please correct the file.', 'danger')
+        elif result.written:
+            db.session.commit()
+            logging.info(f'{current_user.username} imported {result.valid} scores into test {test_session.id}')
+            flash(f'{result.valid} score(s) imported.', 'success')
+        else:
+            flash(f'Dry run: all {result.valid} score(s) can be imported.', 'info')
+    return render_template('import_scores.html', title='Import Scores', form=form, result=result)
 
 @current_app.route('/calendar')
 @login_required
 def calendar():
-    """Renders the calendar page."""
-    events = []
-    class_batches = db.session.query(mo.ClassBatch).all()
-    for batch in class_batches:
-        events.append({
-            'title': f'{batch.class_name.name} - {batch.batch_no}',
-            'start': batch.start_date.strftime('%Y-%m-%d'),
-        })
-    return render_template('calendar.html', title='Calendar', events=events)
+    """Renders the calendar page; its events come from /api/calendar."""
+    return render_template('calendar.html', title='Calendar')
+
+@current_app.route('/api/calendar')
+@login_required
+def calendar_events():
+    """The calendar events between ?start= and ?end= in the user's batches; 304 when the ETag matches."""
+    try:
+        start, end = calendar_feed.parse_window(request.args.get('start'), request.args.get('end'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    etag = calendar_feed.etag(current_user, start, end)
+    if etag in request.if_none_match:
+        response = current_app.response_class(status=304)
+    else:
+        events = calendar_feed.events(start, end, calendar_feed.viewer_batch_ids(current_user))
+        response = jsonify(events)
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
 
 @current_app.route('/messages')
 @login_required
@@ -506,6 +762,7 @@ def download_file(file_id):
 
 @current_app.route('/class_name', methods=['GET', 'POST'])
 @login_required
+@permission_required(Perm.MANAGE_CLASSES)
 def class_name():
     form = ClassNameForm()
     if form.validate_on_submit():
@@ -526,6 +783,7 @@ def class_name():
 
 @current_app.route('/class_batch', methods=['GET', 'POST'])
 @login_required
+@permission_required(Perm.MANAGE_CLASSES)
 def class_batch():
     """Renders the class batch page and handles the creation of new class batches."""
     form = ClassBatchForm()
@@ -548,6 +806,7 @@ def class_batch():
 
 @current_app.route('/class_region', methods=['GET', 'POST'])
 @login_required
+@permission_required(Perm.MANAGE_CLASSES)
 def class_region():
     """
     Renders the class region page and handles the creation of new class regions.
@@ -578,6 +837,7 @@ def class_region():
 
 @current_app.route('/class_group', methods=['GET', 'POST'])
 @login_required
+@permission_required(Perm.MANAGE_CLASSES)
 def class_group():
     form = ClassGroupForm()
     if request.method == 'POST':
@@ -603,6 +863,7 @@ def class_group():
 
 @current_app.route('/class_group_mentor', methods=['GET', 'POST'])
 @login_required
+@permission_required(Perm.MANAGE_MENTORS)
 def class_group_mentor():
     """Renders the class group mentor page."""
     form = ClassGroupMentorForm()
@@ -617,14 +878,18 @@ def class_group_mentor():
 
 @current_app.route('/list_class_group_mentors')
 @login_required
+@permission_required(Perm.VIEW_STUDENTS, anywhere=True)
 def list_class_group_mentors():
     """Renders the list_class_group_mentors page."""
-    mentors = ClassGroupMentor.query.all()
+    mentors = ClassGroupMentor.query.filter(current_grants().filter(
+        Perm.VIEW_STUDENTS, batch=ClassGroupMentor.class_batch_id, region=ClassGroupMentor.class_region_id,
+        group=ClassGroupMentor.class_group_id)).all()
     return render_template('list_class_group_mentors.html', title='List Class Group Mentors', mentors=mentors)
 
 
 @current_app.route('/remove_class_group_mentor', methods=['GET', 'POST'])
 @login_required
+@permission_required(Perm.MANAGE_MENTORS)
 def remove_class_group_mentor():
     """Renders the remove_class_group_mentor page."""
     if request.method == 'POST':
@@ -643,6 +908,7 @@ def remove_class_group_mentor():
 
 @current_app.route('/update_class_group_mentor', methods=['GET'])
 @login_required
+@permission_required(Perm.MANAGE_MENTORS)
 def update_class_group_mentor():
     """Renders the update_class_group_mentor page."""
     mentors = ClassGroupMentor.query.all()
@@ -651,6 +917,7 @@ def update_class_group_mentor():
 
 @current_app.route('/update_class_group_mentor/<int:id>', methods=['GET', 'POST'])
 @login_required
+@permission_required(Perm.MANAGE_MENTORS)
 def update_class_group_mentor_item(id):
     """Renders the update_class_group_mentor_item page."""
     mentor = ClassGroupMentor.query.get_or_404(id)
@@ -693,6 +960,7 @@ def search_class_group_mentor():
 
 @current_app.route('/user_status', methods=['GET', 'POST'])
 @login_required
+@permission_required(Perm.MANAGE_CLASSES)
 def user_status():
     """Renders the user_status page and handles the creation of new user statuses."""
     form = UserStatusForm()
@@ -715,6 +983,7 @@ def list_user_statuses():
 
 @current_app.route('/remove_user_status', methods=['GET', 'POST'])
 @login_required
+@permission_required(Perm.MANAGE_CLASSES)
 def remove_user_status():
     """Renders the remove_user_status page."""
     if request.method == 'POST':
@@ -733,6 +1002,7 @@ def remove_user_status():
 
 @current_app.route('/update_user_status', methods=['GET'])
 @login_required
+@permission_required(Perm.MANAGE_CLASSES)
 def update_user_status():
     """Renders the update_user_status page."""
     statuses = UserStatus.query.all()
@@ -741,6 +1011,7 @@ def update_user_status():
 
 @current_app.route('/update_user_status/<int:id>', methods=['GET', 'POST'])
 @login_required
+@permission_required(Perm.MANAGE_CLASSES)
 def update_user_status_item(id):
     """Renders the update_user_status_item page."""
     status = UserStatus.query.get_or_404(id)
@@ -776,6 +1047,7 @@ def search_user_status():
 
 @current_app.route('/student_group', methods=['GET', 'POST'])
 @login_required
+@permission_required(Perm.MANAGE_CLASSES)
 def student_group():
     form = StudentGroupForm()
     if form.validate_on_submit():
@@ -789,6 +1061,7 @@ def student_group():
 
 @current_app.route('/class_batch_teacher', methods=['GET', 'POST'])
 @login_required
+@permission_required(Perm.MANAGE_CLASSES)
 def class_batch_teacher():
     """Renders the class_batch_teacher page and handles the creation of new class batch teachers."""
     form = ClassBatchTeacherForm()
@@ -803,6 +1076,7 @@ def class_batch_teacher():
 
 @current_app.route('/role', methods=['GET', 'POST'])
 @login_required
+@permission_required(Perm.MANAGE_ROLES)
 def role():
     """Renders the role page and handles the creation of new roles."""
     form = RoleForm()
@@ -817,6 +1091,7 @@ def role():
 
 @current_app.route('/remove_role', methods=['GET', 'POST'])
 @login_required
+@permission_required(Perm.MANAGE_ROLES)
 def remove_role():
     """Renders the remove_role page and handles the deletion of roles."""
     if request.method == 'POST':
@@ -834,6 +1109,7 @@ def remove_role():
 
 @current_app.route('/update_role', methods=['GET'])
 @login_required
+@permission_required(Perm.MANAGE_ROLES)
 def update_role():
     """Renders the update_role page."""
     roles = Role.query.order_by(Role.level).all()
@@ -841,6 +1117,7 @@ def update_role():
 
 @current_app.route('/update_role/<int:id>', methods=['GET', 'POST'])
 @login_required
+@permission_required(Perm.MANAGE_ROLES)
 def update_role_item(id):
     """Renders the update_role_item page and handles the update of a specific role."""
     role = Role.query.get_or_404(id)
@@ -864,6 +1141,7 @@ def list_roles():
 
 @current_app.route('/remove_user_role', methods=['GET', 'POST'])
 @login_required
+@permission_required(Perm.MANAGE_ROLES)
 def remove_user_role():
     form = fo.EmptyForm()
     if request.method == 'POST':
@@ -882,6 +1160,7 @@ def remove_user_role():
 
 @current_app.route('/update_user_role', methods=['GET'])
 @login_required
+@permission_required(Perm.MANAGE_ROLES)
 def update_user_role():
     """Renders the update_user_role page."""
     query = UserRole.query
@@ -901,6 +1180,7 @@ def update_user_role():
 
 @current_app.route('/update_user_role/<int:id>', methods=['GET', 'POST'])
 @login_required
+@permission_required(Perm.MANAGE_ROLES)
 def update_user_role_item(id):
     user_role = UserRole.query.get_or_404(id)
     form = UserRoleForm(obj=user_role)
@@ -965,9 +1245,12 @@ def update_user_role_item(id):
 
 @current_app.route('/list_user_roles')
 @login_required
+@permission_required(Perm.VIEW_STUDENTS, anywhere=True)
 def list_user_roles():
     """Renders the list_user_roles page."""
-    query = UserRole.query
+    query = UserRole.query.filter(current_grants().filter(
+        Perm.VIEW_STUDENTS, batch=UserRole.class_batch_id, region=UserRole.class_region_id,
+        group=UserRole.class_group_id))
     search = request.args.get('search')
     if search:
         query = query.join(mo.User, mo.User.id == mo.UserRole.user_id).join(mo.Role).join(mo.ClassBatch).outerjoin(mo.ClassRegion).filter(
@@ -984,6 +1267,7 @@ def list_user_roles():
 
 @current_app.route('/user_role', methods=['GET', 'POST'])
 @login_required
+@permission_required(Perm.MANAGE_ROLES)
 def user_role():
     form = UserRoleForm()
     if request.method == 'POST':
@@ -1034,6 +1318,7 @@ def user_profile(username):
 
 @current_app.route('/class_batch_status', methods=['GET', 'POST'])
 @login_required
+@permission_required(Perm.MANAGE_CLASSES)
 def class_batch_status():
     form = ClassBatchStatusForm()
     if form.validate_on_submit():
@@ -1071,6 +1356,7 @@ def search_class_name():
 
 @current_app.route('/remove_class_name', methods=['GET', 'POST'])
 @login_required
+@permission_required(Perm.MANAGE_CLASSES)
 def remove_class_name():
     """Renders the remove_class_name page."""
     if request.method == 'POST':
@@ -1089,6 +1375,7 @@ def remove_class_name():
 
 @current_app.route('/update_class_name', methods=['GET'])
 @login_required
+@permission_required(Perm.MANAGE_CLASSES)
 def update_class_name():
     """Renders the update_class_name page."""
     class_names = ClassName.query.all()
@@ -1097,6 +1384,7 @@ def update_class_name():
 
 @current_app.route('/update_class_name/<int:id>', methods=['GET', 'POST'])
 @login_required
+@permission_required(Perm.MANAGE_CLASSES)
 def update_class_name_item(id):
     """Renders the update_class_name_item page."""
     class_name = ClassName.query.get_or_404(id)
@@ -1120,6 +1408,7 @@ def list_class_batch_statuses():
 
 @current_app.route('/remove_class_batch_status', methods=['GET', 'POST'])
 @login_required
+@permission_required(Perm.MANAGE_CLASSES)
 def remove_class_batch_status():
     """Renders the remove_class_batch_status page."""
     if request.method == 'POST':
@@ -1138,6 +1427,7 @@ def remove_class_batch_status():
 
 @current_app.route('/update_class_batch_status', methods=['GET'])
 @login_required
+@permission_required(Perm.MANAGE_CLASSES)
 def update_class_batch_status():
     """Renders the update_class_batch_status page."""
     statuses = ClassBatchStatus.query.all()
@@ -1146,6 +1436,7 @@ def update_class_batch_status():
 
 @current_app.route('/update_class_batch_status/<int:id>', methods=['GET', 'POST'])
 @login_required
+@permission_required(Perm.MANAGE_CLASSES)
 def update_class_batch_status_item(id):
     """Renders the update_class_batch_status_item page."""
     status = ClassBatchStatus.query.get_or_404(id)
@@ -1168,6 +1459,7 @@ def list_class_batches():
 
 @current_app.route('/remove_class_batch', methods=['GET', 'POST'])
 @login_required
+@permission_required(Perm.MANAGE_CLASSES)
 def remove_class_batch():
     """Renders the remove_class_batch page."""
     if request.method == 'POST':
@@ -1186,6 +1478,7 @@ def remove_class_batch():
 
 @current_app.route('/update_class_batch', methods=['GET'])
 @login_required
+@permission_required(Perm.MANAGE_CLASSES)
 def update_class_batch():
     """Renders the update_class_batch page."""
     batches = ClassBatch.query.all()
@@ -1194,6 +1487,7 @@ def update_class_batch():
 
 @current_app.route('/update_class_batch/<int:id>', methods=['GET', 'POST'])
 @login_required
+@permission_required(Perm.MANAGE_CLASSES)
 def update_class_batch_item(id):
     """Renders the update_class_batch_item page."""
     batch = ClassBatch.query.get_or_404(id)
@@ -1220,6 +1514,7 @@ def list_class_regions():
 
 @current_app.route('/remove_class_region', methods=['GET', 'POST'])
 @login_required
+@permission_required(Perm.MANAGE_CLASSES)
 def remove_class_region():
     """Renders the remove_class_region page."""
     if request.method == 'POST':
@@ -1238,6 +1533,7 @@ def remove_class_region():
 
 @current_app.route('/update_class_region', methods=['GET'])
 @login_required
+@permission_required(Perm.MANAGE_CLASSES)
 def update_class_region():
     """Renders the update_class_region page."""
     regions = ClassRegion.query.all()
@@ -1246,6 +1542,7 @@ def update_class_region():
 
 @current_app.route('/update_class_region/<int:id>', methods=['GET', 'POST'])
 @login_required
+@permission_required(Perm.MANAGE_CLASSES)
 def update_class_region_item(id):
     """Renders the update_class_region_item page."""
     region = ClassRegion.query.get_or_404(id)
@@ -1279,6 +1576,7 @@ def list_class_groups():
 
 @current_app.route('/remove_class_group', methods=['GET', 'POST'])
 @login_required
+@permission_required(Perm.MANAGE_CLASSES)
 def remove_class_group():
     """Renders the remove_class_group page."""
     if request.method == 'POST':
@@ -1297,6 +1595,7 @@ def remove_class_group():
 
 @current_app.route('/update_class_group', methods=['GET'])
 @login_required
+@permission_required(Perm.MANAGE_CLASSES)
 def update_class_group():
     """Renders the update_class_group page."""
     indexes = ClassGroup.query.all()
@@ -1305,6 +1604,7 @@ def update_class_group():
 
 @current_app.route('/update_class_group/<int:id>', methods=['GET', 'POST'])
 @login_required
+@permission_required(Perm.MANAGE_CLASSES)
 def update_class_group_item(id):
     """Renders the update_class_group_item page."""
     index = ClassGroup.query.get_or_404(id)
@@ -1362,6 +1662,7 @@ def search_class_group():
 
 @current_app.route('/search_user_password', methods=['GET', 'POST'])
 @login_required
+@permission_required(Perm.MANAGE_PASSWORDS)
 def search_user_password():
     form = fo.SearchUserForm()
     users = []
@@ -1379,12 +1680,9 @@ def search_user_password():
 
 @current_app.route('/update_password/<int:user_id>', methods=['GET', 'POST'])
 @login_required
+@permission_required(Perm.MANAGE_PASSWORDS)
 def update_password(user_id):
     """Handles the update password functionality for an admin user."""
-    if not current_user.username == 'admin': # TODO: later add condition check role
-        flash('You are not authorized to perform this action.', 'danger')
-        return redirect(url_for('index'))
-    
     user = db.session.get(mo.User, user_id)
     if not user:
         flash('User not found.', 'danger')
@@ -1394,14 +1692,14 @@ def update_password(user_id):
     if form.validate_on_submit():
         password = db.session.scalar(sa.select(mo.Password).where(mo.Password.user_id == user.id))
         if password:
-            password.password_hash = generate_password_hash(form.password.data)
+            password.password_hash = hasher.hash(form.password.data)
             password.is_allowed = form.is_allowed.data
             password.force_change = form.force_change.data
             db.session.commit()
             flash(f'Password for {user.username} has been updated.', 'success')
         else:
             new_password = mo.Password(user_id=user.id, 
-                                     password_hash=generate_password_hash(form.password.data), 
+                                     password_hash=hasher.hash(form.password.data), 
                                      is_allowed=form.is_allowed.data, 
                                      force_change=form.force_change.data)
             db.session.add(new_password)
@@ -1430,22 +1728,17 @@ def change_password():
 
 @current_app.route('/list_passwords')
 @login_required
+@permission_required(Perm.MANAGE_PASSWORDS)
 def list_passwords():
     """Renders the list_passwords page."""
-    if not current_user.username == 'admin':
-        flash('You are not authorized to perform this action.', 'danger')
-        return redirect(url_for('index'))
     users = db.session.query(mo.User).all()
     return render_template('list_passwords.html', users=users)
 
 @current_app.route('/remove_password/<int:user_id>', methods=['GET', 'POST'])
 @login_required
+@permission_required(Perm.MANAGE_PASSWORDS)
 def remove_password(user_id):
     """Handles the removal of a user's password."""
-    if not current_user.username == 'admin': # TODO: later add condition check role
-        flash('You are not authorized to perform this action.', 'danger')
-        return redirect(url_for('index'))
-    
     user = db.session.get(mo.User, user_id)
     if not user:
         flash('User not found.', 'danger')
@@ -1466,12 +1759,9 @@ def remove_password(user_id):
 
 @current_app.route('/remove_passwords', methods=['POST'])
 @login_required
+@permission_required(Perm.MANAGE_PASSWORDS)
 def remove_passwords():
     """Handles the removal of multiple user passwords."""
-    if not current_user.username == 'admin': # TODO: later add condition check role
-        flash('You are not authorized to perform this action.', 'danger')
-        return redirect(url_for('index'))
-    
     user_ids = request.form.getlist('user_ids')
     if user_ids:
         for user_id in user_ids:
@@ -1484,6 +1774,13 @@ def remove_passwords():
         flash('No users were selected.', 'warning')
     return redirect(url_for('search_user_password'))
 
+@current_app.route('/captcha_pool_stats')
+@login_required
+@permission_required(Perm.VIEW_METRICS)
+def captcha_pool_stats():
+    """Returns this worker's captcha pool counters."""
+    return jsonify(captcha.stats())
+
 @current_app.route('/search_referrer', methods=['GET', 'POST'])
 @login_required
 def search_referrer():
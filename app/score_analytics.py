@@ -0,0 +1,210 @@
+# app/score_analytics.py
+"""
+This module computes a class batch's test score report with NumPy.
+
+Scores are loaded with one query per report into arrays, with each
+student's ClassGroup in the batch (the lowest id if they are in several).
+Per TestSession, ``ScoreResult`` holds the score as a percentage of
+``max_score``, the summary (mean, percentiles, 10-point histogram), and
+each student's rank in the test and in their group. Ties share the best
+rank (1, 2, 2, 4).
+
+ScoreResults are cached per worker on the versions of their own
+TestSessionScore partition and of the tables they read
+(app/table_versions.py). Writing scores for one test therefore recomputes
+that test only. The batch totals (mean percentage and ranks per student,
+mean per group) are recomputed from the cached arrays on each request.
+"""
+import itertools
+import math
+import threading
+from collections import OrderedDict, namedtuple
+import numpy as np
+import sqlalchemy as sa
+from app import db
+from app.table_versions import versions
+import app.models as mo
+
+SCORE_TABLES = ('test_session', 'test_session_score', 'student_group', 'class_group', 'class_region')
+versions.track(*SCORE_TABLES)
+versions.track_partitions('test_session_score', 'test_session_id')
+
+NO_GROUP = -1
+HISTOGRAM_BINS = np.linspace(0, 100, 11)
+PERCENTILES = (25, 50, 75, 90)
+
+ScoreResult = namedtuple('ScoreResult', 'test_session_id user_ids group_ids percent rank group_rank summary')
+
+
+def competition_rank(values, groups=None):
+    """1-based rank of values, highest first, within groups if given; ties share the best rank."""
+    n = len(values)
+    if not n:
+        return np.zeros(0, np.int64)
+    groups = np.zeros(n, np.int64) if groups is None else groups
+    order = np.lexsort((-values, groups))
+    sorted_groups, sorted_values = groups[order], values[order]
+    positions = np.arange(n)
+    new_group = np.r_[True, sorted_groups[1:] != sorted_groups[:-1]]
+    new_value = new_group | np.r_[True, sorted_values[1:] != sorted_values[:-1]]
+    group_start = np.maximum.accumulate(np.where(new_group, positions, 0))
+    tie_start = np.maximum.accumulate(np.where(new_value, positions, 0))
+    ranks = np.empty(n, np.int64)
+    ranks[order] = tie_start - group_start + 1
+    return ranks
+
+
+def summary(percent):
+    """Mean, percentiles and histogram of percentages (NaN ignored)."""
+    values = percent[~np.isnan(percent)]
+    if not len(values):
+        return {'count': 0, 'mean': None, 'std': None, 'percentiles': {}, 'histogram': [0] * (len(HISTOGRAM_BINS) - 1)}
+    return {
+        'count': int(len(values)),
+        'mean': round(float(values.mean()), 1),
+        'std': round(float(values.std()), 1),
+        'percentiles': {p: round(float(v), 1) for p, v in zip(PERCENTILES, np.percentile(values, PERCENTILES))},
+        # Scores above max_score land in the last bin.
+        'histogram': np.histogram(np.clip(values, 0, 100), bins=HISTOGRAM_BINS)[0].tolist(),
+    }
+
+
+def score_result(test_session_id, max_score, user_ids, group_ids, scores):
+    """The ScoreResult of one test's score arrays."""
+    percent = np.divide(scores * 100.0, max_score, out=np.full(len(scores), np.nan), where=max_score > 0) \
+        if len(scores) else np.zeros(0)
+    ranked = np.nan_to_num(percent, nan=-np.inf)
+    return ScoreResult(test_session_id, user_ids, group_ids, percent, competition_rank(ranked),
+                       competition_rank(ranked, group_ids), summary(percent))
+
+
+def load_scores(class_batch_id, test_session_ids):
+    """{test_session_id: (user_ids, group_ids, scores)} of the given tests, with one query."""
+    groups = (sa.select(mo.StudentGroup.user_id, sa.func.min(mo.StudentGroup.class_group_id).label('group_id'))
+              .join(mo.ClassGroup, mo.ClassGroup.id == mo.StudentGroup.class_group_id)
+              .join(mo.ClassRegion, mo.ClassRegion.id == mo.ClassGroup.class_region_id)
+              .where(mo.ClassRegion.class_batch_id == class_batch_id)
+              .group_by(mo.StudentGroup.user_id).subquery())
+    rows = db.session.connection().execute(
+        sa.select(mo.TestSessionScore.test_session_id, mo.TestSessionScore.user_id,
+                  sa.func.coalesce(groups.c.group_id, NO_GROUP), mo.TestSessionScore.score)
+        .outerjoin(groups, groups.c.user_id == mo.TestSessionScore.user_id)
+        .where(mo.TestSessionScore.test_session_id.in_(test_session_ids))).all()
+    values = np.fromiter(itertools.chain.from_iterable(rows), np.int64, count=4 * len(rows)).reshape(-1, 4)
+    values = values[np.argsort(values[:, 0], kind='stable')]
+    tests, starts = np.unique(values[:, 0], return_index=True)
+    loaded = {test_session_id: (np.zeros(0, np.int64),) * 3 for test_session_id in test_session_ids}
+    for test_session_id, part in zip(tests.tolist(), np.split(values, starts[1:])):
+        loaded[test_session_id] = (part[:, 1], part[:, 2], part[:, 3])
+    return loaded
+
+
+class ScoreResultCache:
+    """ScoreResults per TestSession, kept while their score versions are unchanged."""
+
+    def __init__(self, size=512):
+        self.size = size
+        self._lock = threading.Lock()
+        # test_session_id -> (versions key, ScoreResult), least recently used first
+        self._entries = OrderedDict()
+
+    def results(self, class_batch_id, tests):
+        """The ScoreResults of tests ((id, max_score) pairs of the batch's TestSessions), in order."""
+        if not tests:
+            return []
+        keys = [f'test_session_score:{test_session_id}' for test_session_id, _ in tests]
+        current = versions.get((*SCORE_TABLES, *keys))
+        shared = current[:len(SCORE_TABLES)]
+        wanted = {test_session_id: (shared, own, max_score)
+                  for (test_session_id, max_score), own in zip(tests, current[len(SCORE_TABLES):])}
+        found = {}
+        with self._lock:
+            for test_session_id, key in wanted.items():
+                entry = self._entries.get(test_session_id)
+                if entry is not None and entry[0] == key:
+                    self._entries.move_to_end(test_session_id)
+                    found[test_session_id] = entry[1]
+        missing = [test_session_id for test_session_id in wanted if test_session_id not in found]
+        if missing:
+            for test_session_id, arrays in load_scores(class_batch_id, missing).items():
+                key = wanted[test_session_id]
+                found[test_session_id] = score_result(test_session_id, key[2], *arrays)
+                with self._lock:
+                    self._entries[test_session_id] = (key, found[test_session_id])
+                    self._entries.move_to_end(test_session_id)
+                    while len(self._entries) > self.size:
+                        self._entries.popitem(last=False)
+        return [found[test_session_id] for test_session_id, _ in tests]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+results_cache = ScoreResultCache()
+
+
+def batch_totals(results):
+    """Per-student mean percentage over the tests taken, with overall and group ranks, and group means."""
+    if not results:
+        return [], []
+    user_ids = np.concatenate([result.user_ids for result in results])
+    group_ids = np.concatenate([result.group_ids for result in results])
+    percent = np.concatenate([result.percent for result in results])
+    students, index = np.unique(user_ids, return_inverse=True)
+    scored = ~np.isnan(percent)
+    taken = np.bincount(index, weights=scored, minlength=len(students))
+    total = np.bincount(index, weights=np.where(scored, percent, 0), minlength=len(students))
+    mean = np.divide(total, taken, out=np.full(len(students), np.nan), where=taken > 0)
+    # Every score row carries the student's current group in the batch.
+    group = np.full(len(students), NO_GROUP, np.int64)
+    group[index] = group_ids
+    ranked = np.nan_to_num(mean, nan=-np.inf)
+    rank, group_rank = competition_rank(ranked), competition_rank(ranked, group)
+    order = np.argsort(rank, kind='stable')
+    per_student = [
+        {'user_id': int(students[i]), 'group_id': None if group[i] == NO_GROUP else int(group[i]),
+         'tests': int(taken[i]), 'mean': None if np.isnan(mean[i]) else round(float(mean[i]), 1),
+         'rank': int(rank[i]), 'group_rank': int(group_rank[i])} for i in order]
+    groups, group_index = np.unique(group[taken > 0], return_inverse=True)
+    group_mean = np.bincount(group_index, weights=mean[taken > 0], minlength=len(groups)) \
+        / np.maximum(np.bincount(group_index, minlength=len(groups)), 1)
+    sizes = np.bincount(group_index, minlength=len(groups))
+    per_group = [{'group_id': None if g == NO_GROUP else int(g), 'mean': round(float(m), 1), 'students': int(n)}
+                 for g, m, n in zip(groups, group_mean, sizes)]
+    return per_student, per_group
+
+
+def test_scores(result):
+    """Each student's percentage and ranks in one test."""
+    percent = [None if math.isnan(p) else p for p in np.round(result.percent, 1).tolist()]
+    return [{'user_id': user_id, 'percent': p, 'rank': rank, 'group_rank': group_rank}
+            for user_id, p, rank, group_rank in zip(result.user_ids.tolist(), percent, result.rank.tolist(),
+                                                    result.group_rank.tolist())]
+
+
+def report(class_batch_id, scores=False):
+    """The test score report of a class batch, with usernames and group names; per-test scores if asked."""
+    tests = db.session.execute(
+        sa.select(mo.TestSession.id, mo.TestSession.test_date, mo.TestSession.max_score)
+        .where(mo.TestSession.class_batch_id == class_batch_id)
+        .order_by(mo.TestSession.test_date, mo.TestSession.id)).all()
+    results = results_cache.results(class_batch_id, [(test.id, test.max_score) for test in tests])
+    students, groups = batch_totals(results)
+    names = dict(db.session.execute(sa.select(mo.User.id, mo.User.username).where(
+        mo.User.id.in_([student['user_id'] for student in students]))).all())
+    group_names = dict(db.session.execute(sa.select(mo.ClassGroup.id, mo.ClassGroup.name).where(
+        mo.ClassGroup.id.in_([group['group_id'] for group in groups if group['group_id'] is not None]))).all())
+    for student in students:
+        student['username'] = names.get(student['user_id'])
+        student['group'] = group_names.get(student['group_id'])
+    for group in groups:
+        group['name'] = group_names.get(group['group_id'])
+    return {
+        'tests': [{'test_session_id': test.id, 'date': str(test.test_date), 'max_score': test.max_score,
+                   **result.summary, **({'scores': test_scores(result)} if scores else {})}
+                  for test, result in zip(tests, results)],
+        'students': students,
+        'groups': groups,
+        'bins': [f'{int(low)}-{int(high)}' for low, high in zip(HISTOGRAM_BINS, HISTOGRAM_BINS[1:])],
+    }
@@ -0,0 +1,135 @@
+# app/score_import.py
+"""
+This module imports a TestSession's scores from a CSV file.
+
+Each row is a student identifier (user ID or username), the score and an
+optional note; a first row whose score is not a number is taken as the
+header. The file is read as a stream of lines, with at most ``MAX_ROWS``
+rows. All identifiers are resolved with one query against the batch's
+students, narrowed to the importer's scope. A username matching more than
+one of them is rejected rather than guessed.
+
+Scores must be whole numbers from 0 to the test's ``max_score``. The valid
+rows are written with executemany INSERT ... ON CONFLICT (test_session_id,
+user_id) DO UPDATE in chunks of ``BATCH_SIZE``, so re-importing a file
+replaces its scores. Each rejected row is reported with its line, and a
+file with any rejected row (or more than ``MAX_ROWS`` rows) is not written
+at all, like an attendance sheet. A dry run validates the whole file and
+counts what would be replaced, but writes nothing.
+"""
+import csv
+import re
+from collections import namedtuple
+from datetime import datetime, timezone
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql, sqlite
+from app import db
+import app.models as mo
+
+Scores = mo.TestSessionScore.__table__
+BATCH_SIZE = 500
+MAX_ROWS = 10_000
+MAX_NOTE = 255
+WHOLE_NUMBER = re.compile(r'\d+', re.ASCII)
+
+RowError = namedtuple('RowError', 'line identifier error')
+ImportResult = namedtuple('ImportResult', 'valid replaced errors written')
+
+
+def _key(identifier):
+    return str(int(identifier)) if WHOLE_NUMBER.fullmatch(identifier) else identifier.lower()
+
+
+def read_rows(lines):
+    """Yield (line, identifier, score text, note) of the non-blank CSV rows, without the header."""
+    reader = csv.reader(lines)
+    for record in reader:
+        cells = [cell.strip() for cell in record] + [''] * (3 - len(record))
+        if not any(cells):
+            continue
+        if reader.line_num == 1 and not WHOLE_NUMBER.fullmatch(cells[1]):
+            continue
+        yield reader.line_num, cells[0], cells[1], cells[2]
+
+
+def resolve(class_batch_id, identifiers, condition=sa.true()):
+    """{identifier key: [user ids]} of the batch's students matching identifiers (user IDs or usernames)."""
+    ids = {int(identifier) for identifier in identifiers if WHOLE_NUMBER.fullmatch(identifier)}
+    names = {identifier.lower() for identifier in identifiers if not WHOLE_NUMBER.fullmatch(identifier)}
+    if not ids and not names:
+        return {}
+    rows = db.session.execute(
+        sa.select(mo.User.id, mo.User.username).distinct()
+        .join(mo.StudentGroup, mo.StudentGroup.user_id == mo.User.id)
+        .join(mo.ClassGroup, mo.ClassGroup.id == mo.StudentGroup.class_group_id)
+        .join(mo.ClassRegion, mo.ClassRegion.id == mo.ClassGroup.class_region_id)
+        .where(mo.ClassRegion.class_batch_id == class_batch_id, condition,
+               sa.or_(mo.User.id.in_(ids), sa.func.lower(mo.User.username).in_(names)))).all()
+    found = {}
+    for user_id, username in rows:
+        if user_id in ids:
+            found.setdefault(str(user_id), []).append(user_id)
+        if username and username.lower() in names:
+            found.setdefault(username.lower(), []).append(user_id)
+    return found
+
+
+def validate(test_session, rows, condition=sa.true()):
+    """(score rows to write, RowErrors) of the (line, identifier, score, note) rows."""
+    rows, errors = list(rows), []
+    found = resolve(test_session.class_batch_id, {identifier for _, identifier, _, _ in rows if identifier},
+                    condition)
+    scores, seen = [], {}
+    for line, identifier, score, note in rows:
+        user_ids = found.get(_key(identifier), [])
+        if not identifier:
+            error = 'Student is missing.'
+        elif not user_ids:
+            error = 'Not a student of this batch.'
+        elif len(user_ids) > 1:
+            error = f'{len(user_ids)} students have this name; use their user ID.'
+        elif user_ids[0] in seen:
+            error = f'Student already scored on line {seen[user_ids[0]]}.'
+        elif not WHOLE_NUMBER.fullmatch(score) or int(score) > test_session.max_score:
+            error = f'Score must be a whole number from 0 to {test_session.max_score}.'
+        elif len(note) > MAX_NOTE:
+            error = f'Note is longer than {MAX_NOTE} characters.'
+        else:
+            seen[user_ids[0]] = line
+            scores.append({'user_id': user_ids[0], 'score': int(score), 'note': note or None})
+            continue
+        errors.append(RowError(line, identifier, error))
+    return scores, errors
+
+
+def _upsert():
+    dialect = postgresql if db.session.get_bind().dialect.name == 'postgresql' else sqlite
+    stmt = dialect.insert(Scores)
+    return stmt.on_conflict_do_update(
+        index_elements=[Scores.c.test_session_id, Scores.c.user_id],
+        set_={name: stmt.excluded[name] for name in ('score', 'note', 'updated_by', 'updated_at')})
+
+
+def import_scores(test_session, lines, actor_id, condition=sa.true(), dry_run=False):
+    """Import the scores of a CSV file's lines into test_session if every row is valid; the caller commits."""
+    rows, errors = [], []
+    for row in read_rows(lines):
+        if len(rows) == MAX_ROWS:
+            errors.append(RowError(row[0], row[1], f'The file has more than {MAX_ROWS} rows.'))
+            break
+        rows.append(row)
+    scores, invalid = validate(test_session, rows, condition)
+    errors = sorted(invalid + errors)
+    replaced = db.session.scalar(
+        sa.select(sa.func.count()).select_from(Scores).where(
+            Scores.c.test_session_id == test_session.id,
+            Scores.c.user_id.in_([score['user_id'] for score in scores]))) if scores else 0
+    written = not dry_run and not errors and bool(scores)
+    if written:
+        now = datetime.now(timezone.utc)
+        audit = {'test_session_id': test_session.id, 'created_by': actor_id, 'created_at': now,
+                 'updated_by': actor_id, 'updated_at': now}
+        stmt = _upsert()
+        for start in range(0, len(scores), BATCH_SIZE):
+            db.session.execute(stmt, [{**score, **audit} for score in scores[start:start + BATCH_SIZE]])
+    return ImportResult(len(scores), replaced, errors, written)
@@ -0,0 +1,264 @@
+# app/sessions.py
+"""
+This module keeps Flask sessions on the server.
+
+Flask's default session is a signed cookie, which the browser can read, so
+the captcha answer stored by flask-session-captcha is visible to the client.
+Here only a random session id goes in the cookie. The data lives in a store
+chosen by ``SESSION_TYPE``:
+- 'sqlite': one row per session in ``SESSION_SQLITE_PATH`` (default:
+  sessions.db in the app's instance folder), with an index on the expiry
+  time. Shared by all the workers of a host.
+- 'memory': an in-process LRU of ``SESSION_MEMORY_MAX`` sessions, for a
+  single-process dev server.
+- 'cookie': Flask's default signed cookie.
+
+Empty sessions are never stored. A session expires
+``PERMANENT_SESSION_LIFETIME`` after its last write. A daemon thread deletes
+expired sessions every ``SESSION_SWEEP_INTERVAL`` seconds (0 disables it;
+``flask sessions-sweep`` does the same once).
+
+Threads and SQLite connections do not survive a fork, so neither is created
+when the app is: each process opens its own connections and starts its own
+sweeper on its first request, and works under ``gunicorn --preload``.
+"""
+import logging
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from flask import session
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+SID_BYTES = 32
+# A session that is read but not modified has its expiry pushed back at most this often.
+TOUCH_INTERVAL = 60
+
+serializer = TaggedJSONSerializer()
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    """A session dict that remembers its id, its expiry and whether it changed."""
+
+    def __init__(self, data=None, sid=None, expires=None):
+        def on_update(self):
+            self.modified = True
+            self.accessed = True
+
+        super().__init__(data, on_update)
+        self.sid = sid
+        self.expires = expires
+        self.new = sid is None
+        self.modified = False
+        self.accessed = False
+        self.regenerate = False
+
+
+class MemorySessionStore:
+    """Sessions in an in-process LRU; expired ones are dropped on read and by sweep()."""
+
+    def __init__(self, max_sessions=10000):
+        self.max_sessions = max_sessions
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()
+
+    def get(self, sid, now):
+        with self._lock:
+            entry = self._sessions.get(sid)
+            if entry is None:
+                return None
+            if entry[0] <= now:
+                del self._sessions[sid]
+                return None
+            self._sessions.move_to_end(sid)
+            return entry[0], serializer.loads(entry[1])
+
+    def set(self, sid, data, expires):
+        payload = serializer.dumps(data)
+        with self._lock:
+            self._sessions[sid] = (expires, payload)
+            self._sessions.move_to_end(sid)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def touch(self, sid, expires):
+        with self._lock:
+            entry = self._sessions.get(sid)
+            if entry is not None:
+                self._sessions[sid] = (expires, entry[1])
+
+    def delete(self, sid):
+        with self._lock:
+            self._sessions.pop(sid, None)
+
+    def sweep(self, now):
+        with self._lock:
+            expired = [sid for sid, (expires, _) in self._sessions.items() if expires <= now]
+            for sid in expired:
+                del self._sessions[sid]
+        return len(expired)
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+class SqliteSessionStore:
+    """Sessions in their own SQLite file, one connection per thread of each process, opened on first use."""
+
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS session (sid TEXT PRIMARY KEY, expires REAL NOT NULL, data TEXT NOT NULL)'
+        ' WITHOUT ROWID',
+        'CREATE INDEX IF NOT EXISTS ix_session_expires ON session (expires)',
+    )
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def _connection(self):
+        # A forked child keeps the forking thread's locals; never reuse the parent's connection.
+        if getattr(self._local, 'pid', None) != os.getpid():
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            for statement in self.SCHEMA:
+                connection.execute(statement)
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return self._local.connection
+
+    def get(self, sid, now):
+        row = self._connection().execute(
+            'SELECT expires, data FROM session WHERE sid = ? AND expires > ?', (sid, now)).fetchone()
+        return None if row is None else (row[0], serializer.loads(row[1]))
+
+    def set(self, sid, data, expires):
+        self._connection().execute('INSERT OR REPLACE INTO session (sid, expires, data) VALUES (?, ?, ?)',
+                                   (sid, expires, serializer.dumps(data)))
+
+    def touch(self, sid, expires):
+        self._connection().execute('UPDATE session SET expires = ? WHERE sid = ?', (expires, sid))
+
+    def delete(self, sid):
+        self._connection().execute('DELETE FROM session WHERE sid = ?', (sid,))
+
+    def sweep(self, now):
+        return self._connection().execute('DELETE FROM session WHERE expires <= ?', (now,)).rowcount
+
+    def __len__(self):
+        return self._connection().execute('SELECT count(*) FROM session').fetchone()[0]
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """Flask session interface over a session store."""
+
+    session_class = ServerSideSession
+
+    def __init__(self, store, sweep_interval=0):
+        self.store = store
+        self.sweep_interval = sweep_interval
+        self.sweeper = None
+        self._lock = threading.Lock()
+
+    def start_sweeper(self):
+        """Start this process's sweeper, unless it runs already."""
+        with self._lock:
+            if self.sweeper is None or self.sweeper.pid != os.getpid():
+                self.sweeper = SessionSweeper(self.store, self.sweep_interval)
+                self.sweeper.start()
+
+    def open_session(self, app, request):
+        if self.sweep_interval and (self.sweeper is None or self.sweeper.pid != os.getpid()):
+            self.start_sweeper()
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            found = self.store.get(sid, time.time())
+            if found is not None:
+                return self.session_class(found[1], sid, found[0])
+        # Unknown ids are never adopted, so a session id cannot be planted.
+        return self.session_class()
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if not session:
+            if session.sid is not None:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path,
+                                       secure=self.get_cookie_secure(app),
+                                       samesite=self.get_cookie_samesite(app),
+                                       httponly=self.get_cookie_httponly(app))
+            return
+        if session.accessed:
+            response.vary.add('Cookie')
+        expires = time.time() + app.permanent_session_lifetime.total_seconds()
+        if session.regenerate and session.sid is not None:
+            self.store.delete(session.sid)
+            session.sid = None
+        if session.sid is None:
+            session.sid = secrets.token_urlsafe(SID_BYTES)
+        elif not session.modified:
+            if session.expires is not None and expires - session.expires >= TOUCH_INTERVAL:
+                self.store.touch(session.sid, expires)
+                if self.should_set_cookie(app, session):
+                    self._set_cookie(app, session, response)
+            return
+        self.store.set(session.sid, dict(session), expires)
+        self._set_cookie(app, session, response)
+
+    def _set_cookie(self, app, session, response):
+        response.set_cookie(self.get_cookie_name(app), session.sid,
+                            expires=self.get_expiration_time(app, session),
+                            httponly=self.get_cookie_httponly(app), domain=self.get_cookie_domain(app),
+                            path=self.get_cookie_path(app), secure=self.get_cookie_secure(app),
+                            samesite=self.get_cookie_samesite(app))
+
+
+class SessionSweeper(threading.Thread):
+    """Daemon thread deleting expired sessions every interval seconds."""
+
+    def __init__(self, store, interval):
+        super().__init__(name='session-sweeper', daemon=True)
+        self.store = store
+        self.interval = interval
+        self.pid = os.getpid()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.store.sweep(time.time())
+            except sqlite3.Error:
+                logging.exception('Session sweep failed')
+
+
+def make_store(config, instance_path):
+    """The session store for config's SESSION_TYPE, or None for Flask's cookie sessions."""
+    kind = config['SESSION_TYPE']
+    if kind == 'sqlite':
+        return SqliteSessionStore(config['SESSION_SQLITE_PATH'] or os.path.join(instance_path, 'sessions.db'))
+    if kind == 'memory':
+        return MemorySessionStore(config['SESSION_MEMORY_MAX'])
+    if kind == 'cookie':
+        return None
+    raise ValueError(f"SESSION_TYPE must be 'sqlite', 'memory' or 'cookie', not {kind!r}")
+
+
+def init_app(app):
+    """Install the configured session store on app; its sweeper starts with each process's first request."""
+    store = make_store(app.config, app.instance_path)
+    if store is not None:
+        app.session_interface = ServerSideSessionInterface(store, app.config['SESSION_SWEEP_INTERVAL'])
+
+
+def regenerate():
+    """Give the current session a new id when it is saved (call on login)."""
+    if isinstance(session._get_current_object(), ServerSideSession):
+        session.regenerate = True
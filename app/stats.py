@@ -0,0 +1,231 @@
+# app/stats.py
+"""
+This module keeps the dashboard numbers in the DashboardStat table.
+
+Mapper hooks on User, ClassName, ClassBatch, ClassBatchTeacher and
+StudentGroup adjust the counters in the flush that inserts, deletes or
+updates the rows, with one UPSERT per counter. The counters therefore
+commit or roll back with the change. Keys:
+- 'users', 'classes', 'batches';
+- 'teachers' (distinct teachers), backed by 'teacher:<user id>' row counts;
+- 'status:<status id>' and 'batch:<class batch id>': students per status
+  and per batch. Moving a ClassGroup to another region, or a ClassRegion
+  to another batch, moves its students between the 'batch:' counters.
+
+Deleting a ClassBatch drops its 'batch:' counter.
+
+Bulk inserts (``session.execute(insert(Model), rows)``) bypass the mapper;
+callers add their deltas with ``add()``. Other changes are fixed by
+``reconcile()``: a full recount, run every ``STATS_RECONCILE_INTERVAL``
+seconds by ``flask stats-reconcile`` from cron (see README.md). It rewrites
+every counter and commits, so requests only run it to seed a table that was
+never reconciled (a fresh deploy); after that the dashboard only logs a
+warning when the last run is older than the interval.
+"""
+import logging
+import time
+from collections import Counter
+from types import SimpleNamespace
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql, sqlite
+from flask import current_app
+from app import db
+import app.models as mo
+
+RECONCILED_AT = '_reconciled_at'
+Stat = mo.DashboardStat.__table__
+# When this worker last logged that the counters are stale
+_stale_logged_at = 0
+
+
+def _upsert(connection, key, delta):
+    dialect = postgresql if connection.dialect.name == 'postgresql' else sqlite
+    stmt = dialect.insert(Stat).values(key=key, value=delta)
+    stmt = stmt.on_conflict_do_update(index_elements=[Stat.c.key], set_={'value': Stat.c.value + stmt.excluded.value})
+    return connection.execute(stmt.returning(Stat.c.value)).scalar_one()
+
+
+def add(connection, deltas):
+    """Apply {key: delta} to the counters, on connection (a Connection, e.g. session.connection())."""
+    for key, delta in deltas.items():
+        if not delta:
+            continue
+        value = _upsert(connection, key, delta)
+        if key.startswith('teacher:') and value == (1 if delta > 0 else 0):
+            # The first row of a teacher or the last one gone changes the distinct count.
+            _upsert(connection, 'teachers', 1 if delta > 0 else -1)
+
+
+def _batch_of_group(connection, class_group_id):
+    return connection.execute(
+        sa.select(mo.ClassRegion.class_batch_id).join(mo.ClassGroup, mo.ClassGroup.class_region_id == mo.ClassRegion.id)
+        .where(mo.ClassGroup.id == class_group_id)).scalar()
+
+
+def _student_keys(connection, status_id, class_group_id):
+    return [f'status:{status_id}', f'batch:{_batch_of_group(connection, class_group_id)}']
+
+
+# model -> function(connection, row) returning the counter keys the row counts towards
+KEYS = {
+    mo.User: lambda connection, row: ['users'],
+    mo.ClassName: lambda connection, row: ['classes'],
+    mo.ClassBatch: lambda connection, row: ['batches'],
+    mo.ClassBatchTeacher: lambda connection, row: [f'teacher:{row.user_id}'],
+    mo.StudentGroup: lambda connection, row: _student_keys(connection, row.status_id, row.class_group_id),
+}
+# model -> the columns whose change moves a row between counters
+MOVES = {
+    mo.ClassBatchTeacher: ('user_id',),
+    mo.StudentGroup: ('status_id', 'class_group_id'),
+}
+
+
+def _counted(sign):
+    def listener(mapper, connection, target):
+        add(connection, dict.fromkeys(KEYS[mapper.class_](connection, target), sign))
+    return listener
+
+
+def _moved(mapper, connection, target):
+    state = sa.inspect(target)
+    if not any(state.attrs[name].history.has_changes() for name in MOVES[mapper.class_]):
+        return
+    # Read the old values before the UPDATE (they may never have been loaded).
+    table = mapper.local_table
+    old = connection.execute(sa.select(*(table.c[name] for name in MOVES[mapper.class_]))
+                             .where(table.c.id == target.id)).one()._asdict()
+    before = KEYS[mapper.class_](connection, SimpleNamespace(**old))
+    deltas = Counter(dict.fromkeys(KEYS[mapper.class_](connection, target), 1))
+    deltas.subtract(before)
+    add(connection, deltas)
+
+
+def _batch_move(connection, old_batch, new_batch, students):
+    if old_batch != new_batch and students:
+        add(connection, {f'batch:{old_batch}': -students, f'batch:{new_batch}': students})
+
+
+def _group_moved(mapper, connection, target):
+    if not sa.inspect(target).attrs.class_region_id.history.has_changes():
+        return
+    # Before the UPDATE, the row still points at its old region.
+    old_batch = _batch_of_group(connection, target.id)
+    new_batch = connection.execute(sa.select(mo.ClassRegion.class_batch_id)
+                                   .where(mo.ClassRegion.id == target.class_region_id)).scalar()
+    students = connection.execute(sa.select(sa.func.count()).select_from(mo.StudentGroup)
+                                  .where(mo.StudentGroup.class_group_id == target.id)).scalar()
+    _batch_move(connection, old_batch, new_batch, students)
+
+
+def _region_moved(mapper, connection, target):
+    if not sa.inspect(target).attrs.class_batch_id.history.has_changes():
+        return
+    old_batch = connection.execute(sa.select(mo.ClassRegion.class_batch_id)
+                                   .where(mo.ClassRegion.id == target.id)).scalar()
+    students = connection.execute(
+        sa.select(sa.func.count()).select_from(mo.StudentGroup)
+        .join(mo.ClassGroup, mo.ClassGroup.id == mo.StudentGroup.class_group_id)
+        .where(mo.ClassGroup.class_region_id == target.id)).scalar()
+    _batch_move(connection, old_batch, target.class_batch_id, students)
+
+
+for _model in KEYS:
+    sa.event.listen(_model, 'after_insert', _counted(1))
+    # Before the DELETE, so a row's unloaded columns can still be read.
+    sa.event.listen(_model, 'before_delete', _counted(-1))
+for _model in MOVES:
+    sa.event.listen(_model, 'before_update', _moved)
+sa.event.listen(mo.ClassGroup, 'before_update', _group_moved)
+sa.event.listen(mo.ClassRegion, 'before_update', _region_moved)
+
+
+@sa.event.listens_for(mo.ClassBatch, 'after_delete')
+def _batch_deleted(mapper, connection, target):
+    connection.execute(sa.delete(Stat).where(Stat.c.key == f'batch:{target.id}'))
+
+
+def recount():
+    """The counters as {key: value}, counted from the tables."""
+    session = db.session
+    counts = {
+        'users': session.scalar(sa.select(sa.func.count()).select_from(mo.User)),
+        'classes': session.scalar(sa.select(sa.func.count()).select_from(mo.ClassName)),
+        'batches': session.scalar(sa.select(sa.func.count()).select_from(mo.ClassBatch)),
+    }
+    teachers = session.execute(sa.select(mo.ClassBatchTeacher.user_id, sa.func.count())
+                               .group_by(mo.ClassBatchTeacher.user_id)).all()
+    counts.update((f'teacher:{user_id}', n) for user_id, n in teachers)
+    counts['teachers'] = len(teachers)
+    counts.update((f'status:{status_id}', n) for status_id, n in session.execute(
+        sa.select(mo.StudentGroup.status_id, sa.func.count()).group_by(mo.StudentGroup.status_id)))
+    counts.update((f'batch:{batch_id}', n) for batch_id, n in session.execute(
+        sa.select(mo.ClassRegion.class_batch_id, sa.func.count(mo.StudentGroup.id))
+        .join(mo.ClassGroup, mo.ClassGroup.id == mo.StudentGroup.class_group_id)
+        .join(mo.ClassRegion, mo.ClassRegion.id == mo.ClassGroup.class_region_id)
+        .group_by(mo.ClassRegion.class_batch_id)))
+    return counts
+
+
+def reconcile():
+    """Replace the counters with a full recount; return {key: (stored, counted)} for those that drifted."""
+    session = db.session
+    # Delete first: it takes the write lock, so no increment lands between the recount and the insert.
+    stored = {key: value for key, value in session.execute(sa.delete(Stat).returning(Stat.c.key, Stat.c.value))}
+    stored.pop(RECONCILED_AT, None)
+    counts = {key: value for key, value in recount().items() if value}
+    session.execute(sa.insert(Stat), [{'key': key, 'value': value} for key, value in counts.items()]
+                    + [{'key': RECONCILED_AT, 'value': int(time.time())}])
+    session.commit()
+    drift = {key: (stored.get(key, 0), counts.get(key, 0)) for key in stored.keys() | counts.keys()
+             if stored.get(key, 0) != counts.get(key, 0)}
+    if drift:
+        logging.warning(f'Dashboard counters drifted: {drift}')
+    return drift
+
+
+def counters():
+    """All counters, seeded by reconcile() if they never were; logs when they are stale."""
+    global _stale_logged_at
+    values = dict(db.session.execute(sa.select(Stat.c.key, Stat.c.value)).all())
+    if RECONCILED_AT not in values:
+        reconcile()
+        values = dict(db.session.execute(sa.select(Stat.c.key, Stat.c.value)).all())
+    interval = current_app.config['STATS_RECONCILE_INTERVAL']
+    now = time.time()
+    if now - values.get(RECONCILED_AT, 0) >= interval and now - _stale_logged_at >= interval:
+        _stale_logged_at = now
+        logging.warning(f'Dashboard counters not reconciled in the last {interval}s; schedule flask stats-reconcile.')
+    return values
+
+
+def dashboard_counts():
+    """The dashboard's headline numbers."""
+    values = counters()
+    return {
+        'num_students': values.get('users', 0),
+        'num_teachers': values.get('teachers', 0),
+        'num_classes': values.get('classes', 0),
+        'num_batches': values.get('batches', 0),
+    }
+
+
+def chart_series():
+    """Students per status name and per batch number, from the counters."""
+    by_prefix = {'status': {}, 'batch': {}}
+    for key, value in counters().items():
+        prefix, _, ref = key.partition(':')
+        if prefix in by_prefix and value and ref != 'None':
+            by_prefix[prefix][int(ref)] = value
+    statuses, batches = by_prefix['status'], by_prefix['batch']
+    status_names = dict(db.session.execute(
+        sa.select(mo.UserStatusLookup.id, mo.UserStatusLookup.status).where(mo.UserStatusLookup.id.in_(statuses))).all())
+    batch_names = dict(db.session.execute(
+        sa.select(mo.ClassBatch.id, mo.ClassBatch.batch_no).where(mo.ClassBatch.id.in_(batches))).all())
+    per_status = Counter()
+    for status_id, n in statuses.items():
+        per_status[status_names.get(status_id, str(status_id))] += n
+    per_batch = Counter()
+    for batch_id, n in batches.items():
+        per_batch[batch_names.get(batch_id, str(batch_id))] += n
+    return {'student_status': dict(sorted(per_status.items())), 'student_batch': dict(sorted(per_batch.items()))}
@@ -0,0 +1,139 @@
+# app/table_versions.py
+"""
+This module keeps a modification version per table, for cache keys.
+
+Tables are registered with ``track()``. A commit that changed a tracked
+table (ORM flushes, and insert/update/delete statements run through the
+session) increments the table's row in TableVersion inside that commit.
+After the commit, the new version is copied into this worker's dict. Other
+workers pick it up on their next read of the table, at most
+``TABLE_VERSION_CHECK_INTERVAL`` seconds later. In between, ``get()`` is a
+dict lookup.
+
+A table registered with ``track_partitions(table, column)`` is also
+versioned per value of column, as '<table>:<value>'. ORM flushes and
+multi-row inserts then bump only the partitions they touch. UPDATE and
+DELETE statements bump the table, so cache keys take both versions.
+"""
+import threading
+import time
+import sqlalchemy as sa
+import sqlalchemy.orm as so
+from sqlalchemy.dialects import postgresql, sqlite
+from flask import current_app
+from app import db
+import app.models as mo
+
+Version = mo.TableVersion.__table__
+
+
+class TableVersions:
+    """Per-worker copy of the TableVersion rows."""
+
+    def __init__(self):
+        self.tracked = set()
+        # table -> column it is partitioned on
+        self.partitions = {}
+        self._lock = threading.Lock()
+        self._versions = {}
+        self._checked_at = None
+
+    def track(self, *tables):
+        self.tracked.update(tables)
+
+    def track_partitions(self, table, column):
+        self.track(table)
+        self.partitions[table] = column
+
+    def _merge(self, versions):
+        with self._lock:
+            for table, version in versions:
+                if version > self._versions.get(table, 0):
+                    self._versions[table] = version
+
+    def get(self, tables):
+        """The versions of tables, as a tuple usable in cache keys."""
+        now = time.monotonic()
+        if self._checked_at is None or now - self._checked_at >= current_app.config['TABLE_VERSION_CHECK_INTERVAL']:
+            self._checked_at = now
+            self._merge(db.session.execute(sa.select(Version.c.table_name, Version.c.version)).all())
+        return tuple(self._versions.get(table, 0) for table in tables)
+
+    @staticmethod
+    def _increment(session, table):
+        dialect = postgresql if session.get_bind().dialect.name == 'postgresql' else sqlite
+        stmt = dialect.insert(Version).values(table_name=table, version=1)
+        stmt = stmt.on_conflict_do_update(index_elements=[Version.c.table_name],
+                                          set_={'version': Version.c.version + 1})
+        return session.execute(stmt.returning(Version.c.version)).scalar_one()
+
+    def _changed(self, session, tables):
+        tables = {table for table in tables if table.partition(':')[0] in self.tracked}
+        if tables:
+            session.info.setdefault('tables_changed', set()).update(tables)
+
+    def _flushed_keys(self, objects):
+        """The tables, or partitions of partitioned tables, of flushed objects."""
+        for obj in objects:
+            state = sa.inspect(obj)
+            table = state.mapper.local_table.name
+            column = self.partitions.get(table)
+            if column is None:
+                yield table
+                continue
+            values = set(state.attrs[column].history.deleted)
+            if column in state.dict:
+                values.add(state.dict[column])
+            else:
+                # Not loaded, so its partition is unknown.
+                yield table
+            for value in values:
+                yield f'{table}:{value}'
+
+    def _statement_keys(self, orm_execute_state):
+        table = orm_execute_state.statement.table
+        column = self.partitions.get(table.name)
+        params = orm_execute_state.parameters
+        if orm_execute_state.is_insert and column is not None and params:
+            rows = params if isinstance(params, (list, tuple)) else [params]
+            if all(column in row for row in rows):
+                return {f'{table.name}:{row[column]}' for row in rows}
+        return [table.name]
+
+
+versions = TableVersions()
+
+
+@sa.event.listens_for(so.Session, 'after_flush')
+def _flushed(session, flush_context):
+    versions._changed(session, versions._flushed_keys((*session.new, *session.dirty, *session.deleted)))
+
+
+@sa.event.listens_for(so.Session, 'do_orm_execute')
+def _executed(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        table = orm_execute_state.statement.table
+        if table is not Version:
+            versions._changed(orm_execute_state.session, versions._statement_keys(orm_execute_state))
+
+
+@sa.event.listens_for(so.Session, 'before_commit')
+def _increment_changed(session):
+    # The commit flushes after this hook; flush now so its tables are counted.
+    session.flush()
+    tables = session.info.pop('tables_changed', None)
+    if tables:
+        session.info['tables_committed'] = [(table, versions._increment(session, table)) for table in sorted(tables)]
+
+
+@sa.event.listens_for(so.Session, 'after_commit')
+def _committed(session):
+    committed = session.info.pop('tables_committed', None)
+    if committed:
+        versions._merge(committed)
+
+
+@sa.event.listens_for(so.Session, 'after_rollback')
+def _rolled_back(session):
+    session.info.pop('tables_changed', None)
+    session.info.pop('tables_committed', None)
@@ -0,0 +1,156 @@
+# app/throttle.py
+"""
+This module throttles login attempts before any password hashing.
+
+Each attempt takes a token from two in-memory token buckets: one for the
+email and one for the client IP. A bucket holds up to ``burst`` tokens and
+earns them all back over ``period`` seconds (``LOGIN_THROTTLE_EMAIL`` and
+``LOGIN_THROTTLE_IP``). When either bucket is empty, the attempt is rejected
+without touching the database or the hasher. A successful login refills the
+email's bucket. Emails are keyed as normalized for the login query
+(``dedup.normalize_email``), and the IP is ``request.remote_addr``, which
+is the forwarded client address when ``PROXY_FIX_X_FOR`` is set.
+
+Attempts are also counted per email. Every ``LOGIN_THROTTLE_FLUSH_INTERVAL``
+seconds the counts are written to Password.attempt_counts and
+last_attempt_time with one executemany UPDATE. A successful login resets
+attempt_counts. The buckets and the pending counts are per worker, hold at
+most ``MAX_KEYS`` entries each and start empty after a restart; the stored
+counts are not used for throttling.
+"""
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+import sqlalchemy as sa
+from flask import current_app
+from app import db
+import app.models as mo
+from app.dedup import normalize_email
+
+MAX_KEYS = 100000
+
+
+class TokenBuckets:
+    """Token buckets keyed by any hashable, least recently used dropped beyond max_keys."""
+
+    def __init__(self, max_keys=MAX_KEYS):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+
+    def tokens(self, key, burst, period, now):
+        """Tokens key has at now (not thread-safe; callers hold a lock)."""
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            return float(burst)
+        tokens, updated = bucket
+        return min(float(burst), tokens + (now - updated) * burst / period)
+
+    def set(self, key, tokens, now):
+        self._buckets[key] = (tokens, now)
+        self._buckets.move_to_end(key)
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+
+    def pop(self, key):
+        self._buckets.pop(key, None)
+
+    def clear(self):
+        self._buckets.clear()
+
+
+class LoginThrottle:
+    """Per-worker login throttle by email and IP, with attempt counts flushed to Password."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._emails = TokenBuckets()
+        self._ips = TokenBuckets()
+        # email -> [attempts since the last flush or success, last attempt time, success time or None],
+        # least recently used dropped beyond MAX_KEYS
+        self._pending = OrderedDict()
+        self._flushed_at = time.monotonic()
+
+    @staticmethod
+    def _key(email):
+        return normalize_email(email) or ''
+
+    def attempt(self, email, ip):
+        """Take a token for email and for ip.
+
+        Returns 0 when the attempt may go ahead, else the seconds until it
+        would be allowed.
+        """
+        email = self._key(email)
+        config = current_app.config
+        email_burst, email_period = config['LOGIN_THROTTLE_EMAIL']
+        ip_burst, ip_period = config['LOGIN_THROTTLE_IP']
+        now = time.monotonic()
+        with self._lock:
+            self._count(email)
+            email_tokens = self._emails.tokens(email, email_burst, email_period, now)
+            ip_tokens = self._ips.tokens(ip, ip_burst, ip_period, now)
+            if email_tokens < 1 or ip_tokens < 1:
+                return max((1 - email_tokens) * email_period / email_burst if email_tokens < 1 else 0,
+                           (1 - ip_tokens) * ip_period / ip_burst if ip_tokens < 1 else 0)
+            self._emails.set(email, email_tokens - 1, now)
+            self._ips.set(ip, ip_tokens - 1, now)
+            return 0
+
+    def _entry(self, email):
+        entry = self._pending.setdefault(email, [0, None, None])
+        self._pending.move_to_end(email)
+        while len(self._pending) > MAX_KEYS:
+            self._pending.popitem(last=False)
+        return entry
+
+    def _count(self, email):
+        entry = self._entry(email)
+        entry[0] += 1
+        entry[1] = datetime.now(timezone.utc)
+
+    def succeeded(self, email):
+        """Refill the email's bucket and reset its attempt count."""
+        email = self._key(email)
+        with self._lock:
+            self._emails.pop(email)
+            entry = self._entry(email)
+            entry[0] = 0
+            entry[2] = datetime.now(timezone.utc)
+
+    def maybe_flush(self):
+        """Flush the attempt counts if LOGIN_THROTTLE_FLUSH_INTERVAL has passed."""
+        if time.monotonic() - self._flushed_at >= current_app.config['LOGIN_THROTTLE_FLUSH_INTERVAL']:
+            self.flush()
+
+    def flush(self):
+        """Write the pending attempt counts to Password, in their own transaction."""
+        with self._lock:
+            pending, self._pending = self._pending, OrderedDict()
+            self._flushed_at = time.monotonic()
+        added = [{'b_email': email, 'b_count': count, 'b_time': last}
+                 for email, (count, last, success) in pending.items() if success is None]
+        reset = [{'b_email': email, 'b_count': count, 'b_time': last, 'b_success': success}
+                 for email, (count, last, success) in pending.items() if success is not None]
+        user_id = (sa.select(mo.Contact.user_id).where(mo.Contact.email == sa.bindparam('b_email'))
+                   .scalar_subquery())
+        with db.engine.begin() as connection:
+            if added:
+                connection.execute(
+                    sa.update(mo.Password).where(mo.Password.user_id == user_id)
+                    .values(attempt_counts=sa.func.coalesce(mo.Password.attempt_counts, 0) + sa.bindparam('b_count'),
+                            last_attempt_time=sa.bindparam('b_time')), added)
+            if reset:
+                connection.execute(
+                    sa.update(mo.Password).where(mo.Password.user_id == user_id)
+                    .values(attempt_counts=sa.bindparam('b_count'), last_attempt_time=sa.bindparam('b_time'),
+                            last_successful_attempt_time=sa.bindparam('b_success')), reset)
+
+    def clear(self):
+        with self._lock:
+            self._emails.clear()
+            self._ips.clear()
+            self._pending = OrderedDict()
+
+
+throttle = LoginThrottle()
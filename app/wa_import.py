@@ -0,0 +1,223 @@
+# app/wa_import.py
+"""
+This module bulk registers students from an exported WhatsApp chat.
+
+The export is read line by line and split into "*STUDENT DETAILS FOR ...*"
+blocks (one per message, with the WhatsApp date/sender prefixes stripped).
+Each block is parsed with ``parse_wa_text_fn`` and validated, with the geo
+names resolved through the geo cache. Duplicate numbers and emails, against
+existing contacts or earlier blocks, are found once per batch
+(``app/dedup.py``). Valid registrations are written in
+batches, one transaction per batch, with executemany inserts into User,
+Contact, HomeAddress, ResidentAddress, OtherDetail, Referrer and
+UserRegStatus. Each rejected block is reported with its reasons.
+"""
+import re
+from collections import namedtuple
+from datetime import datetime, timezone
+import sqlalchemy as sa
+from email_validator import validate_email, EmailNotValidError
+from app import db, stats
+from app.dedup import DuplicateChecker, describe, normalize_phone
+from app.geo import cache
+import app.models as mo
+from functions.parse_wa_text import parse_wa_text_fn
+
+BLOCK_MARKER = '*STUDENT DETAILS FOR'
+DEFAULT_BATCH_SIZE = 200
+
+# "12/03/2024, 10:15 - Name: ", "[12/03/24, 10:15:32 AM] Name: " (Android / iOS exports)
+MESSAGE_PREFIX = re.compile(
+    r'^\u200e?\[?\d{1,2}[/.-]\d{1,2}[/.-]\d{2,4},?\s+\d{1,2}:\d{2}(?::\d{2})?(?:\s?[APap]\.?[Mm]\.?)?\]?'
+    r'(?:\s+-)?\s+[^:]+:\s?')
+
+Block = namedtuple('Block', 'number line text')
+BlockResult = namedtuple('BlockResult', 'number line name email status errors')
+
+
+def iter_chat_blocks(lines):
+    """Yield the registration Blocks of a chat export, given an iterable of its lines.
+
+    A block starts at a line containing the marker and runs until the next
+    message of the chat, so chatter between registrations is never mixed in.
+    Pasting raw registration text (no message prefixes) works too.
+    """
+    current = None
+    start = 0
+    number = 0
+    for line_no, line in enumerate(lines, 1):
+        line = line.rstrip('\r\n').replace('\u200e', '')
+        match = MESSAGE_PREFIX.match(line)
+        if match:
+            line = line[match.end():]
+        if BLOCK_MARKER in line:
+            if current:
+                number += 1
+                yield Block(number, start, '\n'.join(current))
+            current = [line[line.index(BLOCK_MARKER):]]
+            start = line_no
+        elif match and current:
+            number += 1
+            yield Block(number, start, '\n'.join(current))
+            current = None
+        elif current is not None:
+            current.append(line)
+    if current:
+        yield Block(number + 1, start, '\n'.join(current))
+
+
+def _email(value):
+    if not value:
+        return None
+    try:
+        return validate_email(value, check_deliverability=False).normalized.lower()
+    except EmailNotValidError:
+        return None
+
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class WaImporter:
+    """Validates parsed registrations and inserts the valid ones in batches."""
+
+    def __init__(self, actor_id, batch_size=DEFAULT_BATCH_SIZE):
+        self.actor_id = actor_id
+        self.batch_size = batch_size
+        self.geo = cache.data
+        self.max_year = datetime.now().year - 10
+        self.results = []
+        self.dedup = DuplicateChecker()
+        self.reg_status_id = db.session.scalar(
+            sa.select(mo.RegStatusLookup.id).filter_by(status='NewRegistration'))
+
+    def _address(self, d, prefix, city_field, errors):
+        country = self.geo.resolve_country(d[f'{prefix}_country'])
+        if country is None:
+            errors.append(f'Unknown {prefix} country: {d[f"{prefix}_country"]!r}')
+            return None
+        state = self.geo.resolve_state(country.id, d[f'{prefix}_state'])
+        if state is None:
+            errors.append(f'Unknown {prefix} state in {country.name}: {d[f"{prefix}_state"]!r}')
+            return None
+        city = self.geo.resolve_city(state.id, d[city_field])
+        if city is None:
+            errors.append(f'Unknown {prefix} city in {state.name}: {d[city_field]!r}')
+            return None
+        return {'country_id': country.id, 'state_id': state.id, 'city_id': city.id}
+
+    def validate(self, d):
+        """Return (rows, errors) for one parsed registration."""
+        errors = []
+        full_name = (d['full_name'] or '').strip()
+        if not full_name:
+            errors.append('Full name is missing')
+        elif len(full_name) > 64:
+            errors.append('Full name is longer than 64 characters')
+        if d['gender'] not in ('M', 'F'):
+            errors.append('Gender is missing')
+        mobile = normalize_phone(d['mobile'])
+        if mobile is None:
+            errors.append(f'Invalid mobile: {d["mobile"]!r}')
+        whatsapp = normalize_phone(d['whatsapp']) if d['whatsapp'] else mobile
+        if whatsapp is None:
+            errors.append(f'Invalid WhatsApp: {d["whatsapp"]!r}')
+        email = _email(d['email'])
+        if email is None:
+            errors.append(f'Invalid email: {d["email"]!r}')
+        yob = _int(d['yob'])
+        if yob is None or not 1950 <= yob <= self.max_year:
+            errors.append(f'Invalid year of birth: {d["yob"]!r}')
+        if not d['education'] or not d['profession']:
+            errors.append('Education and profession are required')
+        home = self._address(d, 'hometown', 'hometown_district', errors)
+        resident = self._address(d, 'resident', 'resident_city', errors)
+        if errors:
+            return None, errors
+        if home is not None:
+            home['area'] = (d['hometown_city'] or '')[:32] or None
+        rows = {
+            'user': {'username': full_name, 'gender': d['gender'], 'birthyear': yob},
+            'contact': {'mobile': mobile, 'whatsapp': whatsapp, 'email': email},
+            'home': home,
+            'resident': resident,
+            'other': {'education': d['education'][:32], 'profession': d['profession'][:32]},
+            'referrer': None,
+        }
+        if d['referrer_name']:
+            rows['referrer'] = {'full_name': d['referrer_name'][:64], 'mobile': normalize_phone(d['referrer_mobile']),
+                                'email': _email(d['referrer_email']), 'batch': (d['referrer_batch'] or '')[:16] or None,
+                                'referrer_id': _int(d['referrer_student_id'])}
+        return rows, errors
+
+    def _insert(self, pending):
+        """Insert one batch of (block, parsed, rows) in a single transaction."""
+        duplicates = self.dedup.check((block.number, rows['contact']['mobile'], rows['contact']['whatsapp'],
+                                       rows['contact']['email']) for block, _, rows in pending)
+        accepted = []
+        for block, d, rows in pending:
+            if block.number in duplicates:
+                self.results.append(BlockResult(block.number, block.line, d['full_name'], rows['contact']['email'],
+                                                'rejected', [describe(dup, 'block') for dup in duplicates[block.number]]))
+            else:
+                accepted.append((block, d, rows))
+        if not accepted:
+            return
+        try:
+            user_ids = self._write(accepted)
+        except sa.exc.IntegrityError as e:
+            db.session.rollback()
+            for block, d, rows in accepted:
+                self.results.append(BlockResult(block.number, block.line, d['full_name'], rows['contact']['email'],
+                                                'rejected', [f'Batch rolled back: {e.orig}']))
+            return
+        self.dedup.accept(block.number for block, _, _ in accepted)
+        for user_id, (block, d, rows) in zip(user_ids, accepted):
+            self.results.append(BlockResult(block.number, block.line, d['full_name'], rows['contact']['email'],
+                                            'registered', [f'User ID {user_id}']))
+
+    def _write(self, accepted):
+        user_ids = db.session.scalars(
+            sa.insert(mo.User).returning(mo.User.id, sort_by_parameter_order=True),
+            [rows['user'] for _, _, rows in accepted]).all()
+        now = datetime.now(timezone.utc)
+        audit = {'created_by': self.actor_id, 'updated_by': self.actor_id, 'created_at': now, 'updated_at': now}
+        tables = {'contact': mo.Contact, 'home': mo.HomeAddress, 'resident': mo.ResidentAddress,
+                  'other': mo.OtherDetail}
+        for key, model in tables.items():
+            db.session.execute(sa.insert(model), [
+                {**rows[key], **audit, 'user_id': user_id} for user_id, (_, _, rows) in zip(user_ids, accepted)])
+        referrers = [{**rows['referrer'], 'user_id': user_id}
+                     for user_id, (_, _, rows) in zip(user_ids, accepted) if rows['referrer']]
+        if referrers:
+            db.session.execute(sa.insert(mo.Referrer), referrers)
+        # executemany inserts skip the mapper hooks that keep the dashboard counters
+        stats.add(db.session.connection(), {'users': len(user_ids)})
+        if self.reg_status_id is not None:
+            db.session.execute(sa.insert(mo.UserRegStatus), [
+                {**audit, 'user_id': user_id, 'status_id': self.reg_status_id} for user_id in user_ids])
+        db.session.commit()
+        return user_ids
+
+    def run(self, blocks):
+        """Parse, validate and insert every block; return the BlockResults in block order."""
+        pending = []
+        for block in blocks:
+            d = parse_wa_text_fn(block.text)
+            rows, errors = self.validate(d)
+            if errors:
+                self.results.append(BlockResult(block.number, block.line, d['full_name'], d['email'],
+                                                'rejected', errors))
+                continue
+            pending.append((block, d, rows))
+            if len(pending) >= self.batch_size:
+                self._insert(pending)
+                pending = []
+        if pending:
+            self._insert(pending)
+        self.results.sort(key=lambda r: r.number)
+        return self.results
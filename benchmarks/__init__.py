@@ -0,0 +1 @@
+"""Stand-alone benchmarks. Run from the repository root, e.g. ``python -m benchmarks.bench_geo_nearest``."""
@@ -0,0 +1,118 @@
+"""
+Benchmark the attendance report on a synthetic batch against plain Python loops.
+
+    python -m benchmarks.bench_attendance [--students 2000] [--sessions 200]
+
+The loop version is what a per-student report would do: fetch the marks with
+their session date and status letter, group them by student, sort by date,
+and walk each student's sessions once for counts, runs and lateness. One
+student in 20 is given a high absence rate, so the at-risk lists are not
+empty; both versions must agree on them.
+"""
+import argparse
+import statistics
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+import numpy as np
+import sqlalchemy as sa
+from app import create_app, db
+from app.config import Config
+from app.attendance_analytics import AttendanceMatrix, summarize
+import app.models as mo
+
+
+class BenchConfig(Config):
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+
+
+def populate(students, sessions, rng):
+    audit = {'created_by': 1, 'updated_by': 1}
+    db.session.execute(sa.insert(mo.AttendanceStatusLookup), [{'id': i, 'status': s} for i, s in enumerate('PLAE', 1)])
+    db.session.execute(sa.insert(mo.User), [{'id': i + 1, 'username': f'S{i + 1}', 'gender': 'F', 'birthyear': 2000}
+                                            for i in range(students)])
+    start = date(2024, 1, 1)
+    db.session.execute(sa.insert(mo.ClassSession), [
+        {'id': i + 1, 'class_date': start + timedelta(days=i), 'class_batch_id': 1, 'teacher_id': 1, **audit}
+        for i in range(sessions)])
+    status = rng.choice(4, size=(students, sessions), p=(0.85, 0.07, 0.06, 0.02)) + 1
+    absentees = rng.random(students) < 0.05
+    status[absentees] = rng.choice(4, size=(absentees.sum(), sessions), p=(0.5, 0.05, 0.43, 0.02)) + 1
+    late = rng.integers(1, 45, size=(students, sessions))
+    left = rng.random((students, sessions)) < 0.03
+    db.session.execute(sa.insert(mo.UserAttendance), [
+        {'user_id': u + 1, 'class_session_id': s + 1, 'attendance_status_id': int(status[u, s]),
+         'late_by_min': int(late[u, s]) if status[u, s] == 2 else None,
+         'left_early_by_min': 20 if left[u, s] else None, **audit}
+        for u in range(students) for s in range(sessions)])
+    db.session.commit()
+
+
+def loop_report(rows, at_risk_rate, at_risk_streak):
+    by_student = defaultdict(list)
+    for user_id, _, class_date, letter, late, left_early in rows:
+        by_student[user_id].append((class_date, letter, late, left_early))
+    students, late_all, left_all = {}, [], []
+    for user_id, marks in by_student.items():
+        marks.sort(key=lambda mark: mark[0])
+        attended = counted = longest = current = 0
+        late_minutes = []
+        for _, letter, late, left_early in marks:
+            if letter in 'PL':
+                attended += 1
+                counted += 1
+                current = 0
+            elif letter != 'E':
+                counted += 1
+                current += 1
+                longest = max(longest, current)
+            if late:
+                late_minutes.append(late)
+            if left_early:
+                left_all.append(left_early)
+        late_all.extend(late_minutes)
+        rate = attended / counted if counted else None
+        students[user_id] = {'rate': rate, 'longest': longest, 'current': current,
+                             'mean_late': statistics.fmean(late_minutes) if late_minutes else None,
+                             'at_risk': counted and (rate < at_risk_rate or current >= at_risk_streak)}
+    percentiles = statistics.quantiles(late_all, n=100)
+    return students, percentiles, statistics.quantiles(left_all, n=100) if len(left_all) > 1 else None
+
+
+def timed(label, fn, repeat=3):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    print(f'{label}: {best * 1000:8.1f} ms')
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--students', type=int, default=2000)
+    parser.add_argument('--sessions', type=int, default=200)
+    args = parser.parse_args()
+
+    app = create_app(BenchConfig)
+    with app.app_context():
+        db.create_all()
+        populate(args.students, args.sessions, np.random.default_rng(42))
+        rows = timed('naive query    ', lambda: db.session.execute(
+            sa.select(mo.UserAttendance.user_id, mo.UserAttendance.class_session_id, mo.ClassSession.class_date,
+                      mo.AttendanceStatusLookup.status, mo.UserAttendance.late_by_min,
+                      mo.UserAttendance.left_early_by_min)
+            .join(mo.ClassSession).join(mo.AttendanceStatusLookup).where(mo.ClassSession.class_batch_id == 1)).all())
+        looped = timed('python loops   ', lambda: loop_report(rows, 0.75, 3))
+        print(f'{len(rows)} attendance rows')
+        matrix = timed('load (arrays)  ', lambda: AttendanceMatrix.load(1))
+        vectorized = timed('numpy summarize', lambda: summarize(matrix, 0.75, 3))
+        at_risk = {user_id for user_id, row in looped[0].items() if row['at_risk']}
+        assert set(vectorized['at_risk']) == at_risk
+        print(f'{len(at_risk)} students at risk (both agree)')
+
+
+if __name__ == '__main__':
+    main()
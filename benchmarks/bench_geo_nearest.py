@@ -0,0 +1,77 @@
+"""
+Benchmark the nearest-city grid index against a naive SQL distance scan.
+
+    python -m benchmarks.bench_geo_nearest [--cities 150000] [--queries 1000]
+"""
+import argparse
+import time
+import numpy as np
+import sqlalchemy as sa
+from app import create_app, db
+from app.config import Config
+from app.geo_spatial import SpatialIndex
+import app.models as mo
+
+
+class BenchConfig(Config):
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+
+
+def synthetic_cities(n, rng):
+    """Half the cities clustered around a few dense regions, half spread out."""
+    centers = np.array([[22.0, 79.0], [30.0, 114.0], [50.0, 10.0], [39.0, -98.0], [-10.0, -55.0]])
+    dense = n // 2
+    which = rng.integers(0, len(centers), dense)
+    lats = np.concatenate((rng.normal(centers[which, 0], 4.0), rng.uniform(-60, 70, n - dense)))
+    lons = np.concatenate((rng.normal(centers[which, 1], 6.0), rng.uniform(-180, 180, n - dense)))
+    return np.clip(lats, -89.9, 89.9), (lons + 180) % 360 - 180
+
+
+def naive_nearest(lat, lon, k):
+    """ORDER BY an equirectangular distance over the whole table."""
+    scale = float(np.cos(np.radians(lat))) ** 2
+    dist = ((mo.Cities.latitude - lat) * (mo.Cities.latitude - lat)
+            + (mo.Cities.longitude - lon) * (mo.Cities.longitude - lon) * scale)
+    return db.session.scalars(sa.select(mo.Cities.id).order_by(dist).limit(k)).all()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cities', type=int, default=150_000)
+    parser.add_argument('--queries', type=int, default=1000)
+    parser.add_argument('--sql-queries', type=int, default=50)
+    parser.add_argument('-k', type=int, default=5)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(42)
+    lats, lons = synthetic_cities(args.cities, rng)
+    app = create_app(BenchConfig)
+    with app.app_context():
+        db.create_all()
+        db.session.execute(sa.insert(mo.Cities), [
+            {'id': i + 1, 'name': f'City {i + 1}', 'state_id': 1, 'country_id': 1, 'country_code': 'XX',
+             'latitude': float(la), 'longitude': float(lo)}
+            for i, (la, lo) in enumerate(zip(lats, lons))])
+        db.session.commit()
+
+        started = time.perf_counter()
+        index = SpatialIndex.from_db()
+        print(f'index build ({len(index)} cities): {time.perf_counter() - started:.2f}s')
+
+        queries = np.column_stack((rng.uniform(-50, 60, args.queries), rng.uniform(-150, 150, args.queries)))
+        started = time.perf_counter()
+        for lat, lon in queries:
+            index.nearest(lat, lon, args.k)
+        per_query = (time.perf_counter() - started) / len(queries)
+        print(f'grid index: {per_query * 1e3:.3f} ms/query ({1 / per_query:,.0f} queries/s)')
+
+        started = time.perf_counter()
+        for lat, lon in queries[:args.sql_queries]:
+            naive_nearest(float(lat), float(lon), args.k)
+        sql_per_query = (time.perf_counter() - started) / args.sql_queries
+        print(f'naive SQL scan: {sql_per_query * 1e3:.3f} ms/query ({1 / sql_per_query:,.0f} queries/s)')
+        print(f'speed-up: {sql_per_query / per_query:.0f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+Benchmark loading the geo cache from the tables vs mapping the geo snapshot.
+
+    python -m benchmarks.bench_geo_snapshot [--cities 150000] [--states 5000]
+
+Reports the load time and the Python heap a worker allocates for each, and
+the per-lookup cost of the location payloads.
+"""
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import sqlalchemy as sa
+from app import create_app, db
+from app.config import Config
+from app.geo import City, GeoData
+from app.geo_snapshot import GeoSnapshot, build_snapshot
+from benchmarks.bench_geo_nearest import synthetic_cities
+import app.models as mo
+
+
+class BenchConfig(Config):
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+
+
+def measure(label, load):
+    tracemalloc.start()
+    started = time.perf_counter()
+    data = load()
+    data.cities_json.get(1)
+    data.prefix_index.search('city 1')
+    data.nearest_cities(22.0, 79.0)
+    elapsed = time.perf_counter() - started
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f'{label}: load+index {elapsed:.2f}s, heap kept {current / 2**20:.1f} MiB (peak {peak / 2**20:.1f} MiB)')
+    return data
+
+
+def lookups(label, data, state_ids, city_ids):
+    started = time.perf_counter()
+    for state_id in state_ids:
+        data.cities_json.get(state_id)
+    for city_id in city_ids:
+        data.cities.get(city_id)
+    per = (time.perf_counter() - started) / (len(state_ids) + len(city_ids)) * 1e6
+    print(f'{label}: {per:.2f} us per cities_json/city lookup')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cities', type=int, default=150_000)
+    parser.add_argument('--states', type=int, default=5000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(42)
+    lats, lons = synthetic_cities(args.cities, rng)
+    app = create_app(BenchConfig)
+    path = os.path.join(tempfile.gettempdir(), 'bench_geo_snapshot.bin')
+    with app.app_context():
+        db.create_all()
+        db.session.execute(sa.insert(mo.Countries), [{'id': 1, 'name': 'Country', 'timezones': '[]'}])
+        db.session.execute(sa.insert(mo.States), [
+            {'id': i + 1, 'name': f'State {i + 1}', 'country_id': 1, 'country_code': 'XX'}
+            for i in range(args.states)])
+        db.session.execute(sa.insert(mo.Cities), [
+            {'id': i + 1, 'name': f'City {i + 1}', 'state_id': i % args.states + 1, 'country_id': 1,
+             'country_code': 'XX', 'latitude': float(la), 'longitude': float(lo)}
+            for i, (la, lo) in enumerate(zip(lats, lons))])
+        db.session.commit()
+
+        started = time.perf_counter()
+        build_snapshot(path)
+        print(f'snapshot build: {time.perf_counter() - started:.2f}s, {os.path.getsize(path) / 2**20:.1f} MiB')
+
+        def from_tables():
+            rows = GeoData.query_rows()
+            return GeoData(0, rows[0], rows[1], {row[0]: City(*row) for row in rows[2]})
+
+        tables = measure('tables  ', from_tables)
+        mapped = measure('snapshot', lambda: GeoSnapshot(path).geo_data(0))
+        state_ids = rng.integers(1, args.states + 1, 10_000).tolist()
+        city_ids = rng.integers(1, args.cities + 1, 10_000).tolist()
+        lookups('tables  ', tables, state_ids, city_ids)
+        lookups('snapshot', mapped, state_ids, city_ids)
+    os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
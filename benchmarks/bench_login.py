@@ -0,0 +1,101 @@
+"""
+Benchmark login throughput at several concurrency levels.
+
+    python -m benchmarks.bench_login [--logins 64] [--levels 1,2,4,8]
+                                     [--method scrypt:32768:8:1] [--workers N]
+
+Each level runs that many client threads posting valid logins, with the
+password hashing inline on the request threads and on the hashing pool
+(thread and process executors). Reports logins/s and the p95 latency.
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+import sqlalchemy as sa
+from app import create_app, db
+from app.config import Config
+from app.passwords import hasher
+import app.models as mo
+
+
+class BenchConfig(Config):
+    WTF_CSRF_ENABLED = False
+    CAPTCHA_ENABLE = False
+    SESSION_TYPE = 'memory'
+    # All clients share one IP
+    LOGIN_THROTTLE_IP = (10**9, 1)
+
+
+def seed(users):
+    password_hash = hasher.hash('bench-password')
+    user_ids = db.session.scalars(sa.insert(mo.User).returning(mo.User.id, sort_by_parameter_order=True), [
+        {'username': f'User {i}', 'gender': 'M', 'birthyear': 1990} for i in range(users)]).all()
+    db.session.execute(sa.insert(mo.Contact), [
+        {'user_id': user_id, 'mobile': 919800000000 + user_id, 'whatsapp': 919800000000 + user_id,
+         'email': f'user{user_id}@example.com', 'created_by': user_id, 'updated_by': user_id}
+        for user_id in user_ids])
+    db.session.execute(sa.insert(mo.Password), [
+        {'user_id': user_id, 'password_hash': password_hash, 'is_allowed': True} for user_id in user_ids])
+    db.session.commit()
+    return [f'user{user_id}@example.com' for user_id in user_ids]
+
+
+def run(app, emails, logins, concurrency):
+    latencies = []
+    lock = threading.Lock()
+
+    def client_thread(n):
+        client = app.test_client()
+        for i in range(n, logins, concurrency):
+            started = time.perf_counter()
+            response = client.post('/login', data={'email': emails[i % len(emails)],
+                                                   'password': 'bench-password', 'captcha': 'x'})
+            elapsed = time.perf_counter() - started
+            assert response.status_code == 302 and response.location == '/index', response.location
+            client.get('/logout')
+            with lock:
+                latencies.append(elapsed)
+
+    threads = [threading.Thread(target=client_thread, args=(n,)) for n in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return logins / elapsed, latencies[int(len(latencies) * 0.95) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--logins', type=int, default=64)
+    parser.add_argument('--levels', default='1,2,4,8')
+    parser.add_argument('--method', default=Config.PASSWORD_HASH_METHOD)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.gettempdir(), 'bench_login.db')
+    if os.path.exists(path):
+        os.remove(path)
+    BenchConfig.SQLALCHEMY_DATABASE_URI = 'sqlite:///' + path
+    BenchConfig.PASSWORD_HASH_METHOD = args.method
+    BenchConfig.PASSWORD_HASH_WORKERS = args.workers
+    app = create_app(BenchConfig)
+    with app.app_context():
+        db.create_all()
+        emails = seed(32)
+    print(f'{args.method}, {os.cpu_count()} CPUs, pool of {args.workers or os.cpu_count()}')
+    for executor in ('inline', 'thread', 'process'):
+        app.config['PASSWORD_HASH_EXECUTOR'] = executor
+        for level in map(int, args.levels.split(',')):
+            rate, p95 = run(app, emails, args.logins, level)
+            print(f'{executor:7} x{level:<3} {rate:7.1f} logins/s  p95 {p95 * 1000:7.1f} ms')
+    hasher.shutdown()
+    os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+Benchmark the session stores against a file-per-session store at 100k sessions.
+
+    python -m benchmarks.bench_sessions [--sessions 100000] [--reads 10000]
+
+The filesystem store below mirrors what Flask-Session's 'filesystem' type
+does (cachelib's FileSystemCache): one pickle per session, named by the md5
+of the id, in one directory, with expiry found by reading every file.
+Half of the sessions are written already expired, then swept.
+"""
+import argparse
+import hashlib
+import os
+import pickle
+import random
+import secrets
+import shutil
+import tempfile
+import time
+from app.sessions import MemorySessionStore, SqliteSessionStore
+
+DATA = {'_user_id': '12345', '_fresh': True, 'captcha_answer': '482913', '_id': 'x' * 128}
+
+
+class FilesystemSessionStore:
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, sid):
+        return os.path.join(self.directory, hashlib.md5(sid.encode()).hexdigest())
+
+    def get(self, sid, now):
+        try:
+            with open(self._path(sid), 'rb') as f:
+                expires, data = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        return (expires, data) if expires > now else None
+
+    def set(self, sid, data, expires):
+        path = self._path(sid)
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump((expires, data), f)
+        os.replace(path + '.tmp', path)
+
+    def sweep(self, now):
+        removed = 0
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            with open(path, 'rb') as f:
+                expires, _ = pickle.load(f)
+            if expires <= now:
+                os.remove(path)
+                removed += 1
+        return removed
+
+
+def disk_usage(path):
+    """Bytes allocated on disk (a small file still takes a whole block)."""
+    if os.path.isfile(path):
+        return os.stat(path).st_blocks * 512
+    return sum(os.stat(os.path.join(path, name)).st_blocks * 512 for name in os.listdir(path))
+
+
+def bench(label, store, sids, reads, path=None):
+    now = time.time()
+    started = time.perf_counter()
+    for i, sid in enumerate(sids):
+        store.set(sid, DATA, now - 1 if i % 2 else now + 3600)
+    write = time.perf_counter() - started
+    sample = random.Random(1).sample(sids, reads)
+    started = time.perf_counter()
+    for sid in sample:
+        store.get(sid, now)
+    read = (time.perf_counter() - started) / reads * 1e6
+    started = time.perf_counter()
+    swept = store.sweep(now)
+    sweep = time.perf_counter() - started
+    size = f', {disk_usage(path) / 2**20:.1f} MiB left on disk' if path else ''
+    print(f'{label:10} write {len(sids) / write:8.0f}/s  read {read:7.1f} us  '
+          f'sweep {swept} in {sweep:6.2f}s{size}')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sessions', type=int, default=100_000)
+    parser.add_argument('--reads', type=int, default=10_000)
+    args = parser.parse_args()
+
+    sids = [secrets.token_urlsafe(32) for _ in range(args.sessions)]
+    directory = tempfile.mkdtemp(prefix='bench_sessions_')
+    try:
+        files = os.path.join(directory, 'files')
+        bench('filesystem', FilesystemSessionStore(files), sids, args.reads, files)
+        db_path = os.path.join(directory, 'sessions.db')
+        store = SqliteSessionStore(db_path)
+        bench('sqlite', store, sids, args.reads)
+        store._connection().execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        print(f'{"":10} {disk_usage(db_path) / 2**20:.1f} MiB left on disk (freed pages are reused)')
+        bench('memory', MemorySessionStore(args.sessions), sids, args.reads)
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
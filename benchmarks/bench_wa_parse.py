@@ -0,0 +1,60 @@
+"""
+Benchmark WhatsApp registration parsing throughput on one core.
+
+    python -m benchmarks.bench_wa_parse [--blocks 20000]
+"""
+import argparse
+import time
+from functions.parse_wa_text import WaTextParser
+
+TEMPLATE = """*STUDENT DETAILS FOR TAFSEER-07 BATCH*
+======================================
+Full Name: student number {i}
+Mobile#: +91 98765 {i:05d}
+WhatsApp#: +91 98765 {i:05d}
+Gender: Female
+——————————————
+HOMETOWN DETAILS
+Country: India
+State: Uttar Pradesh
+District: Lucknow
+Town/City: Aminabad
+——————————————
+CURRENT RESIDENCE
+Country: United Arab Emirates
+State: Dubai
+City: Dubai
+Area: Deira
+——————————————
+OTHER DETAILS
+Year of birth: 1990
+Education: B.Tech
+Profession: Engineer
+Email Address: student{i}@example.com
+——————————————
+REFERRED By
+Full Name: Abdul Kareem
+Mobile#: 919876500000
+Email#: kareem@example.com
+Student ID#: 12
+Batch#: t-05
+——————————————"""
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--blocks', type=int, default=20_000)
+    args = parser.parse_args()
+
+    texts = [TEMPLATE.format(i=i) for i in range(args.blocks)]
+    wa_parser = WaTextParser()
+    started = time.perf_counter()
+    for _ in wa_parser.parse_many(texts):
+        pass
+    elapsed = time.perf_counter() - started
+    print(f'{args.blocks} registrations in {elapsed:.2f}s: {args.blocks / elapsed:,.0f}/s per core, '
+          f'{elapsed / args.blocks * 1e6:.1f} us each')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,156 +1,153 @@
 import re
 
-# Initialize the dictionary
-USERDICT = {
-    'class_name': None,
-    'batch_name': None,
-    'full_name': None,
-    'mobile': None,
-    'whatsapp': None,
-    'email': None,
-    'gender': None,
-    'hometown_country': None,
-    'hometown_state': None,
-    'hometown_district': None,
-    'hometown_city': None,
-    'resident_country': None,
-    'resident_state': None,
-    'resident_city': None,
-    'yob': None,
-    'education': None,
-    'profession': None,
-    'referrer_name': None,
-    'referrer_mobile': None,
-    'referrer_email': None,
-    'referrer_batch': None,
-    'referrer_student_id': None,
-    'any_other_detail': "",
-    'registration_status': 'NewRegistration',
-}
+# Keys of a parsed registration, in form order
+FIELDS = (
+    'class_name',
+    'batch_name',
+    'full_name',
+    'mobile',
+    'whatsapp',
+    'email',
+    'gender',
+    'hometown_country',
+    'hometown_state',
+    'hometown_district',
+    'hometown_city',
+    'resident_country',
+    'resident_state',
+    'resident_city',
+    'yob',
+    'education',
+    'profession',
+    'referrer_name',
+    'referrer_mobile',
+    'referrer_email',
+    'referrer_batch',
+    'referrer_student_id',
+    'any_other_detail',
+    'registration_status',
+)
 
 def capitalize_name(name):
     """Capitalize each word in the name."""
-    return ' '.join([word.capitalize() for word in name.split()])
+    return ' '.join(map(str.capitalize, name.split()))
+
+NON_DIGITS = re.compile(r'\D')
+LEADING_DIGITS = re.compile(r'\d+')
 
 def clean_phone(number):
     """Remove non-numeric characters from the phone number."""
-    return re.sub(r'\D', '', number)
+    return NON_DIGITS.sub('', number)
+
+def _gender(value):
+    return 'M' if value.lower().startswith('m') else 'F'
+
+def _digits(value):
+    match = LEADING_DIGITS.match(value)
+    return match.group() if match else None
+
+def _lower(value):
+    return value.lower()
+
+def _upper(value):
+    return value.upper()
+
+
+class WaTextParser:
+    """Parses a "*STUDENT DETAILS FOR ... BATCH*" WhatsApp registration into a dict.
+
+    The text is scanned once, line by line: a line without a value that
+    contains a section heading (ignoring case, emoji and punctuation, so
+    "🏠 Hometown details:" counts) switches the section, and every
+    "Label: value" line is split on its first colon and
+    dispatched on the section's label table, so a blank value never spills
+    into the next line. The few patterns left are compiled once.
+    ``parse()`` returns a new dict per call, so one parser can be shared by
+    any number of threads.
+    """
+
+    BATCH = re.compile(r'\*STUDENT DETAILS FOR (.*) BATCH\*')
+    STRIP = ' \t\r*_#'
+    NOT_LETTERS = re.compile(r'[^A-Z]+')
+
+    # Section heading -> {label (lower case, without '#'): (field, transform)}.
+    # Lines before the first heading and after a '———' separator are personal details.
+    SECTIONS = {
+        'HOMETOWN DETAILS': {
+            'country': ('hometown_country', capitalize_name),
+            'state': ('hometown_state', capitalize_name),
+            'district': ('hometown_district', capitalize_name),
+            'town/city': ('hometown_city', capitalize_name),
+        },
+        'CURRENT RESIDENCE': {
+            'country': ('resident_country', capitalize_name),
+            'state': ('resident_state', capitalize_name),
+            'city': ('resident_city', capitalize_name),
+            'town/city': ('resident_city', capitalize_name),
+        },
+        'OTHER DETAILS': {
+            'year of birth': ('yob', _digits),
+            'education': ('education', capitalize_name),
+            'profession': ('profession', capitalize_name),
+            'email address': ('email', _lower),
+        },
+        'REFERRED By': {
+            'full name': ('referrer_name', capitalize_name),
+            'mobile': ('referrer_mobile', clean_phone),
+            'email': ('referrer_email', _lower),
+            'student id': ('referrer_student_id', _digits),
+            'batch': ('referrer_batch', _upper),
+        },
+    }
+    HEADINGS = [(heading.upper(), labels) for heading, labels in SECTIONS.items()]
+    PERSONAL = {
+        'full name': ('full_name', capitalize_name),
+        'mobile': ('mobile', clean_phone),
+        'whatsapp': ('whatsapp', clean_phone),
+        'gender': ('gender', _gender),
+    }
+
+    def parse(self, text):
+        """Extract student details from one registration text."""
+        result = dict.fromkeys(FIELDS)
+
+        batch_match = self.BATCH.search(text)
+        if batch_match:
+            class_batch = batch_match.group(1).strip().split('-')
+            result['class_name'] = class_batch[0].strip()
+            result['batch_name'] = class_batch[1].strip() if len(class_batch) > 1 else ""
+
+        strip = self.STRIP
+        fields = self.PERSONAL
+        for line in text.splitlines():
+            label, _, value = line.partition(':')
+            value = value.strip(strip)
+            if not value:
+                if line.lstrip().startswith('—'):
+                    fields = self.PERSONAL
+                else:
+                    fields = self._section(line) or fields
+                continue
+            field = fields.get(label.strip(strip).lower())
+            if field is not None and result[field[0]] is None:
+                result[field[0]] = field[1](value)
+        return result
+
+    def _section(self, line):
+        words = ' '.join(self.NOT_LETTERS.sub(' ', line.upper()).split())
+        for heading, labels in self.HEADINGS:
+            if heading in words:
+                return labels
+        return None
+
+    def parse_many(self, texts):
+        """Yield one parsed dict per registration text."""
+        for text in texts:
+            yield self.parse(text)
+
+
+_parser = WaTextParser()
 
 def parse_wa_text_fn(text):
     """Extract student details"""
-    # Reset USERDICT
-    for key in USERDICT:
-        USERDICT[key] = None
-
-    # Extract batch info
-    batch_match = re.search(r'\*STUDENT DETAILS FOR (.*) BATCH\*', text)
-    if batch_match:
-        class_batch = batch_match.group(1).strip()
-        class_batch = class_batch.split('-')
-        if class_batch:
-            USERDICT['class_name'] = class_batch[0].strip()
-            USERDICT['batch_name'] = class_batch[1].strip() if len(class_batch) > 1 else ""
-        else:
-            USERDICT['class_name'], USERDICT['batch_name'] = ("", "")
-
-    # Extract sections
-    sections = re.split(r'—+', text)
-    for section in sections:
-        if 'HOMETOWN DETAILS' in section:
-            parse_hometown(section)
-        elif 'CURRENT RESIDENCE' in section:
-            parse_residence(section)
-        elif 'OTHER DETAILS' in section:
-            parse_other_details(section)
-        elif 'REFERRED By' in section:
-            parse_referrer(section)
-        else:
-            parse_personal_details(section)
-
-    return USERDICT
-
-def parse_personal_details(section):
-    name_match = re.search(r'Full Name:\s*(.*)', section)
-    if name_match:
-        USERDICT['full_name'] = capitalize_name(name_match.group(1).strip())
-
-    mobile_match = re.search(r'Mobile:\s*(.*)', section)
-    if mobile_match:
-        USERDICT['mobile'] = clean_phone(mobile_match.group(1))
-
-    whatsapp_match = re.search(r'WhatsApp:\s*(.*)', section)
-    if whatsapp_match:
-        USERDICT['whatsapp'] = clean_phone(whatsapp_match.group(1))
-
-    gender_match = re.search(r'Gender:\s*(\w+)', section)
-    if gender_match:
-        gender = gender_match.group(1).strip().lower()
-        USERDICT['gender'] = 'M' if gender.startswith('m') else 'F'
-
-def parse_hometown(section):
-    country_match = re.search(r'Country:\s*(.*)', section)
-    if country_match:
-        USERDICT['hometown_country'] = capitalize_name(country_match.group(1).strip())
-
-    state_match = re.search(r'State:\s*(.*)', section)
-    if state_match:
-        USERDICT['hometown_state'] = capitalize_name(state_match.group(1).strip())
-
-    district_match = re.search(r'District:\s*(.*)', section)
-    if district_match:
-        USERDICT['hometown_district'] = capitalize_name(district_match.group(1).strip())
-
-    city_match = re.search(r'Town/City:\s*(.*)', section)
-    if city_match:
-        USERDICT['hometown_city'] = capitalize_name(city_match.group(1).strip())
-
-def parse_residence(section):
-    country_match = re.search(r'Country:\s*(.*)', section)
-    if country_match:
-        USERDICT['resident_country'] = capitalize_name(country_match.group(1).strip())
-
-    state_match = re.search(r'State:\s*(.*)', section)
-    if state_match:
-        USERDICT['resident_state'] = capitalize_name(state_match.group(1).strip())
-
-    city_match = re.search(r'City:\s*(.*)', section)
-    if city_match:
-        USERDICT['resident_city'] = capitalize_name(city_match.group(1).strip())
-
-def parse_other_details(section):
-    yob_match = re.search(r'Year of birth:\s*(\d+)', section)
-    if yob_match:
-        USERDICT['yob'] = yob_match.group(1).strip()
-
-    education_match = re.search(r'Education:\s*(.*)', section)
-    if education_match:
-        USERDICT['education'] = capitalize_name(education_match.group(1).strip())
-
-    profession_match = re.search(r'Profession:\s*(.*)', section)
-    if profession_match:
-        USERDICT['profession'] = capitalize_name(profession_match.group(1).strip())
-
-    email_match = re.search(r'Email Address:\s*(.*)', section)
-    if email_match:
-        USERDICT['email'] = email_match.group(1).strip().lower()
-
-def parse_referrer(section):
-    name_match = re.search(r'Full Name:\s*(.*)', section)
-    if name_match:
-        USERDICT['referrer_name'] = capitalize_name(name_match.group(1).strip())
-
-    mobile_match = re.search(r'Mobile#:\s*(.*)', section)
-    if mobile_match:
-        USERDICT['referrer_mobile'] = clean_phone(mobile_match.group(1))
-
-    email_match = re.search(r'Email#:\s*(.*)', section)
-    if email_match:
-        USERDICT['referrer_email'] = email_match.group(1).strip().lower()
-
-    student_id_match = re.search(r'Student ID#:\s*(\d+)', section)
-    if student_id_match:
-        USERDICT['referrer_student_id'] = student_id_match.group(1).strip()
-
-    batch_match = re.search(r'Batch#:\s*(.*)', section)
-    if batch_match:
-        USERDICT['referrer_batch'] = batch_match.group(1).strip().upper()
\ No newline at end of file
+    return _parser.parse(text)
@@ -0,0 +1,161 @@
+import os
+import tempfile
+from pathlib import Path
+from contextlib import contextmanager
+from datetime import datetime
+import pytest
+import sqlalchemy as sa
+from flask import g
+from app import captcha, create_app, db
+from app.config import Config
+from app.geo import cache
+from app.identity import user_cache
+from app.throttle import throttle
+import app.models as mo
+
+
+class TestConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+    WTF_CSRF_ENABLED = False
+    CAPTCHA_ENABLE = False
+    LOGIN_DISABLED = True
+    GEO_CACHE_STAMP = os.path.join(tempfile.gettempdir(), 'sims_test_geo_cache.stamp')
+    GEO_CACHE_CHECK_INTERVAL = 0
+    SESSION_TYPE = 'memory'
+    SESSION_SWEEP_INTERVAL = 0
+    GEO_SNAPSHOT_PATH = os.path.join(tempfile.gettempdir(), 'sims_test_geo_snapshot.bin')
+
+
+@pytest.fixture(scope='session')
+def app():
+    # Routes are attached to the first app created, so share one per session.
+    app = create_app(TestConfig)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@contextmanager
+def _statements():
+    statements = []
+
+    def before_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    sa.event.listen(db.engine, 'before_cursor_execute', before_execute)
+    try:
+        yield statements
+    finally:
+        sa.event.remove(db.engine, 'before_cursor_execute', before_execute)
+
+
+@pytest.fixture
+def count_statements(app):
+    # Used as `with count_statements() as statements:`; the list holds the SQL run inside the block.
+    return _statements
+
+
+@pytest.fixture
+def member(app):
+    user = mo.User(username='Member', gender='M', birthyear=1990)
+    db.session.add(user)
+    db.session.flush()
+    password = mo.Password(user_id=user.id, is_allowed=True)
+    password.set_password('secret-pass')
+    db.session.add_all([password, mo.Contact(user_id=user.id, mobile=919800000001, whatsapp=919800000001,
+                                             email='member@example.com', created_by=user.id, updated_by=user.id)])
+    db.session.commit()
+    user_id = user.id
+    db.session.remove()
+    user_cache.clear()
+    yield user_id
+    # The session-wide app context is shared with test requests, so drop Flask-Login's user from g.
+    g.pop('_login_user', None)
+    user_cache.clear()
+    throttle.clear()
+    for model in (mo.Password, mo.Contact, mo.User):
+        db.session.query(model).delete()
+    db.session.commit()
+
+
+@pytest.fixture
+def admin(client, member, monkeypatch):
+    # client, logged in as member with the Admin role.
+    monkeypatch.setattr(captcha, 'validate', lambda: True)
+    role = mo.Role(role='Admin', level=10)
+    db.session.add(role)
+    db.session.flush()
+    db.session.add(mo.UserRole(user_id=member, role_id=role.id, created_by=member, updated_by=member))
+    db.session.commit()
+    assert client.post('/login', data={'email': 'member@example.com', 'password': 'secret-pass',
+                                       'captcha': 'x'}).location == '/index'
+    yield member
+    db.session.execute(sa.delete(mo.UserRole))
+    db.session.execute(sa.delete(mo.Role))
+    db.session.commit()
+    user_cache.clear()
+
+
+@pytest.fixture(scope='session')
+def registration():
+    # The WhatsApp registration message, as registration(name=..., suffix=<last mobile digits>, email=...).
+    return (Path(__file__).parent / 'data' / 'registration.txt').read_text(encoding='utf-8').rstrip('\n').format
+
+
+@pytest.fixture
+def geo_rows(app):
+    db.session.add_all([
+        mo.Countries(id=1, name='Guinea', iso2='GN', iso3='GIN', timezones='[]'),
+        mo.Countries(id=2, name='India', iso2='IN', iso3='IND', capital='New Delhi',
+                     timezones='[{"zoneName":"Asia/Kolkata","gmtOffset":19800,"gmtOffsetName":"UTC+05:30","abbreviation":"IST","tzName":"Indian Standard Time"}]'),
+        mo.States(id=10, name='Telangana', country_id=2, country_code='IN', iso2='TG'),
+        mo.States(id=11, name='Uttar Pradesh', country_id=2, country_code='IN', iso2='UP'),
+        mo.Cities(id=100, name='Hyderabad', state_id=10, country_id=2, country_code='IN', state_code='TG', latitude=17.38, longitude=78.45),
+        mo.Cities(id=101, name='Secunderabad', state_id=10, country_id=2, country_code='IN', state_code='TG', latitude=17.44, longitude=78.50),
+        mo.Cities(id=102, name='Lucknow', state_id=11, country_id=2, country_code='IN', state_code='UP', latitude=26.85, longitude=80.95),
+    ])
+    db.session.commit()
+    cache.invalidate()
+    yield
+    for model in (mo.Cities, mo.States, mo.Countries):
+        db.session.query(model).delete()
+    db.session.commit()
+    cache.invalidate()
+
+
+@pytest.fixture
+def school(app):
+    admin = mo.User(username='Admin', gender='M', birthyear=1980)
+    db.session.add(admin)
+    db.session.flush()
+    audit = {'created_by': admin.id, 'updated_by': admin.id}
+    db.session.add_all([mo.ClassBatchStatus(id=1, status='Running'),
+                        mo.UserStatusLookup(id=1, status='Active'), mo.UserStatusLookup(id=2, status='Left')])
+    tafseer = mo.ClassName(name='TAF', **audit)
+    db.session.add(tafseer)
+    db.session.flush()
+    batches = [mo.ClassBatch(class_name_id=tafseer.id, batch_no=no, start_date=datetime(2024, 1, 1), status_id=1,
+                             **audit) for no in ('07', '08')]
+    db.session.add_all(batches)
+    db.session.flush()
+    regions = [mo.ClassRegion(class_name_id=tafseer.id, class_batch_id=b.id, section='A', **audit) for b in batches]
+    db.session.add_all(regions)
+    db.session.flush()
+    groups = [mo.ClassGroup(name=f'G{r.id}', class_region_id=r.id, **audit) for r in regions]
+    db.session.add_all(groups)
+    db.session.commit()
+    yield {'admin': admin.id, 'audit': audit, 'batches': [b.id for b in batches], 'groups': [g.id for g in groups]}
+    for model in (mo.TestSessionScore, mo.TestSession, mo.UserAttendance, mo.ClassSession, mo.AttendanceStatusLookup,
+                  mo.StudentGroup, mo.ClassBatchTeacher, mo.ClassGroup, mo.ClassRegion, mo.ClassBatch, mo.ClassName,
+                  mo.ClassBatchStatus, mo.UserStatusLookup, mo.Contact, mo.User, mo.DashboardStat):
+        db.session.query(model).delete()
+    db.session.commit()
+    db.session.remove()
@@ -0,0 +1,81 @@
+from datetime import date, timedelta
+import numpy as np
+from app import db
+from app.attendance_analytics import AttendanceMatrix, absence_runs, summarize
+import app.models as mo
+
+
+def naive_runs(row):
+    longest = current = 0
+    for attended, absent in row:
+        if absent:
+            current += 1
+            longest = max(longest, current)
+        elif attended:
+            current = 0
+    return longest, current
+
+
+def test_absence_runs_match_a_loop():
+    rng = np.random.default_rng(7)
+    status = rng.integers(-1, 4, size=(50, 40))
+    attended, absent = status <= 1, status == 2
+    attended &= status >= 0
+    longest, current = absence_runs(attended, absent)
+    expected = [naive_runs(zip(a, b)) for a, b in zip(attended, absent)]
+    assert list(zip(longest.tolist(), current.tolist())) == expected
+
+
+def test_report_from_the_tables(school):
+    audit = school['audit']
+    batch, other = school['batches']
+    db.session.add_all([mo.AttendanceStatusLookup(id=i, status=s) for i, s in enumerate('PLAE', 1)])
+    students = [mo.User(username=f'S{i}', gender='F', birthyear=2000) for i in range(4)]
+    db.session.add_all(students)
+    db.session.flush()
+    # S3 is enrolled but has no marks yet; the others are only known from their marks.
+    db.session.add(mo.StudentGroup(user_id=students[3].id, class_group_id=school['groups'][0], status_id=1, **audit))
+    start = date(2024, 1, 1)
+    # Added out of date order; the other batch's session is left out.
+    sessions = [mo.ClassSession(class_date=start + timedelta(days=7 * i), class_batch_id=batch,
+                                teacher_id=school['admin'], **audit) for i in (3, 0, 1, 2)]
+    sessions.append(mo.ClassSession(class_date=start, class_batch_id=other, teacher_id=school['admin'], **audit))
+    db.session.add_all(sessions)
+    db.session.flush()
+    by_week = {0: sessions[1], 1: sessions[2], 2: sessions[3], 3: sessions[0]}
+    marks = {
+        students[0]: ['P', 'L', 'P', 'P'],
+        students[1]: ['A', 'P', 'A', 'A'],
+        students[2]: ['E', 'A', None, 'P'],
+    }
+    late = {(students[0], 1): 12}
+    status_id = {'P': 1, 'L': 2, 'A': 3, 'E': 4}
+    for student, row in marks.items():
+        for week, mark in enumerate(row):
+            if mark:
+                db.session.add(mo.UserAttendance(user_id=student.id, class_session_id=by_week[week].id,
+                                                 attendance_status_id=status_id[mark],
+                                                 late_by_min=late.get((student, week)), **audit))
+    db.session.add(mo.UserAttendance(user_id=students[0].id, class_session_id=sessions[4].id,
+                                     attendance_status_id=3, **audit))
+    db.session.commit()
+
+    matrix = AttendanceMatrix.load(batch)
+    assert matrix.status.shape == (4, 4)
+    assert [str(d) for d in matrix.dates] == ['2024-01-01', '2024-01-08', '2024-01-15', '2024-01-22']
+    report = summarize(matrix, 0.75, 3)
+    rows = {row['user_id']: row for row in report['students']}
+    assert rows[students[0].id]['rate'] == 1.0 and rows[students[0].id]['mean_late'] == 12.0
+    assert rows[students[1].id]['rate'] == 0.25
+    assert (rows[students[1].id]['longest_absence'], rows[students[1].id]['current_absence']) == (2, 2)
+    # Excused and unmarked sessions are not counted.
+    assert (rows[students[2].id]['attended'], rows[students[2].id]['counted']) == (1, 2)
+    assert (rows[students[3].id]['counted'], rows[students[3].id]['rate']) == (0, None)
+    assert report['at_risk'] == [students[1].id, students[2].id]
+    assert [s['rate'] for s in report['sessions']] == [0.5, 0.6667, 0.5, 0.6667]
+    assert report['lateness']['count'] == 1 and ('10-14', 1) in report['lateness']['histogram']
+
+
+def test_report_route_requires_permission(client, school):
+    response = client.get(f'/reports/attendance/{school["batches"][0]}')
+    assert response.status_code == 302
@@ -0,0 +1,72 @@
+from datetime import date
+import sqlalchemy as sa
+from app import db
+import app.models as mo
+
+
+def marks():
+    return {user_id: (status, late, left) for user_id, status, late, left in db.session.execute(
+        sa.select(mo.UserAttendance.user_id, mo.AttendanceStatusLookup.status, mo.UserAttendance.late_by_min,
+                  mo.UserAttendance.left_early_by_min).join(mo.AttendanceStatusLookup))}
+
+
+def test_sheet_is_saved_with_one_upsert(client, school, admin, count_statements):
+    audit = school['audit']
+    batch = school['batches'][0]
+    db.session.add_all([mo.AttendanceStatusLookup(id=i, status=s) for i, s in enumerate('PLAE', 1)])
+    students = [mo.User(username=f'S{i}', gender='F', birthyear=2000) for i in range(300)]
+    db.session.add_all(students)
+    db.session.flush()
+    db.session.add_all([mo.StudentGroup(user_id=s.id, class_group_id=school['groups'][0], index_no=n, status_id=1,
+                                        **audit) for n, s in enumerate(students)])
+    db.session.commit()
+    ids = [s.id for s in students]
+    response = client.post('/attendance', data={'class_batch_id': batch, 'class_date': '2024-06-03'})
+    class_session = db.session.scalar(sa.select(mo.ClassSession))
+    assert response.location == f'/attendance/{class_session.id}'
+    assert class_session.class_date == date(2024, 6, 3) and class_session.teacher_id == admin
+    # Opening the same date again reuses the session.
+    client.post('/attendance', data={'class_batch_id': batch, 'class_date': '2024-06-03'})
+    assert db.session.scalar(sa.select(sa.func.count()).select_from(mo.ClassSession)) == 1
+    url = f'/attendance/{class_session.id}'
+    assert b'S299' in client.get(url).data
+
+    sheet = {f'status-{i}': 'P' for i in ids}
+    sheet.update({f'status-{ids[1]}': 'L', f'late-{ids[1]}': '12', f'status-{ids[2]}': 'A', f'status-{ids[3]}': ''})
+    with count_statements() as statements:
+        assert client.post(url, data=sheet).location == url
+    assert len([s for s in statements if s.startswith('INSERT INTO user_attendance')]) == 1
+    saved = marks()
+    assert len(saved) == 299 and saved[ids[1]] == ('L', 12, None) and ids[3] not in saved
+
+    # Resubmitting updates in place; blank statuses keep their mark.
+    sheet.update({f'status-{ids[2]}': 'E', f'status-{ids[0]}': '', f'left-{ids[4]}': '15'})
+    client.post(url, data=sheet)
+    saved = marks()
+    assert len(saved) == 299 and saved[ids[2]] == ('E', None, None) and saved[ids[0]] == ('P', None, None)
+    assert saved[ids[4]] == ('P', None, 15)
+
+    # One bad row rejects the whole sheet.
+    response = client.post(url, data={f'status-{ids[0]}': 'A', f'status-{ids[5]}': 'X', f'late-{ids[6]}': '-3',
+                                      f'status-{ids[6]}': 'L'})
+    assert response.status_code == 200 and b'Unknown status' in response.data
+    assert marks() == saved
+
+
+def test_student_in_two_groups_is_marked_once(client, school, admin):
+    audit = school['audit']
+    first = db.session.get(mo.ClassGroup, school['groups'][0])
+    second = mo.ClassGroup(name='Second', class_region_id=first.class_region_id, **audit)
+    student = mo.User(username='Both', gender='F', birthyear=2000)
+    db.session.add_all([mo.AttendanceStatusLookup(id=1, status='P'), second, student])
+    db.session.flush()
+    db.session.add_all([mo.StudentGroup(user_id=student.id, class_group_id=group.id, status_id=1, **audit)
+                        for group in (first, second)])
+    class_session = mo.ClassSession(class_date=date(2024, 6, 3), class_batch_id=school['batches'][0],
+                                    teacher_id=admin, **audit)
+    db.session.add(class_session)
+    db.session.commit()
+    url = f'/attendance/{class_session.id}'
+    assert client.get(url).get_data(as_text=True).count(f'name="status-{student.id}"') == 1
+    client.post(url, data={f'status-{student.id}': 'P'})
+    assert marks() == {student.id: ('P', None, None)}
@@ -0,0 +1,85 @@
+from types import SimpleNamespace
+import sqlalchemy as sa
+from app import captcha, db
+from app.authz import Grants, Perm
+from app.identity import user_cache
+import app.models as mo
+
+
+def user_role(role, batch=None, region=None, group=None):
+    return SimpleNamespace(role=SimpleNamespace(role=role, level={'Admin': 10, 'Ustad': 30, 'Muallim': 50}[role]),
+                           class_batch_id=batch, class_region_id=region, class_group_id=group)
+
+
+def test_grants_from_roles():
+    grants = Grants.from_roles(1, [user_role('Ustad', batch=7), user_role('Muallim', batch=7, region=3, group=9)])
+    assert grants.level == 30 and grants.bits == 0
+    assert grants.can(Perm.TAKE_ATTENDANCE, batch_id=7)
+    assert not grants.can(Perm.TAKE_ATTENDANCE, batch_id=8) and not grants.can(Perm.TAKE_ATTENDANCE)
+    assert grants.can(Perm.VIEW_STUDENTS, batch_id=8, region_id=3, group_id=9)
+    assert not grants.can(Perm.TAKE_ATTENDANCE | Perm.MANAGE_ROLES, batch_id=7)
+    assert grants.has_anywhere(Perm.ENTER_SCORES) and not grants.has_anywhere(Perm.MANAGE_PASSWORDS)
+    assert grants.scope(Perm.VIEW_STUDENTS).group_ids == {9}
+
+    admin = Grants.from_roles(2, [user_role('Admin'), user_role('Ustad', batch=7)])
+    assert admin.can(Perm.MANAGE_PASSWORDS | Perm.TAKE_ATTENDANCE) and admin.scopes == {}
+    assert admin.scope(Perm.VIEW_STUDENTS) is None
+
+
+def test_scope_filter_sql():
+    grants = Grants.from_roles(1, [user_role('Ustad', batch=7)])
+    condition = grants.filter(Perm.VIEW_STUDENTS, batch=mo.UserRole.class_batch_id,
+                              region=mo.UserRole.class_region_id)
+    assert str(condition.compile(compile_kwargs={'literal_binds': True})) == 'user_role.class_batch_id IN (7)'
+    assert str(grants.filter(Perm.MANAGE_ROLES, batch=mo.UserRole.class_batch_id)) == 'false'
+    assert str(Grants.from_roles(2, [user_role('Admin')]).filter(Perm.VIEW_STUDENTS)) == 'true'
+
+
+def test_routes_use_cached_grants_invalidated_by_user_role(app, client, member, count_statements):
+    assert client.post('/login', data={'email': 'member@example.com', 'password': 'secret-pass',
+                                       'captcha': 'x'}).location == '/index'
+    assert client.get('/list_passwords').location == '/index'
+
+    admin = mo.Role(role='Admin', level=10)
+    db.session.add(admin)
+    db.session.flush()
+    db.session.add(mo.UserRole(user_id=member, role_id=admin.id, created_by=member, updated_by=member))
+    db.session.commit()
+    try:
+        assert client.get('/list_passwords').status_code == 200
+        # The user and their grants come from the cache.
+        with count_statements() as statements:
+            assert client.get('/list_passwords').status_code == 200
+        assert not [s for s in statements if 'user_role' in s]
+        assert client.get('/list_user_roles').status_code == 200
+    finally:
+        db.session.execute(sa.delete(mo.UserRole))
+        db.session.delete(admin)
+        db.session.commit()
+    assert client.get('/list_passwords').location == '/index'
+    user_cache.clear()
+
+
+def test_registration_and_class_admin_routes_check_their_permission(client, member, monkeypatch):
+    monkeypatch.setattr(captcha, 'validate', lambda: True)
+    assert client.post('/login', data={'email': 'member@example.com', 'password': 'secret-pass',
+                                       'captcha': 'x'}).location == '/index'
+    urls = ('/reg_from_wa_text', '/reg_from_wa_export', '/user_reg', '/class_name', '/class_batch',
+            '/class_group_mentor')
+    assert [client.get(url).location for url in urls] == ['/index'] * len(urls)
+
+    zimmedar = mo.Role(role='BatchZimmedar', level=20)
+    db.session.add(zimmedar)
+    db.session.flush()
+    db.session.add(mo.UserRole(user_id=member, role_id=zimmedar.id, created_by=member, updated_by=member))
+    db.session.commit()
+    try:
+        assert [client.get(url).status_code for url in ('/reg_from_wa_text', '/reg_from_wa_export', '/class_name')] \
+            == [200, 200, 200]
+        # Password management is not part of the role.
+        assert client.get('/list_passwords').location == '/index'
+    finally:
+        db.session.execute(sa.delete(mo.UserRole))
+        db.session.delete(zimmedar)
+        db.session.commit()
+        user_cache.clear()
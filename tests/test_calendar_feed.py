@@ -0,0 +1,45 @@
+from datetime import date
+from app import captcha, db
+import app.models as mo
+
+
+def test_calendar_feed_is_windowed_scoped_and_cached(client, member, school, monkeypatch, count_statements):
+    monkeypatch.setattr(captcha, 'validate', lambda: True)
+    audit = school['audit']
+    mine, other = school['batches']
+    db.session.add(mo.StudentGroup(user_id=member, class_group_id=school['groups'][0], status_id=1, **audit))
+    db.session.add_all([
+        mo.ClassSession(class_date=date(2024, 3, 4), class_batch_id=mine, teacher_id=school['admin'], **audit),
+        mo.ClassSession(class_date=date(2024, 4, 1), class_batch_id=mine, teacher_id=school['admin'], **audit),
+        mo.ClassSession(class_date=date(2024, 3, 4), class_batch_id=other, teacher_id=school['admin'], **audit),
+        mo.TestSession(test_date=date(2024, 3, 10), class_batch_id=mine, max_score=50, **audit),
+        mo.Task(name='Read Surah', class_batch_id=mine, due_date=date(2024, 3, 31), **audit),
+    ])
+    db.session.commit()
+    assert client.post('/login', data={'email': 'member@example.com', 'password': 'secret-pass',
+                                       'captcha': 'x'}).location == '/index'
+
+    url = '/api/calendar?start=2024-03-01T00:00:00+05:30&end=2024-04-01T00:00:00+05:30'
+    with count_statements() as statements:
+        response = client.get(url)
+    assert response.status_code == 200
+    assert [(e['start'], e['title'], e['extendedProps']['type']) for e in response.json] == [
+        ('2024-03-04', 'TAF 07: Class', 'class'), ('2024-03-10', 'TAF 07: Test (50)', 'test'),
+        ('2024-03-31', 'TAF 07: Read Surah', 'task')]
+    # Batch and class name are joined in, not loaded per event.
+    assert len([s for s in statements if '>= ? AND' in s]) == 4
+    assert not [s for s in statements if 'WHERE class_name.id = ?' in s or 'WHERE class_batch.id = ?' in s]
+
+    etag = response.headers['ETag']
+    with count_statements() as statements:
+        assert client.get(url, headers={'If-None-Match': etag}).status_code == 304
+    assert not statements
+    db.session.add(mo.Task(name='Revise', class_batch_id=mine, due_date=date(2024, 3, 15), **audit))
+    db.session.commit()
+    response = client.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 200 and len(response.json) == 4
+
+    assert client.get('/api/calendar?start=2024-03-01&end=2026-03-01').status_code == 400
+    assert client.get('/api/calendar?start=2024-03-01').status_code == 400
+    db.session.query(mo.Task).delete()
+    db.session.commit()
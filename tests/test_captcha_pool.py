@@ -0,0 +1,48 @@
+from flask import Flask, session
+from app.captcha_pool import PooledSessionCaptcha
+
+
+def make_captcha(app, pool_size):
+    # Init on a throwaway app so the shared app keeps its own captcha() template global.
+    other = Flask(__name__)
+    other.config.update(app.config, CAPTCHA_ENABLE=True, CAPTCHA_POOL_SIZE=pool_size)
+    captcha = PooledSessionCaptcha()
+    captcha.init_app(other)
+    return captcha
+
+
+def test_pool_serves_each_captcha_once(app):
+    captcha = make_captcha(app, 3)
+    captcha._ensure_producer = lambda: None
+    captcha.fill()
+    pooled = list(captcha._pool)
+    served = []
+    with app.test_request_context():
+        for _ in range(4):
+            html = captcha.generate()
+            served.append((session['captcha_answer'], html))
+    for (answer, data), (session_answer, html) in zip(pooled, served):
+        assert answer == session_answer and data in html
+    assert len(served[3][0]) == captcha.length and served[3][1] not in {h for _, h in served[:3]}
+    assert captcha.stats() == {'pool_size': 3, 'pooled': 0, 'produced': 3, 'hits': 3, 'misses': 1,
+                               'hit_rate': 0.75}
+
+
+def test_producer_refills_the_pool(app):
+    captcha = make_captcha(app, 2)
+    with app.test_request_context():
+        captcha.generate()
+    captcha._wanted.set()
+    for _ in range(100):
+        if len(captcha._pool) == 2:
+            break
+        captcha._producer.join(0.05)
+    assert len(captcha._pool) == 2 and captcha._producer.is_alive()
+
+
+def test_answers_use_the_configured_alphabets(app):
+    captcha = make_captcha(app, 0)
+    captcha.length, captcha.include_alphabet = 6, True
+    answers = [captcha._answer() for _ in range(50)]
+    assert all(len(answer) == 6 and sum(c.isdigit() for c in answer) == 3 for answer in answers)
+    assert len(set(answers)) > 1
@@ -0,0 +1,41 @@
+from app import db
+from app.dedup import DuplicateChecker, find_existing, normalize_phone
+import app.models as mo
+
+
+def test_normalize_phone():
+    assert normalize_phone('+91 98765-43210') == normalize_phone('0091 9876543210') == 919876543210
+    assert normalize_phone('12345') is None
+    assert normalize_phone(None) is None
+
+
+def test_duplicates_in_batch_and_against_contacts(app):
+    user = mo.User(username='Existing', gender='F', birthyear=1990)
+    db.session.add(user)
+    db.session.flush()
+    db.session.add(mo.Contact(user_id=user.id, mobile=919800000001, whatsapp=919800000002,
+                              email='taken@example.com', created_by=user.id, updated_by=user.id))
+    db.session.commit()
+    try:
+        checker = DuplicateChecker(chunk_size=2)
+        found = checker.check([
+            (1, '+91 98000 00002', None, 'new@example.com'),    # WhatsApp of the existing user as a mobile
+            (2, '919811111111', '919811111111', 'TAKEN@example.com'),
+            (3, '919822222222', None, 'New@Example.com'),       # same email as record 1
+            (4, '919833333333', None, 'fine@example.com'),
+        ])
+        assert sorted(found) == [1, 2, 3]
+        assert [(d.field, d.user_id) for d in found[1]] == [('mobile', user.id)]
+        assert [(d.field, d.value, d.user_id) for d in found[2]] == [('email', 'taken@example.com', user.id)]
+        assert [(d.field, d.first_ref) for d in found[3]] == [('email', 1)]
+        # Values of an earlier chunk's committed records still count; those of records not committed do not.
+        checker.accept([4])
+        assert [(d.field, d.first_ref) for d in checker.check([(5, '919833333333', None, None)])[5]] == [('mobile', 4)]
+        assert checker.check([(6, None, None, 'new@example.com')]) == {}
+
+        assert [d.field for d in find_existing(mobile='919800000002', email='other@example.com')] == ['mobile']
+        assert find_existing(mobile='919899999999', email='other@example.com') == []
+    finally:
+        db.session.query(mo.Contact).delete()
+        db.session.query(mo.User).delete()
+        db.session.commit()
@@ -0,0 +1,65 @@
+import csv
+import io
+import tempfile
+import tracemalloc
+import zipfile
+from datetime import date
+import sqlalchemy as sa
+from app import db
+import app.models as mo
+
+STUDENTS = 30_000
+# Fetching the 30k roster rows with .all() alone takes about 12 MiB; streaming stays near 2 MiB at any size.
+MEMORY_CEILING = 4 * 2**20
+
+
+def streamed(client, url):
+    """The body of url, and the peak Python heap while it was produced (chunks are spooled to a file)."""
+    with tempfile.TemporaryFile() as body:
+        tracemalloc.start()
+        try:
+            response = client.get(url, buffered=False)
+            assert response.status_code == 200
+            for chunk in response.response:
+                body.write(chunk)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        body.seek(0)
+        return body.read(), peak
+
+
+def test_exports_stream_a_large_batch_in_flat_memory(client, school, admin):
+    audit = school['audit']
+    batch, group = school['batches'][0], school['groups'][0]
+    first = db.session.scalar(sa.select(sa.func.max(mo.User.id))) + 1
+    ids = range(first, first + STUDENTS)
+    db.session.execute(sa.insert(mo.User), [{'id': i, 'username': f'Student {i}', 'gender': 'F', 'birthyear': 2000}
+                                            for i in ids])
+    db.session.execute(sa.insert(mo.Contact), [
+        {'user_id': i, 'mobile': 919000000000 + i, 'whatsapp': 919000000000 + i, 'email': f's{i}@example.com', **audit}
+        for i in ids])
+    db.session.execute(sa.insert(mo.StudentGroup), [
+        {'user_id': i, 'class_group_id': group, 'index_no': n, 'status_id': 1, **audit} for n, i in enumerate(ids)])
+    db.session.execute(sa.update(mo.User).where(mo.User.id == first).values(username='=HYPERLINK("x")'))
+    test = mo.TestSession(test_date=date(2024, 5, 1), class_batch_id=batch, max_score=40, **audit)
+    db.session.add(test)
+    db.session.flush()
+    db.session.add(mo.TestSessionScore(test_session_id=test.id, user_id=first + 1, score=30, **audit))
+    db.session.commit()
+    body, peak = streamed(client, f'/export/roster/{batch}')
+    rows = list(csv.reader(io.StringIO(body.decode('utf-8-sig'))))
+    assert len(rows) == STUDENTS + 1 and rows[0][:4] == ['Group', 'Index', 'User ID', 'Name']
+    # Formulas are neutralised.
+    assert rows[1][3] == '\'=HYPERLINK("x")'
+    assert len(body) > 2_500_000 and peak < MEMORY_CEILING, (len(body), peak)
+
+    body, peak = streamed(client, f'/export/roster/{batch}?format=xlsx')
+    with zipfile.ZipFile(io.BytesIO(body)) as workbook:
+        sheet = workbook.read('xl/worksheets/sheet1.xml')
+    assert sheet.count(b'<row>') == STUDENTS + 1 and b'&lt;' not in sheet[:1000]
+    assert peak < MEMORY_CEILING, peak
+
+    body, _ = streamed(client, f'/export/scores/{batch}')
+    assert body.decode('utf-8-sig').splitlines()[1] == f'2024-05-01,40,{first + 1},Student {first + 1},30,75.0,'
+    assert client.get(f'/export/roster/{batch}?format=pdf').status_code == 400
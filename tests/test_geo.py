@@ -0,0 +1,175 @@
+import gc
+import os
+import weakref
+from types import SimpleNamespace
+from app import db
+from app.geo import City, Memo, PrefixIndex, cache
+import app.models as mo
+
+
+def test_states_and_cities_served_from_cache(client, geo_rows):
+    assert client.get('/api/states_for_country/2').get_json() == [
+        {'id': 10, 'name': 'Telangana'}, {'id': 11, 'name': 'Uttar Pradesh'}]
+    assert client.get('/api/cities_for_state/10').get_json() == [
+        {'id': 100, 'name': 'Hyderabad'}, {'id': 101, 'name': 'Secunderabad'}]
+    assert client.get('/api/cities/india/11').get_json() == [{'id': 102, 'name': 'Lucknow'}]
+    assert client.get('/api/cities/guinea/11').get_json() == []
+    assert client.get('/api/states_for_country/99').get_json() == []
+
+
+def test_location_payload(client, geo_rows):
+    [location] = client.get('/api/location/100').get_json()
+    assert location['Country'] == 'India'
+    assert location['CityState'] == 'Telangana'
+    assert location['City'] == 'Hyderabad'
+    assert client.get('/api/location/999').get_json() == []
+
+
+def test_invalidate_reloads(client, geo_rows):
+    version = cache.version
+    db.session.add(mo.States(id=12, name='Kerala', country_id=2, country_code='IN'))
+    db.session.commit()
+    assert len(client.get('/api/states_for_country/2').get_json()) == 2
+    cache.invalidate()
+    assert cache.version != version
+    assert len(client.get('/api/states_for_country/2').get_json()) == 3
+
+
+def test_invalidated_data_is_freed_without_gc(client, geo_rows):
+    client.get('/api/geo/search?q=hy')
+    data = cache.data
+    assert data.resolve_place('India', 'Telangana', 'Hyderabad')[2].name == 'Hyderabad'
+    ref = weakref.ref(data)
+    del data
+    gc.disable()
+    try:
+        cache.invalidate()
+        assert ref() is None
+    finally:
+        gc.enable()
+
+
+def test_memo_drops_the_least_recently_used():
+    calls = []
+
+    def compute(n):
+        calls.append(n)
+        return n * 10
+
+    memo = Memo(2)
+    assert [memo.get((n,), compute) for n in (1, 2, 1, 3, 1, 2)] == [10, 20, 10, 30, 10, 20]
+    assert calls == [1, 2, 3, 2]
+
+
+def test_prefix_search(client, geo_rows):
+    results = client.get('/api/geo/search?q=se').get_json()
+    assert [r['name'] for r in results] == ['Secunderabad']
+    assert results[0]['state'] == 'Telangana' and results[0]['country'] == 'India'
+    # Matches from the start of any word, states included.
+    results = client.get('/api/geo/search?q=PRAD').get_json()
+    assert results == [{'type': 'state', 'id': 11, 'name': 'Uttar Pradesh', 'state_id': 11,
+                        'state': 'Uttar Pradesh', 'country_id': 2, 'country': 'India'}]
+    assert client.get('/api/geo/search?q=h&country_id=1').get_json() == []
+    assert client.get('/api/geo/search?q=').get_json() == []
+
+
+def test_country_filtered_search_finds_matches_after_other_countries():
+    cities = {id: City(id, f'San {id:04}', 1, 1, '') for id in range(1, 2001)}
+    cities[3000] = City(3000, 'San Zeta', 2, 2, '')
+    index = PrefixIndex(SimpleNamespace(cities=cities, states={}, countries={}))
+    assert index.search('san', 10, country_id=2) == [3000]
+    assert index.search('zeta', 10, country_id=2) == [3000]
+    assert len(index.search('san', 10, country_id=1)) == 10
+    assert index.search('san', 10, country_id=3) == []
+    keys, ids = index.by_country()[2]
+    assert list(keys) == ['san zeta', 'zeta'] and list(ids) == [3000, 3000]
+
+
+def test_nearest(client, geo_rows):
+    results = client.get('/api/geo/nearest?lat=17.40&lon=78.47&k=2').get_json()
+    assert [r['name'] for r in results] == ['Hyderabad', 'Secunderabad']
+    assert results[0]['state'] == 'Telangana'
+    assert 0 < results[0]['distance_km'] < results[1]['distance_km']
+    assert client.get('/api/geo/nearest?lat=95&lon=0').status_code == 400
+
+
+def test_timezone_registry(client, geo_rows):
+    from datetime import time
+    from app.geo import parse_timezones
+    registry = cache.timezones
+    [zone] = registry.for_country(2)
+    assert (zone.name, zone.gmt_offset, zone.abbreviation) == ('Asia/Kolkata', 19800, 'IST')
+    assert registry.resolve('utc+05:30') is zone and registry.resolve('Asia/Kolkata') is zone
+    assert registry.to_utc(time(9, 0), 'IST') == time(3, 30)
+    assert registry.to_utc(time(9, 0), 'Mars/Base') is None
+    [location] = client.get('/api/location/100').get_json()
+    assert location['Timezones'] == 'UTC+05:30|IST'
+    # SQL dump style object literal
+    [zone] = parse_timezones("[{zoneName:'Asia\\/Kabul',gmtOffset:16200,gmtOffsetName:'UTC+04:30',abbreviation:'AFT',tzName:'Afghanistan Time'}]")
+    assert zone.name == 'Asia/Kabul' and zone.gmt_offset == 16200
+
+
+def test_country_resolver():
+    from app.geo import Country, CountryResolver
+
+    def country(id, name, iso2, iso3, native=None):
+        return Country(id, name, iso2, iso3, None, None, None, None, (), native)
+
+    countries = {1: country(1, 'Equatorial Guinea', 'GQ', 'GNQ'),
+                 2: country(2, 'Guinea', 'GN', 'GIN'),
+                 3: country(3, 'Guinea-Bissau', 'GW', 'GNB'),
+                 4: country(4, 'India', 'IN', 'IND', 'भारत'),
+                 5: country(5, 'Indonesia', 'ID', 'IDN')}
+    resolver = CountryResolver(countries, {4: '{"de": "Indien", "fr": "Inde"}'})
+    assert resolver.resolve('guinea').id == 2
+    assert resolver.resolve(' GUINÉA ').id == 2
+    assert resolver.resolve('gnb').id == 3
+    assert resolver.resolve('भारत').id == 4
+    assert resolver.resolve('Indien').id == 4
+    # Ranked fallback: prefix beats word prefix beats substring; shorter wins.
+    assert resolver.resolve('ind').id == 4
+    assert resolver.resolve('bissau').id == 3
+    assert resolver.resolve('atorial').id == 1
+    assert resolver.resolve('atlantis') is None
+    assert resolver.resolve('') is None
+
+
+def test_snapshot_serves_same_payloads(app, client, geo_rows):
+    from app.geo_snapshot import build_snapshot
+    urls = ['/api/states_for_country/2', '/api/cities_for_state/10', '/api/cities_for_state/99',
+            '/api/location/100', '/api/location/999', '/api/geo/search?q=se',
+            '/api/geo/search?q=prad', '/api/geo/search?q=h&country_id=2', '/api/geo/nearest?lat=17.40&lon=78.47&k=2']
+    expected = [client.get(url).get_json() for url in urls]
+    path = app.config['GEO_SNAPSHOT_PATH']
+    assert build_snapshot(path) == 3
+    try:
+        cache.invalidate()
+        assert cache.data.snapshot is not None
+        assert cache.data.cities[102].name == 'Lucknow' and 103 not in cache.data.cities
+        actual = [client.get(url).get_json() for url in urls]
+        for item in actual[-1]:
+            item['distance_km'] = round(item['distance_km'], 1)
+        for item in expected[-1]:
+            item['distance_km'] = round(item['distance_km'], 1)
+        assert actual == expected
+    finally:
+        os.remove(path)
+        cache.invalidate()
+
+
+def test_fuzzy_place_resolution(client, geo_rows):
+    data = cache.data
+    country, state, city = data.resolve_place('Inida', 'uttar pradsh', 'Dist. Lacknow')
+    assert (country.id, state.id, city.id) == (2, 11, 102)
+    assert data.resolve_place('IN', 'Pradesh Uttar', 'lucknow city')[2].id == 102
+    # Scoped by the parent: Lucknow is not a city of Telangana.
+    assert data.resolve_city(10, 'Lucknow') is None
+    assert data.resolve_city(10, 'secundrabad').id == 101
+    assert data.resolve_place('Atlantis', 'Telangana', 'Hyderabad') == (None, None, None)
+
+
+def test_reg_from_wa_text_preselects_places(client, geo_rows, registration, admin):
+    text = registration(name='a b', suffix='00001', email='a@example.com')
+    html = client.post('/reg_from_wa_text', data={'whatsapptext': text}).get_data(as_text=True)
+    assert '<option selected value="102">Lucknow</option>' in html
+    assert '<option selected value="101">Secunderabad</option>' in html
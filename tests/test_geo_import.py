@@ -0,0 +1,80 @@
+import io
+import json
+import pytest
+from app import db
+from app.geo_import import TableImporter, import_geo, iter_json_array
+import app.models as mo
+
+
+@pytest.fixture
+def dump_dir(tmp_path):
+    countries = [{'id': 1, 'name': 'India', 'iso2': 'IN', 'iso3': 'IND', 'latitude': '20.00000000',
+                  'timezones': [{'zoneName': 'Asia/Kolkata', 'gmtOffset': 19800}],
+                  'translations': {'fr': 'Inde'}, 'wikiDataId': 'Q668'}]
+    states = [{'id': 10, 'name': 'Telangana', 'country_id': 1, 'country_code': 'IN', 'state_code': 'TG'}]
+    (tmp_path / 'countries.json').write_text(json.dumps(countries))
+    (tmp_path / 'states.json').write_text(json.dumps(states))
+    (tmp_path / 'cities.csv').write_text(
+        'id,name,state_id,state_code,state_name,country_id,country_code,country_name,latitude,longitude,wikiDataId\n'
+        '100,Hyderabad,10,TG,Telangana,1,IN,India,17.38,78.45,Q1361\n'
+        '101,Warangal,10,TG,Telangana,1,IN,India,17.97,79.59,Q213077\n')
+    return tmp_path
+
+
+@pytest.fixture
+def clean_geo(app):
+    yield
+    for model in (mo.Cities, mo.States, mo.Countries):
+        db.session.query(model).delete()
+    db.session.commit()
+
+
+def test_iter_json_array_small_chunks():
+    data = json.dumps([{'a': 1, 's': 'x, ]'}, {'b': [1, 2]}, {}])
+    assert list(iter_json_array(io.StringIO(data), chunk_size=3)) == [{'a': 1, 's': 'x, ]'}, {'b': [1, 2]}, {}]
+
+
+def test_full_then_upsert(app, dump_dir, clean_geo):
+    out = []
+    import_geo(str(dump_dir), batch_size=1, echo=out.append)
+    assert db.session.get(mo.States, 10).iso2 == 'TG'
+    assert json.loads(db.session.get(mo.Countries, 1).timezones)[0]['gmtOffset'] == 19800
+    assert db.session.query(mo.Cities).count() == 2
+
+    (dump_dir / 'cities.csv').write_text(
+        'id,name,state_id,state_code,state_name,country_id,country_code,country_name,latitude,longitude,wikiDataId\n'
+        '100,Hyderabad,10,TG,Telangana,1,IN,India,17.38,78.45,Q1361\n'
+        '999,Warangal City,10,TG,Telangana,1,IN,India,17.97,79.59,Q213077\n'
+        '102,Karimnagar,10,TG,Telangana,1,IN,India,18.43,79.12,Q1365\n')
+    [cities] = import_geo(str(dump_dir), tables=['cities'], echo=out.append)
+    assert (cities.inserted, cities.updated, cities.unchanged) == (1, 1, 1)
+    db.session.expire_all()
+    assert db.session.get(mo.Cities, 101).name == 'Warangal City'
+    assert db.session.query(mo.Cities).count() == 3
+
+
+def test_table_importer_keeps_rows_missing_from_the_dump_unless_replacing(app, clean_geo):
+    db.session.add(mo.Countries(id=2, name='Guinea', iso2='GN', iso3='GIN'))
+    db.session.commit()
+    india = {'id': 1, 'name': 'India', 'iso2': 'IN', 'iso3': 'IND'}
+    countries = TableImporter('countries', mo.Countries, echo=lambda line: None).run([india])
+    assert (countries.inserted, countries.updated, countries.unchanged) == (1, 0, 0)
+    assert db.session.query(mo.Countries).count() == 2
+
+    countries = TableImporter('countries', mo.Countries, replace=True, echo=lambda line: None).run([india])
+    assert countries.inserted == 1
+    assert [c.name for c in db.session.query(mo.Countries)] == ['India']
+
+
+def test_replace_deletes_children_first_in_one_transaction(app, dump_dir, clean_geo):
+    out = []
+    import_geo(str(dump_dir), echo=out.append)
+    db.session.add(mo.Cities(id=103, name='Nizamabad', state_id=10, country_id=1, country_code='IN', state_code='TG',
+                             latitude=18.67, longitude=78.09))
+    db.session.commit()
+    out.clear()
+    import_geo(str(dump_dir), replace=True, echo=out.append)
+    assert out[2:5] == ['cities: deleted 3 rows', 'states: deleted 1 rows', 'countries: deleted 1 rows']
+    db.session.expire_all()
+    assert db.session.get(mo.Cities, 103) is None
+    assert db.session.query(mo.Cities).count() == 2
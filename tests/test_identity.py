@@ -0,0 +1,40 @@
+from app import db
+from app.identity import user_cache
+
+
+def test_login_is_one_statement(client, member, count_statements):
+    with count_statements() as statements:
+        response = client.post('/login', data={'email': 'member@example.com', 'password': 'secret-pass',
+                                               'captcha': 'x'})
+    assert response.status_code == 302 and response.location == '/index'
+    assert len([s for s in statements if 'FROM user' in s]) == 1
+
+
+def test_load_user_is_cached_until_changed(app, member, count_statements):
+    first = user_cache.get(member)
+    assert first.contact.email == 'member@example.com'
+    db.session.remove()
+    with count_statements() as statements:
+        user = user_cache.get(member)
+        assert (user.username, user.contact.email, user.roles) == ('Member', 'member@example.com', [])
+        assert user.password.check_password('secret-pass')
+    assert statements == []
+
+    user.password.set_password('new-pass')
+    db.session.commit()
+    db.session.remove()
+    with count_statements() as statements:
+        assert user_cache.get(member).password.check_password('new-pass')
+    assert len(statements) == 1
+
+
+def test_ttl_expiry(app, member, count_statements):
+    app.config['USER_CACHE_TTL'] = 0
+    try:
+        user_cache.get(member)
+        with count_statements() as statements:
+            user_cache.get(member)
+        assert len(statements) == 1
+    finally:
+        app.config['USER_CACHE_TTL'] = 30
+    assert user_cache.get(99999) is None
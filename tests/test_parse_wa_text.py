@@ -0,0 +1,52 @@
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from functions.parse_wa_text import WaTextParser, parse_wa_text_fn
+
+
+@pytest.fixture
+def text(registration):
+    return lambda i: registration(name=f'student number {i}', suffix=f'{i:05d}', email=f'student{i}@example.com')
+
+
+def test_parse_template(text):
+    d = parse_wa_text_fn(text(7))
+    assert (d['class_name'], d['batch_name']) == ('TAFSEER', '07')
+    assert d['full_name'] == 'Student Number 7'
+    assert d['mobile'] == '919876500007' and d['whatsapp'] is None
+    assert d['gender'] == 'M'
+    assert (d['hometown_country'], d['hometown_state'], d['hometown_district'], d['hometown_city']) == (
+        'India', 'Uttar Pradesh', 'Lucknow', 'Aminabad')
+    assert (d['resident_country'], d['resident_state'], d['resident_city']) == ('In', 'Telangana', 'Secunderabad')
+    assert (d['yob'], d['education'], d['profession'], d['email']) == ('1990', 'B.tech', 'Engineer', 'student7@example.com')
+    assert (d['referrer_name'], d['referrer_mobile'], d['referrer_email']) == (
+        'Abdul Kareem', '919876500000', 'kareem@example.com')
+    assert (d['referrer_student_id'], d['referrer_batch']) == ('12', 'T-05')
+
+
+def test_blank_value_does_not_take_next_line(text):
+    # WhatsApp# is blank in the text; the old regex parser read the Gender line into it.
+    d = parse_wa_text_fn(text(7).replace('Mobile#: +91 98765 00007', 'Mobile#:'))
+    assert d['mobile'] is None and d['whatsapp'] is None
+    assert d['gender'] == 'M'
+
+
+def test_decorated_headings_start_their_sections(text):
+    decorated = (text(7).replace('HOMETOWN DETAILS', '🏠 HOMETOWN DETAILS:')
+                 .replace('CURRENT RESIDENCE', '*Current Residence*').replace('REFERRED By', '👤 _Referred by_ :'))
+    d = parse_wa_text_fn(decorated)
+    assert (d['hometown_country'], d['hometown_city']) == ('India', 'Aminabad')
+    assert (d['resident_state'], d['resident_city']) == ('Telangana', 'Secunderabad')
+    assert (d['referrer_name'], d['referrer_batch']) == ('Abdul Kareem', 'T-05')
+    assert d == parse_wa_text_fn(text(7))
+
+
+def test_results_are_independent(text):
+    parser = WaTextParser()
+    texts = [text(i) for i in range(200)]
+    first = parser.parse(texts[0])
+    with ThreadPoolExecutor(8) as pool:
+        results = list(pool.map(parser.parse, texts))
+    assert first['email'] == 'student0@example.com'
+    assert [d['email'] for d in results] == [f'student{i}@example.com' for i in range(200)]
+    assert [d['email'] for d in parser.parse_many(texts[:3])] == [
+        'student0@example.com', 'student1@example.com', 'student2@example.com']
@@ -0,0 +1,38 @@
+from werkzeug.security import generate_password_hash
+from app import captcha, db
+from app.passwords import hasher
+import app.models as mo
+
+
+def test_hash_verify_and_prefix(app):
+    app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:1000'
+    try:
+        stored = hasher.hash('secret')
+        assert stored.startswith('pbkdf2:sha256:1000$')
+        assert hasher.verify(stored, 'secret') and not hasher.verify(stored, 'wrong')
+        assert not hasher.verify(None, 'secret')
+        assert not hasher.needs_rehash(stored)
+        assert hasher.needs_rehash(generate_password_hash('secret', 'pbkdf2:sha256:2000'))
+    finally:
+        app.config['PASSWORD_HASH_METHOD'] = 'scrypt:32768:8:1'
+    assert hasher.prefix('scrypt') == 'scrypt:32768:8:1'
+
+
+def test_login_rehashes_outdated_hash(client, member, monkeypatch):
+    # test_models creates a second app, which re-enables the shared captcha.
+    monkeypatch.setattr(captcha, 'validate', lambda: True)
+    password = db.session.scalar(db.select(mo.Password).filter_by(user_id=member))
+    password.password_hash = generate_password_hash('secret-pass', 'pbkdf2:sha256:1000')
+    db.session.commit()
+
+    response = client.post('/login', data={'email': 'member@example.com', 'password': 'wrong', 'captcha': 'x'})
+    assert response.location == '/login'
+    db.session.expire_all()
+    assert password.password_hash.startswith('pbkdf2:sha256:1000$')
+
+    response = client.post('/login', data={'email': 'member@example.com', 'password': 'secret-pass',
+                                           'captcha': 'x'})
+    assert response.location == '/index'
+    db.session.expire_all()
+    assert password.password_hash.startswith('scrypt:32768:8:1$')
+    assert password.check_password('secret-pass')
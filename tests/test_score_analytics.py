@@ -0,0 +1,63 @@
+from datetime import date
+import numpy as np
+import sqlalchemy as sa
+from app import db
+from app.score_analytics import competition_rank, report, results_cache
+import app.models as mo
+
+
+def test_competition_rank_within_groups():
+    values = np.array([70, 90, 90, 50, 80, 80])
+    groups = np.array([1, 1, 2, 1, 2, 2])
+    assert competition_rank(values).tolist() == [5, 1, 1, 6, 3, 3]
+    assert competition_rank(values, groups).tolist() == [2, 1, 1, 3, 2, 2]
+
+
+def test_report_and_per_test_cache(school, count_statements):
+    audit = school['audit']
+    batch = school['batches'][0]
+    first_group = db.session.get(mo.ClassGroup, school['groups'][0])
+    second_group = mo.ClassGroup(name='Second', class_region_id=first_group.class_region_id, **audit)
+    students = [mo.User(username=f'S{i}', gender='F', birthyear=2000) for i in range(4)]
+    db.session.add_all(students + [second_group])
+    db.session.flush()
+    for student, group in zip(students, (first_group, first_group, second_group, second_group)):
+        db.session.add(mo.StudentGroup(user_id=student.id, class_group_id=group.id, status_id=1, **audit))
+    tests = [mo.TestSession(test_date=date(2024, 2, day), class_batch_id=batch, max_score=50, **audit)
+             for day in (1, 8)]
+    db.session.add_all(tests)
+    db.session.flush()
+    for test, scores in zip(tests, ((40, 30, 45, 20), (50, 30, 25, None))):
+        db.session.add_all([mo.TestSessionScore(test_session_id=test.id, user_id=student.id, score=score, **audit)
+                            for student, score in zip(students, scores) if score is not None])
+    db.session.commit()
+    results_cache.clear()
+
+    result = report(batch)
+    assert [test['mean'] for test in result['tests']] == [67.5, 70.0]
+    assert result['tests'][0]['histogram'] == [0, 0, 0, 0, 1, 0, 1, 0, 1, 1]
+    assert [(s['username'], s['mean'], s['rank'], s['group_rank']) for s in result['students']] == [
+        ('S0', 90.0, 1, 1), ('S2', 70.0, 2, 1), ('S1', 60.0, 3, 2), ('S3', 40.0, 4, 2)]
+    assert {g['name']: g['mean'] for g in result['groups']} == {first_group.name: 75.0, 'Second': 55.0}
+
+    # Unchanged tests are served from the cache; a new score reloads only its own test.
+    with count_statements() as statements:
+        report(batch)
+    assert not [s for s in statements if 'test_session_score' in s]
+    db.session.add(mo.TestSessionScore(test_session_id=tests[1].id, user_id=students[3].id, score=50, **audit))
+    db.session.commit()
+    with count_statements() as statements:
+        result = report(batch)
+    loads = [s for s in statements if 'FROM test_session_score' in s]
+    assert len(loads) == 1 and str(tests[0].id) not in loads[0].split('IN')[-1]
+    assert result['tests'][1]['count'] == 4
+
+    # Statements that may touch any test drop every cached result.
+    db.session.execute(sa.update(mo.TestSessionScore).where(mo.TestSessionScore.user_id == students[1].id)
+                       .values(score=0))
+    db.session.commit()
+    assert [test['mean'] for test in report(batch)['tests']] == [52.5, 62.5]
+
+
+def test_report_route_requires_permission(client, school):
+    assert client.get(f'/reports/tests/{school["batches"][0]}').status_code == 302
@@ -0,0 +1,86 @@
+import io
+from datetime import date
+import sqlalchemy as sa
+from app import db, score_import
+from app.score_analytics import report, results_cache
+import app.models as mo
+
+
+def upload(client, test_session_id, text, dry_run=False):
+    data = {'test_session_id': test_session_id, 'file': (io.BytesIO(text.encode('utf-8-sig')), 'scores.csv')}
+    if dry_run:
+        data['dry_run'] = 'y'
+    return client.post('/tests/import', data=data, content_type='multipart/form-data')
+
+
+def scores(test_session_id):
+    return dict(db.session.execute(sa.select(mo.TestSessionScore.user_id, mo.TestSessionScore.score)
+                                   .where(mo.TestSessionScore.test_session_id == test_session_id)).all())
+
+
+def test_import_validates_and_upserts_in_batches(client, school, admin, monkeypatch, count_statements):
+    audit = school['audit']
+    batch = school['batches'][0]
+    students = [mo.User(username=f'S{i}', gender='F', birthyear=2000) for i in range(1200)]
+    twins = [mo.User(username='Twin', gender='F', birthyear=2000) for _ in range(2)]
+    outsider = mo.User(username='Outsider', gender='F', birthyear=2000)
+    db.session.add_all(students + twins + [outsider])
+    db.session.flush()
+    db.session.add_all([mo.StudentGroup(user_id=s.id, class_group_id=school['groups'][0], status_id=1, **audit)
+                        for s in students + twins])
+    tests = [mo.TestSession(test_date=date(2024, 3, day), class_batch_id=batch, max_score=50, **audit)
+             for day in (1, 8)]
+    db.session.add_all(tests)
+    db.session.flush()
+    db.session.add(mo.TestSessionScore(test_session_id=tests[1].id, user_id=students[0].id, score=10, **audit))
+    db.session.add(mo.TestSessionScore(test_session_id=tests[0].id, user_id=students[0].id, score=1, **audit))
+    db.session.commit()
+    test = tests[0].id
+    rows = ['Student,Score,Note'] + [f'{s.id},{i % 51},' for i, s in enumerate(students[:1100])]
+    rows += [f's1100,40,"late, but fine"', '']
+    bad = ['Twin,30,', f'{outsider.id},30,', f'{students[1].id},20,', f'{students[1101].id},51,',
+           f'{students[1102].id},4.5,', ',30,']
+    text = '\r\n'.join(rows)
+
+    results_cache.clear()
+    report(batch)
+    # Any rejected row rejects the whole file.
+    response = upload(client, test, '\r\n'.join(rows[:-1] + bad))
+    assert b'Nothing was imported; 6 row(s)' in response.data and b'1101 row(s) are valid' in response.data
+    for error in (b'2 students have this name', b'Not a student of this batch', b'already scored on line 3',
+                  b'from 0 to 50', b'Student is missing'):
+        assert error in response.data
+    assert scores(test) == {students[0].id: 1}
+    with monkeypatch.context() as patch:
+        patch.setattr(score_import, 'MAX_ROWS', 1000)
+        assert b'more than 1000 rows' in upload(client, test, text).data
+    response = upload(client, test, text, dry_run=True)
+    assert response.status_code == 200 and b'Dry run: all 1101 score(s)' in response.data
+    assert scores(test) == {students[0].id: 1}
+
+    with count_statements() as statements:
+        response = upload(client, test, text)
+    assert b'1101 score(s) imported' in response.data and b'1 of them replacing' in response.data
+    assert len([s for s in statements if 'FROM user JOIN student_group' in s]) == 1
+    assert len([s for s in statements if s.startswith('INSERT INTO test_session_score')]) == 3
+    saved = scores(test)
+    assert len(saved) == 1101 and saved[students[0].id] == 0 and saved[students[1100].id] == 40
+    note = db.session.scalar(sa.select(mo.TestSessionScore.note).where(
+        mo.TestSessionScore.user_id == students[1100].id, mo.TestSessionScore.test_session_id == test))
+    assert note == 'late, but fine'
+
+    # Only the imported test's cached result is reloaded.
+    with count_statements() as statements:
+        report(batch)
+    loads = [s for s in statements if 'FROM test_session_score' in s]
+    assert len(loads) == 1 and 'IN (?)' in loads[0]
+
+    # Re-importing replaces the scores in place.
+    response = upload(client, test, f'{students[0].id},50,retake\n')
+    assert b'1 of them replacing' in response.data
+    assert scores(test)[students[0].id] == 50 and len(scores(test)) == 1101
+    assert scores(tests[1].id) == {students[0].id: 10}
+
+
+def test_import_requires_permission(client):
+    assert client.get('/tests/import').status_code == 302
@@ -0,0 +1,90 @@
+import os
+import tempfile
+import time
+from flask import request
+from app import sessions
+from app.sessions import (MemorySessionStore, SqliteSessionStore, ServerSideSession, ServerSideSessionInterface,
+                          make_store)
+
+
+def test_stores_expire_and_sweep():
+    path = os.path.join(tempfile.mkdtemp(), 'sessions.db')
+    for store in (MemorySessionStore(max_sessions=2), SqliteSessionStore(path)):
+        now = time.time()
+        store.set('old', {'a': 1}, now - 1)
+        store.set('live', {'b': (1, 2)}, now + 60)
+        assert store.get('old', now) is None
+        assert store.get('live', now) == (now + 60, {'b': (1, 2)})
+        assert store.sweep(now) == (0 if isinstance(store, MemorySessionStore) else 1)
+        store.touch('live', now + 120)
+        assert store.get('live', now + 90)[0] == now + 120
+        store.delete('live')
+        assert len(store) == 0
+    store = MemorySessionStore(max_sessions=2)
+    for sid in 'abc':
+        store.set(sid, {}, time.time() + 60)
+    assert store.get('a', time.time()) is None and len(store) == 2
+
+
+def test_cookie_holds_only_the_session_id(app, client):
+    store = app.session_interface.store
+    client.get('/logout')
+    assert client.get_cookie('session') is None
+
+    with app.test_request_context():
+        from flask import session
+        assert isinstance(session._get_current_object(), ServerSideSession)
+    with client.session_transaction() as session:
+        session['captcha_answer'] = '123456'
+    sid = client.get_cookie('session').value
+    assert '123456' not in sid
+    assert store.get(sid, time.time())[1] == {'captcha_answer': '123456'}
+
+    # An id the store does not know is replaced, not adopted.
+    client.set_cookie('session', 'planted')
+    with client.session_transaction() as session:
+        session['x'] = 1
+    assert client.get_cookie('session').value not in ('planted', sid)
+
+
+def test_login_regenerates_session_id(app, client, member):
+    with client.session_transaction() as session:
+        session['captcha_answer'] = 'x'
+    before = client.get_cookie('session').value
+    response = client.post('/login', data={'email': 'member@example.com', 'password': 'secret-pass',
+                                           'captcha': 'x'})
+    assert response.location == '/index'
+    after = client.get_cookie('session').value
+    assert after != before
+    store = app.session_interface.store
+    assert store.get(before, time.time()) is None
+    assert store.get(after, time.time())[1]['_user_id'] == str(member)
+
+
+def test_sqlite_store_connects_per_process_in_the_instance_folder(monkeypatch):
+    instance = tempfile.mkdtemp()
+    store = make_store({'SESSION_TYPE': 'sqlite', 'SESSION_SQLITE_PATH': None}, instance)
+    assert store.path == os.path.join(instance, 'sessions.db') and not os.path.exists(store.path)
+    store.set('a', {}, time.time() + 60)
+    parent = store._connection()
+    assert store._connection() is parent
+    # A forked worker opens its own connection.
+    monkeypatch.setattr(sessions.os, 'getpid', lambda: -1)
+    assert store._connection() is not parent and len(store) == 1
+
+
+def test_sweeper_starts_on_each_process_first_request(app, monkeypatch):
+    interface = ServerSideSessionInterface(MemorySessionStore(), sweep_interval=3600)
+    assert interface.sweeper is None
+    try:
+        with app.test_request_context():
+            interface.open_session(app, request)
+            first = interface.sweeper
+            interface.open_session(app, request)
+            assert interface.sweeper is first and first.is_alive()
+            monkeypatch.setattr(sessions.os, 'getpid', lambda: -1)
+            interface.open_session(app, request)
+            assert interface.sweeper is not first and interface.sweeper.pid == -1
+    finally:
+        first.stopped.set()
+        interface.sweeper.stopped.set()
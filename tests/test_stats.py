@@ -0,0 +1,114 @@
+import logging
+from datetime import datetime
+import sqlalchemy as sa
+from app import db, stats
+import app.models as mo
+
+
+def counters():
+    return {key: value for key, value in db.session.execute(sa.select(mo.DashboardStat.key, mo.DashboardStat.value))
+            if value and key != stats.RECONCILED_AT}
+
+
+def test_hooks_keep_counters_equal_to_a_recount(school):
+    stats.reconcile()
+    audit = school['audit']
+    students = [mo.User(username=f'S{i}', gender='F', birthyear=2000) for i in range(3)]
+    db.session.add_all(students)
+    db.session.flush()
+    memberships = [mo.StudentGroup(user_id=s.id, class_group_id=school['groups'][0], status_id=1, **audit)
+                   for s in students]
+    db.session.add_all(memberships + [
+        mo.ClassBatchTeacher(user_id=school['admin'], class_batch_id=b, **audit) for b in school['batches']])
+    db.session.commit()
+    assert counters() == {key: value for key, value in stats.recount().items() if value}
+    assert counters()['teachers'] == 1 and counters()[f'batch:{school["batches"][0]}'] == 3
+
+    memberships[0].status_id = 2
+    memberships[1].class_group_id = school['groups'][1]
+    db.session.delete(memberships[2])
+    teacher = db.session.scalar(sa.select(mo.ClassBatchTeacher).limit(1))
+    teacher.user_id = students[0].id
+    db.session.commit()
+    assert counters() == {key: value for key, value in stats.recount().items() if value}
+    assert counters()['teachers'] == 2
+
+    # Moving a group or a region moves its students between the batch counters.
+    first, second = (db.session.get(mo.ClassGroup, group) for group in school['groups'])
+    first.class_region_id = second.class_region_id
+    db.session.commit()
+    assert counters() == {key: value for key, value in stats.recount().items() if value}
+    assert counters()[f'batch:{school["batches"][1]}'] == 2
+    region = db.session.get(mo.ClassRegion, second.class_region_id)
+    region.class_batch_id, region.section = school['batches'][0], 'B'
+    db.session.commit()
+    assert counters() == {key: value for key, value in stats.recount().items() if value}
+    assert counters()[f'batch:{school["batches"][0]}'] == 2
+
+    # A deleted batch leaves no counter behind.
+    batch = mo.ClassBatch(class_name_id=region.class_name_id, batch_no='09', start_date=datetime(2024, 1, 1),
+                          status_id=1, **audit)
+    db.session.add(batch)
+    db.session.flush()
+    stats.add(db.session.connection(), {f'batch:{batch.id}': 1})
+    db.session.commit()
+    db.session.delete(batch)
+    db.session.commit()
+    assert f'batch:{batch.id}' not in stats.counters()
+
+    # Rolled back changes leave the counters alone.
+    db.session.add(mo.User(username='Gone', gender='M', birthyear=1990))
+    db.session.flush()
+    db.session.rollback()
+    assert stats.reconcile() == {}
+
+
+def test_reconcile_fixes_drift_and_dashboard_reads_counters(app, client, school, monkeypatch, caplog):
+    db.session.execute(sa.insert(mo.User), [{'username': 'Bulk', 'gender': 'M', 'birthyear': 1990}])
+    db.session.commit()
+    assert stats.reconcile() == {'users': (1, 2)}
+
+    # Counters that were never reconciled (a fresh deploy) are seeded on first use.
+    db.session.execute(sa.delete(mo.DashboardStat))
+    db.session.commit()
+    assert stats.counters()['users'] == 2
+    assert stats.RECONCILED_AT in stats.counters()
+
+    db.session.execute(sa.update(mo.DashboardStat).where(mo.DashboardStat.key == 'users').values(value=99))
+    db.session.commit()
+    assert stats.counters()['users'] == 99
+    # Requests never reconcile seeded counters; stale ones are only logged.
+    monkeypatch.setitem(app.config, 'STATS_RECONCILE_INTERVAL', 0)
+    with caplog.at_level(logging.WARNING):
+        assert stats.counters()['users'] == 99
+    assert 'flask stats-reconcile' in caplog.text
+    stats.reconcile()
+    response = client.get('/dashboard')
+    assert response.status_code == 200 and b'<h5 class="card-title">2</h5>' in response.data
+
+
+def test_chart_payload_cached_on_table_versions(client, school, count_statements):
+    stats.reconcile()
+    first = client.get('/api/dashboard/charts')
+    assert first.status_code == 200 and first.json['student_batch'] == {'labels': [], 'data': []}
+    etag = first.headers['ETag']
+    with count_statements() as statements:
+        again = client.get('/api/dashboard/charts', headers={'If-None-Match': etag})
+    assert again.status_code == 304 and again.headers['ETag'] == etag
+    assert not [s for s in statements if 'dashboard_stat' in s or 'table_version' in s]
+
+    student = mo.User(username='S', gender='F', birthyear=2000)
+    db.session.add(student)
+    db.session.flush()
+    db.session.add(mo.StudentGroup(user_id=student.id, class_group_id=school['groups'][1], status_id=1,
+                                   **school['audit']))
+    db.session.commit()
+    changed = client.get('/api/dashboard/charts', headers={'If-None-Match': etag})
+    assert changed.status_code == 200 and changed.headers['ETag'] != etag
+    assert changed.json['student_batch'] == {'labels': ['08'], 'data': [1]}
+    assert changed.json['student_status'] == {'labels': ['Active'], 'data': [1]}
+
+    # Statements run through the session bump the versions too.
+    db.session.execute(sa.update(mo.UserStatusLookup).where(mo.UserStatusLookup.id == 1).values(status='Enrolled'))
+    db.session.commit()
+    assert client.get('/api/dashboard/charts').json['student_status'] == {'labels': ['Enrolled'], 'data': [1]}
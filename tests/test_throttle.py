@@ -0,0 +1,71 @@
+import sqlalchemy as sa
+from werkzeug.middleware.proxy_fix import ProxyFix
+from app import captcha, db
+from app import throttle as throttle_module
+from app.throttle import throttle
+import app.models as mo
+
+
+def login(client, password, ip='10.0.0.1', email='member@example.com', headers=None):
+    return client.post('/login', data={'email': email, 'password': password, 'captcha': 'x'},
+                       environ_base={'REMOTE_ADDR': ip}, headers=headers)
+
+
+def test_throttle_rejects_before_db_and_flushes_counts(app, client, member, monkeypatch, count_statements):
+    monkeypatch.setattr(captcha, 'validate', lambda: True)
+    monkeypatch.setitem(app.config, 'LOGIN_THROTTLE_EMAIL', (3, 300))
+    for _ in range(3):
+        assert login(client, 'wrong', email='Member@example.com').location == '/login'
+    with count_statements() as statements:
+        response = login(client, 'secret-pass')
+    assert response.status_code == 429 and int(response.headers['Retry-After']) > 0
+    assert statements == []
+
+    throttle.flush()
+    password = db.session.scalar(sa.select(mo.Password).filter_by(user_id=member))
+    assert password.attempt_counts == 4 and password.last_attempt_time is not None
+
+
+def test_success_refills_email_and_ip_limit(app, client, member, monkeypatch):
+    monkeypatch.setattr(captcha, 'validate', lambda: True)
+    monkeypatch.setitem(app.config, 'LOGIN_THROTTLE_EMAIL', (2, 300))
+    monkeypatch.setitem(app.config, 'LOGIN_THROTTLE_IP', (4, 300))
+    assert login(client, 'wrong').location == '/login'
+    assert login(client, 'secret-pass').location == '/index'
+    client.get('/logout')
+    throttle.flush()
+    password = db.session.scalar(sa.select(mo.Password).filter_by(user_id=member))
+    assert password.attempt_counts == 0 and password.last_successful_attempt_time is not None
+
+    assert login(client, 'wrong').location == '/login'
+    assert login(client, 'wrong').location == '/login'
+    assert login(client, 'wrong').status_code == 429
+    assert login(client, 'wrong', ip='10.0.0.2').status_code == 429
+    assert login(client, 'wrong', email='Other@example.com').status_code == 429
+    assert login(client, 'wrong', ip='10.0.0.2', email='Other@example.com').location == '/login'
+
+
+def test_login_email_is_matched_as_the_throttle_keys_it(app, client, member, monkeypatch):
+    monkeypatch.setattr(captcha, 'validate', lambda: True)
+    assert login(client, 'secret-pass', email='Member@Example.COM').location == '/index'
+    client.get('/logout')
+
+
+def test_ip_bucket_keys_on_the_forwarded_address_behind_a_proxy(app, client, member, monkeypatch):
+    monkeypatch.setattr(captcha, 'validate', lambda: True)
+    monkeypatch.setitem(app.config, 'LOGIN_THROTTLE_IP', (1, 300))
+    monkeypatch.setattr(app, 'wsgi_app', ProxyFix(app.wsgi_app, x_for=1))
+    proxy = '10.0.0.9'
+    assert login(client, 'wrong', ip=proxy, headers={'X-Forwarded-For': '203.0.113.1'}).location == '/login'
+    assert login(client, 'wrong', ip=proxy, headers={'X-Forwarded-For': '203.0.113.1'}).status_code == 429
+    assert login(client, 'wrong', ip=proxy, email='other@example.com',
+                 headers={'X-Forwarded-For': '203.0.113.2'}).location == '/login'
+
+
+def test_pending_counts_are_bounded(app, monkeypatch):
+    monkeypatch.setattr(throttle_module, 'MAX_KEYS', 2)
+    with app.test_request_context():
+        for email in ('a@example.com', 'b@example.com', 'c@example.com'):
+            throttle.attempt(email, '10.0.0.1')
+    assert list(throttle._pending) == ['b@example.com', 'c@example.com']
+    throttle.clear()
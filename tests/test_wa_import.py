@@ -0,0 +1,80 @@
+import io
+import sqlalchemy as sa
+from app import db
+from app.wa_import import WaImporter, iter_chat_blocks
+import app.models as mo
+
+def export(*messages):
+    lines = []
+    for i, text in enumerate(messages):
+        first, *rest = text.split('\n')
+        lines.append(f'12/03/2024, 10:{i:02d} - Admin: {first}')
+        lines.extend(rest)
+    return io.StringIO('\n'.join(lines) + '\n')
+
+
+def test_iter_chat_blocks_strips_prefixes_and_chatter(registration):
+    blocks = list(iter_chat_blocks(export(
+        'Assalamu alaikum all',
+        registration(name='a', suffix='00001', email='a@example.com'),
+        'Full Name: not a registration',
+        registration(name='b', suffix='00002', email='b@example.com'))))
+    assert [b.number for b in blocks] == [1, 2]
+    assert blocks[0].line == 2
+    assert blocks[0].text.startswith('*STUDENT DETAILS FOR TAFSEER-07 BATCH*')
+    assert 'not a registration' not in blocks[0].text
+    assert blocks[1].text.endswith('——————————————')
+
+
+def test_bulk_import_reports_rejects(app, geo_rows, registration):
+    chat = export(
+        registration(name='mohammed ali', suffix='43210', email='Ali@Example.com'),
+        registration(name='bad email', suffix='43211', email='not-an-email'),
+        registration(name='again ali', suffix='43212', email='ali@example.com'),
+        registration(name='yusuf', suffix='43213', email='yusuf@example.com').replace('Lucknow', 'Atlantis'))
+    results = WaImporter(actor_id=1, batch_size=2).run(iter_chat_blocks(chat))
+    assert [r.status for r in results] == ['registered', 'rejected', 'rejected', 'rejected']
+    assert any('email' in e.lower() for e in results[1].errors)
+    assert 'more than once' in results[2].errors[0]
+    assert any('Atlantis' in e for e in results[3].errors)
+
+    contact = db.session.scalar(db.select(mo.Contact).filter_by(email='ali@example.com'))
+    user = contact.user
+    assert user.username == 'Mohammed Ali' and user.gender == 'M' and user.birthyear == 1990
+    assert contact.mobile == contact.whatsapp == 919876543210
+    assert (user.home_address.state_id, user.home_address.city_id, user.home_address.area) == (11, 102, 'Aminabad')
+    assert (user.resident_address.country_id, user.resident_address.city_id) == (2, 101)
+    assert user.other_details.profession == 'Engineer'
+    assert user.referrer.full_name == 'Abdul Kareem' and user.referrer.batch == 'T-05'
+
+    # A second upload of the same registration is rejected: its number and email are taken.
+    again = WaImporter(actor_id=1).run(iter_chat_blocks(export(
+        registration(name='mohammed ali', suffix='43210', email='ali@example.com'))))
+    assert again[0].status == 'rejected'
+    assert again[0].errors == [f'Mobile 919876543210 is already registered (user {user.id})',
+                               f'WhatsApp 919876543210 is already registered (user {user.id})',
+                               f'Email ali@example.com is already registered (user {user.id})']
+
+    for model in (mo.Referrer, mo.OtherDetail, mo.ResidentAddress, mo.HomeAddress, mo.Contact, mo.User):
+        db.session.query(model).delete()
+    db.session.commit()
+
+
+def test_rolled_back_block_is_not_a_duplicate_later(app, geo_rows, registration):
+    importer = WaImporter(actor_id=1, batch_size=1)
+    write = importer._write
+
+    def fail_once(accepted):
+        importer._write = write
+        raise sa.exc.IntegrityError('INSERT', {}, Exception('UNIQUE constraint failed'))
+
+    importer._write = fail_once
+    results = importer.run(iter_chat_blocks(export(
+        registration(name='mohammed ali', suffix='43210', email='ali@example.com'),
+        registration(name='mohammed ali', suffix='43211', email='ali@example.com'))))
+    assert [r.status for r in results] == ['rejected', 'registered']
+    assert 'rolled back' in results[0].errors[0]
+
+    for model in (mo.Referrer, mo.OtherDetail, mo.ResidentAddress, mo.HomeAddress, mo.Contact, mo.User):
+        db.session.query(model).delete()
+    db.session.commit()